@@ -18,13 +18,13 @@ from litex.soc.integration.builder import *
 
 from litedram.modules import MT8JTF12864
 from litedram.phy import s7ddrphy
-from litedram.frontend.dma import LiteDRAMDMAWriter
 
 from liteeth.phy.s7rgmii import LiteEthPHYRGMII
 from liteeth.core import LiteEthUDPIPCore
 from liteeth.frontend.etherbone import LiteEthEtherbone
 
-from liteiclink.transceiver.gtp_7series import GTPQuadPLL, GTP
+from pcie_analyzer.soc import CaptureConfig, PCIeAnalyzerSoC
+from pcie_analyzer.build_cache import BuildCache, cached_vivado_build
 
 # IOs ----------------------------------------------------------------------------------------------
 
@@ -153,8 +153,10 @@ class _CRG(Module):
 
 # PCIe Analyzer ------------------------------------------------------------------------------------
 
-class PCIeAnalyzer(SoCSDRAM):
-    def __init__(self, platform, connector="pcie", linerate=2.5e9):
+class PCIeAnalyzer(SoCSDRAM, PCIeAnalyzerSoC):
+    def __init__(self, platform, connector="pcie", linerate=2.5e9, with_link_health=False,
+        with_ltssm=False, with_latency=False, with_descrambling=False, with_filter=False,
+        with_dram_crc=False):
         assert connector in ["pcie"]
         sys_clk_freq = int(50e6)
 
@@ -229,46 +231,24 @@ class PCIeAnalyzer(SoCSDRAM):
             i_IB    = refclk_pads.n,
             o_O     = refclk)
 
-        # GTP PLL ----------------------------------------------------------------------------------
-        qpll = GTPQuadPLL(refclk, refclk_freq, linerate)
-        print(qpll)
-        self.submodules += qpll
-
         # GTPs -------------------------------------------------------------------------------------
-        for i in range(2):
-            tx_pads = platform.request(connector + "_tx", i)
-            rx_pads = platform.request(connector + "_rx", i)
-            gtp = GTP(qpll, tx_pads, rx_pads, sys_clk_freq,
-                data_width       = 20,
-                clock_aligner    = False,
-                tx_buffer_enable = True,
-                rx_buffer_enable = True)
-            gtp.add_stream_endpoints()
-            setattr(self.submodules, "gtp"+str(i), gtp)
-            platform.add_period_constraint(gtp.cd_tx.clk, 1e9/gtp.tx_clk_freq)
-            platform.add_period_constraint(gtp.cd_rx.clk, 1e9/gtp.rx_clk_freq)
-            self.platform.add_false_path_constraints(
-                self.crg.cd_sys.clk,
-                gtp.cd_tx.clk,
-                gtp.cd_rx.clk)
-
-        # Record -------------------------------------------------------------------------------------
-        self.submodules.rx_dma_recorder = LiteDRAMDMAWriter(
-            self.sdram.crossbar.get_port("write", 32, clock_domain = "gtp0_rx"))
-        self.rx_dma_recorder.add_csr()
-        self.add_csr("rx_dma_recorder")
-
-        self.submodules.tx_dma_recorder = LiteDRAMDMAWriter(
-            self.sdram.crossbar.get_port("write", 32, clock_domain = "gtp1_rx"))
-        self.tx_dma_recorder.add_csr()
-        self.add_csr("tx_dma_recorder")
-
-        self.comb += [
-            self.rx_dma_recorder.sink.valid.eq(self.gtp0.source.valid),
-            self.rx_dma_recorder.sink.data.eq(self.gtp0.source.payload.raw_bits()),
-            self.tx_dma_recorder.sink.valid.eq(self.gtp1.source.valid),
-            self.tx_dma_recorder.sink.data.eq(self.gtp1.source.payload.raw_bits()),
-        ]
+        self.add_gtps(refclk, refclk_freq, linerate, connector=connector)
+
+        # Capture ----------------------------------------------------------------------------------
+        # 2 symbols + ctrl per 32-bit word, DRAM ports in the GTP domains (as raw GTP words).
+        self.add_capture(CaptureConfig(
+            recorders        = {"rx": 0, "tx": 1},
+            descrambling     = with_descrambling,
+            filter           = with_filter,
+            dma_width        = 32,
+            dma_clock_domain = "gtp",
+            link_health      = with_link_health,
+            ltssm            = with_ltssm,
+            latency          = with_latency))
+
+        # DRAM CRC (upload integrity checks) -------------------------------------------------------
+        if with_dram_crc:
+            self.add_dram_crc(data_width=128)
 
 # Build --------------------------------------------------------------------------------------------
 
@@ -276,12 +256,29 @@ def main():
     parser = argparse.ArgumentParser(description="PCIe Analyzer SoC on AC701")
     parser.add_argument("--build", action="store_true", help="Build bitstream")
     parser.add_argument("--load",  action="store_true", help="Load bitstream")
+    parser.add_argument("--build-cache-dir", default=None, help="Reuse bitstreams of identical builds from this directory")
+    parser.add_argument("--with-descrambling", action="store_true", help="Descramble before the recorders (plain captures)")
+    parser.add_argument("--with-filter", action="store_true", help="Enable packet filter before the recorders (plain captures)")
+    parser.add_argument("--with-link-health", action="store_true", help="Enable link health histograms on the GTPs")
+    parser.add_argument("--with-ltssm", action="store_true", help="Enable LTSSM observers on the GTPs (and recorders auto-arm)")
+    parser.add_argument("--with-latency", action="store_true", help="Enable Request to Completion latency monitor")
+    parser.add_argument("--with-dram-crc", action="store_true", help="Enable DRAM CRC unit (verified uploads)")
     args = parser.parse_args()
 
     platform = Platform()
-    soc      = PCIeAnalyzer(platform)
+    soc      = PCIeAnalyzer(platform,
+        with_descrambling = args.with_descrambling,
+        with_filter       = args.with_filter,
+        with_link_health  = args.with_link_health,
+        with_ltssm        = args.with_ltssm,
+        with_latency      = args.with_latency,
+        with_dram_crc     = args.with_dram_crc)
     builder  = Builder(soc, csr_csv="tools/csr.csv")
-    builder.build(run=args.build)
+    soc.generate_capture_layout("tools/capture_layout.json")
+    if args.build and args.build_cache_dir is not None:
+        cached_vivado_build(builder, BuildCache(args.build_cache_dir))
+    else:
+        builder.build(run=args.build)
 
     if args.load:
         prog = soc.platform.create_programmer()
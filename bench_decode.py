@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+from pcie_analyzer.software.capture import CaptureReader, load_capture_layout
+from pcie_analyzer.software.framing import frame_stream
+from pcie_analyzer.software.crc import verify, CRC_OK
+from pcie_analyzer.software.tlp import decode
+from pcie_analyzer.software.pcapng import PcapngWriter
+from pcie_analyzer.software.profiling import Profiler
+from pcie_analyzer.software.traffic import TrafficGenerator, CaptureWriter, error_kinds
+
+# Scenarios ----------------------------------------------------------------------------------------
+
+# Recorded descrambled and without SKPs (gateware Descrambler and SKP removal, 128-bit words).
+plain_layout = dict(word_size=16, symbols_per_word=12, data_offset=0, ctrl_offset=96,
+    sync_offset=108, scrambled=False, skp_removed=True, filtered=False)
+
+# name: (format or layout, TrafficGenerator parameters)
+scenarios = {
+    "netv2"        : ("netv2", {}),
+    "netv2_errors" : ("netv2", {"ecrc_ratio": 0.1, "errors": {kind: 1e-3 for kind in error_kinds}}),
+    "netv2_small"  : ("netv2", {"mix": {"mrd32": 2, "cpld": 2, "dllp": 3}, "max_payload": 16,
+                                "max_read": 16}),
+    "netv2_plain"  : (plain_layout, {}),
+    "ac701"        : ("ac701", {}),
+    "raw20"        : ("raw20", {}),
+}
+
+# Host pipeline stages (SKP Ordered Sets are skipped by the descramble and framing stages).
+stages = ["generate", "read", "unpack", "descramble", "framing", "crc", "decode", "export"]
+
+# Benchmark ----------------------------------------------------------------------------------------
+
+def run_pipeline(filename, format, output, chunk_size):
+    """Read/unpack/descramble/frame/check/decode/export a capture, returns (profiler, results)."""
+    profiler = Profiler()
+    reader   = CaptureReader(filename, format, chunk_size, profiler)
+    writer   = PcapngWriter(output)
+    writer.add_interface(os.path.basename(filename))
+    stats    = {}
+    totals   = {}
+    tlps     = 0
+    fields   = {name: np.zeros(8, dtype=np.int64) for name in ["tc", "attr"]}
+    for offset, data, ctrl, packets in frame_stream(reader, stats, profiler=profiler):
+        with profiler.stage("crc", int(packets["length"].sum())) as stage:
+            status, chunk_totals = verify(data, packets)
+            stage.output(status.nbytes)
+        for name, value in chunk_totals.items():
+            totals[name] = totals.get(name, 0) + value
+        with profiler.stage("decode", packets.nbytes) as stage:
+            table = decode(data, packets)
+            stage.output(table.array.nbytes)
+        tlps += len(table.array)
+        ok    = table.array[status[table.array["packet"]] == CRC_OK]
+        for name in fields:
+            fields[name] += np.bincount(ok[name], minlength=8)
+        times = np.round((offset + packets["offset"])*4.0).astype(np.uint64)
+        with profiler.stage("export", packets.nbytes) as stage:
+            written = writer.written
+            writer.write_packets(data, packets, times, 0, status)
+            stage.output(writer.written - written)
+    with profiler.stage("export"):
+        writer.close()
+    totals.pop("bytes", None)
+    return profiler, dict(stats, crc=totals, tlps=tlps, fields=fields)
+
+def run_scenario(name, format, params, size, runs, seed, chunk_size, directory):
+    label = format if isinstance(format, str) else "layout"
+    if isinstance(format, dict):
+        layout = os.path.join(directory, name + ".json")
+        with open(layout, "w") as f:
+            json.dump({"recorders": {name: format}}, f)
+        format = load_capture_layout(layout)[0]
+    filename = os.path.join(directory, name + ".bin")
+    output   = os.path.join(directory, name + ".pcapng")
+
+    # Generate capture.
+    generator = TrafficGenerator(seed=seed, **params)
+    writer    = CaptureWriter(filename, format, generator)
+    start     = time.perf_counter()
+    writer.write_size(size)
+    writer.close()
+    walls     = {"generate": time.perf_counter() - start}
+    size      = writer.size
+
+    # Decode it (best of runs for each stage).
+    total = None
+    for run in range(runs):
+        start = time.perf_counter()
+        profiler, results = run_pipeline(filename, format, output, chunk_size)
+        elapsed = time.perf_counter() - start
+        total   = elapsed if total is None else min(total, elapsed)
+        for stage in stages[1:]:
+            wall = profiler.stages[stage].wall/1e9 if stage in profiler.stages else None
+            if wall is not None and (stage not in walls or wall < walls[stage]):
+                walls[stage] = wall
+    os.remove(filename)
+    os.remove(output)
+
+    # Decoded packets must match the generated ones.
+    integrity = (
+        results["crc"]     == generator.crc_totals() and
+        results["packets"] == generator.stats["tlps"] + generator.stats["dllps"] and
+        results["tlps"]    == generator.stats["tlps"] - generator.stats["error_truncated"] and
+        all((results["fields"][name] == generator.fields[name]).all() for name in generator.fields) and
+        results["unsynchronized"] == 0 and results["dropped_symbols"] == 0)
+
+    throughput = {stage: size/wall/1e6 for stage, wall in walls.items() if wall}
+    throughput["total"] = size/total/1e6
+    return {
+        "format"     : label,
+        "size"       : size,
+        "packets"    : results["packets"],
+        "throughput" : throughput, # MB/s of capture.
+        "integrity"  : integrity,
+    }
+
+def check_regressions(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ref = baseline[name]
+        for stage, value in result["throughput"].items():
+            if stage in ref["throughput"] and value < ref["throughput"][stage]*(1 - tolerance):
+                regressions.append("{}: {} {:.1f} MB/s < {:.1f} MB/s".format(
+                    name, stage, value, ref["throughput"][stage]))
+        if result["integrity"] is False:
+            regressions.append("{}: decoded packets mismatch".format(name))
+    return regressions
+
+# Run ----------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="PCIe Analyzer Host Decode Benchmark")
+    parser.add_argument("--size",       default=64,   type=float, help="Capture size per scenario in MB")
+    parser.add_argument("--runs",       default=3,    type=int,   help="Decode runs per scenario (best is kept)")
+    parser.add_argument("--seed",       default=0,    type=int,   help="Random seed")
+    parser.add_argument("--scenario",   action="append",          help="Scenario(s) to run (default=all)")
+    parser.add_argument("--chunk-size", default=4*1024*1024, type=int, help="Read chunk size in bytes")
+    parser.add_argument("--directory",  default=None,             help="Directory of the generated captures (default=temporary)")
+    parser.add_argument("--json",       default=None,             help="Dump results to JSON file")
+    parser.add_argument("--baseline",   default=None,             help="Compare results to JSON baseline")
+    parser.add_argument("--tolerance",  default=0.2, type=float,  help="Baseline tolerance")
+    args = parser.parse_args()
+
+    names   = args.scenario or list(scenarios.keys())
+    results = {}
+    with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+        for name in names:
+            format, params = scenarios[name]
+            results[name] = run_scenario(name, format, params, int(args.size*1e6), args.runs,
+                args.seed, args.chunk_size, directory)
+
+    print("{:14s} {:>8s}".format("MB/s", "packets") +
+        "".join(" {:>10s}".format(stage) for stage in stages + ["total"]) + "  integrity")
+    for name, r in results.items():
+        print("{:14s} {:>8d}".format(name, r["packets"]) +
+            "".join(" {:>10.1f}".format(r["throughput"][stage]) if stage in r["throughput"] else
+                    " {:>10s}".format("-") for stage in stages + ["total"]) +
+            "  {}".format("ok" if r["integrity"] else "FAIL"))
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = check_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION: " + regression)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -23,15 +23,15 @@ from litex.soc.cores.freqmeter import FreqMeter
 
 from litedram.modules import K4B2G1646F
 from litedram.phy import s7ddrphy
-from litedram.frontend.dma import LiteDRAMDMAWriter
 
 from liteeth.phy.rmii import LiteEthPHYRMII
 from liteeth.core import LiteEthUDPIPCore
 from liteeth.frontend.etherbone import LiteEthEtherbone
 
-from liteiclink.transceiver.gtp_7series import GTPQuadPLL, GTP
-
 from pcie_analyzer.bist import GTPTXBIST, GTPRXBIST
+from pcie_analyzer.replay import Replay
+from pcie_analyzer.soc import CaptureConfig, PCIeAnalyzerSoC
+from pcie_analyzer.build_cache import BuildCache, cached_vivado_build
 
 # IOs ----------------------------------------------------------------------------------------------
 
@@ -90,7 +90,7 @@ class _CRG(Module):
 
 # PCIe Analyzer ------------------------------------------------------------------------------------
 
-class PCIeAnalyzer(SoCSDRAM):
+class PCIeAnalyzer(SoCSDRAM, PCIeAnalyzerSoC):
     def __init__(self, platform,
         with_cpu           = True,
         with_sdram         = True,
@@ -98,7 +98,14 @@ class PCIeAnalyzer(SoCSDRAM):
         with_gtp           = True, gtp_connector="pcie", gtp_refclk="pcie", gtp_linerate=5e9,
         with_gtp_bist      = True,
         with_gtp_freqmeter = True,
-        with_record        = True):
+        with_record        = True,
+        with_replay        = False,
+        with_link_health   = False,
+        with_ltssm         = False,
+        with_latency       = False,
+        with_descrambling  = False,
+        with_filter        = False,
+        with_dram_crc      = False):
         sys_clk_freq = int(100e6)
 
         # SoCSDRAM ---------------------------------------------------------------------------------
@@ -169,30 +176,9 @@ class PCIeAnalyzer(SoCSDRAM):
                 self.comb += refclk.eq(ClockSignal("clk100"))
                 platform.add_platform_command("set_property SEVERITY {{Warning}} [get_drc_checks REQP-49]")
 
-        # GTP PLL ----------------------------------------------------------------------------------
-        if with_gtp:
-            qpll = GTPQuadPLL(refclk, refclk_freq, gtp_linerate)
-            print(qpll)
-            self.submodules += qpll
-
         # GTPs -------------------------------------------------------------------------------------
         if with_gtp:
-            for i in range(2):
-                tx_pads = platform.request(gtp_connector + "_tx", i)
-                rx_pads = platform.request(gtp_connector + "_rx", i)
-                gtp = GTP(qpll, tx_pads, rx_pads, sys_clk_freq,
-                    data_width       = 20,
-                    clock_aligner    = False,
-                    tx_buffer_enable = True,
-                    rx_buffer_enable = True)
-                gtp.add_stream_endpoints()
-                setattr(self.submodules, "gtp"+str(i), gtp)
-                platform.add_period_constraint(gtp.cd_tx.clk, 1e9/gtp.tx_clk_freq)
-                platform.add_period_constraint(gtp.cd_rx.clk, 1e9/gtp.rx_clk_freq)
-                self.platform.add_false_path_constraints(
-                    self.crg.cd_sys.clk,
-                    gtp.cd_tx.clk,
-                    gtp.cd_rx.clk)
+            self.add_gtps(refclk, refclk_freq, gtp_linerate, connector=gtp_connector)
 
         # GTPs FreqMeters --------------------------------------------------------------------------
         if with_gtp_freqmeter:
@@ -216,30 +202,31 @@ class PCIeAnalyzer(SoCSDRAM):
             self.add_csr("gtp1_tx_bist")
             self.add_csr("gtp1_rx_bist")
 
-        # Record -----------------------------------------------------------------------------------
-        # FIXME: use better data/ctrl packing (or separate recorders)
-        if with_record:
-            # Convert RX stream from 16-bit@250MHz to 64-bit@sys_clk
-            rx_converter = stream.StrideConverter(
-                [("data", 16), ("ctrl",  2)],
-                [("data", 96), ("ctrl", 12)],
-                reverse     = False)
-            rx_converter = ClockDomainsRenamer("gtp0_rx")(rx_converter)
-            self.submodules.rx_converter = rx_converter
-            rx_cdc = stream.AsyncFIFO([("data", 96), ("ctrl", 12)], 8, buffered=True)
-            rx_cdc = ClockDomainsRenamer({"write": "gtp0_rx", "read": "sys"})(rx_cdc)
-            self.submodules.rx_cdc = rx_cdc
-            # RX DMA Recorder
-            self.submodules.rx_dma_recorder = LiteDRAMDMAWriter(self.sdram.crossbar.get_port("write", 128))
-            self.rx_dma_recorder.add_csr()
-            self.add_csr("rx_dma_recorder")
-            self.comb += [
-                gtp.source.connect(rx_converter.sink),
-                rx_converter.source.connect(rx_cdc.sink),
-                self.rx_dma_recorder.sink.valid.eq(rx_cdc.source.valid),
-                self.rx_dma_recorder.sink.data[0:96].eq(rx_cdc.source.data),
-                self.rx_dma_recorder.sink.data[96:108].eq(rx_cdc.source.ctrl),
-            ]
+        # Replay -----------------------------------------------------------------------------------
+        if with_replay:
+            assert not with_gtp_bist # GTP0 TX is shared with the BIST.
+            self.submodules.replay = Replay(
+                port = self.sdram.crossbar.get_port("read", 128),
+                gtp  = self.gtp0,
+                cd   = "gtp0_tx")
+            self.add_csr("replay")
+
+        # Capture ----------------------------------------------------------------------------------
+        # GTP0 RX recorded on a 128-bit DRAM port (12 symbols + ctrl per word) through a CDC FIFO.
+        if with_gtp:
+            self.add_capture(CaptureConfig(
+                recorders        = {"rx": 0} if with_record else {},
+                descrambling     = with_descrambling,
+                filter           = with_filter,
+                dma_width        = 128,
+                dma_clock_domain = "sys",
+                link_health      = with_link_health,
+                ltssm            = with_ltssm,
+                latency          = with_latency))
+
+        # DRAM CRC (upload integrity checks) -------------------------------------------------------
+        if with_dram_crc and not self.integrated_main_ram_size:
+            self.add_dram_crc(data_width=128)
 
 # Build --------------------------------------------------------------------------------------------
 
@@ -247,13 +234,33 @@ def main():
     parser = argparse.ArgumentParser(description="PCIe Analyzer SoC on AC701")
     parser.add_argument("--build", action="store_true", help="Build bitstream")
     parser.add_argument("--load",  action="store_true", help="Load bitstream")
+    parser.add_argument("--build-cache-dir", default=None, help="Reuse bitstreams of identical builds from this directory")
+    parser.add_argument("--with-replay", action="store_true", help="Enable capture replay on GTP0 TX (disables BIST)")
+    parser.add_argument("--with-descrambling", action="store_true", help="Descramble before the RX recorder (plain captures)")
+    parser.add_argument("--with-filter", action="store_true", help="Enable packet filter before the RX recorder (plain captures)")
+    parser.add_argument("--with-link-health", action="store_true", help="Enable link health histograms on the GTPs")
+    parser.add_argument("--with-ltssm", action="store_true", help="Enable LTSSM observers on the GTPs (and recorder auto-arm)")
+    parser.add_argument("--with-latency", action="store_true", help="Enable Request to Completion latency monitor")
+    parser.add_argument("--with-dram-crc", action="store_true", help="Enable DRAM CRC unit (verified uploads)")
     args = parser.parse_args()
 
     platform = netv2.Platform()
     platform.add_extension(_pcie_analyzer_io)
-    soc      = PCIeAnalyzer(platform)
+    soc      = PCIeAnalyzer(platform,
+        with_gtp_bist     = not args.with_replay,
+        with_replay       = args.with_replay,
+        with_descrambling = args.with_descrambling,
+        with_filter       = args.with_filter,
+        with_link_health  = args.with_link_health,
+        with_ltssm        = args.with_ltssm,
+        with_latency      = args.with_latency,
+        with_dram_crc     = args.with_dram_crc)
     builder  = Builder(soc, csr_csv="tools/csr.csv")
-    builder.build(run=args.build)
+    soc.generate_capture_layout("tools/capture_layout.json")
+    if args.build and args.build_cache_dir is not None:
+        cached_vivado_build(builder, BuildCache(args.build_cache_dir))
+    else:
+        builder.build(run=args.build)
 
     if args.load:
         prog = soc.platform.create_programmer()
@@ -0,0 +1,175 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+"""
+Content-hash build cache.
+
+Builds are keyed on the generated sources (Verilog, constraints, build scripts, memory init files),
+the external sources of the platform and the toolchain options/version. When the key is found in
+the cache, Vivado synthesis/implementation or Verilator compilation is skipped and the cached
+bitstream/binary is reused.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import subprocess
+
+# Helpers ------------------------------------------------------------------------------------------
+
+source_extensions = [".v", ".sv", ".vh", ".vhd", ".xdc", ".tcl", ".sh", ".init", ".hex",
+    ".c", ".cpp", ".h", ".mak", ".js", ".json"]
+
+def toolchain_version(command):
+    """Return the version string of a toolchain (None if not installed)."""
+    try:
+        return subprocess.check_output(command, stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def source_files(directory, exclude=["obj_dir", "modules"]):
+    """List the source files of a build directory (relative paths, sorted), build outputs
+    directories excluded."""
+    files = []
+    for root, dirs, filenames in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if d not in exclude and not d.startswith("."))
+        for filename in filenames:
+            if os.path.splitext(filename)[1] in source_extensions:
+                files.append(os.path.relpath(os.path.join(root, filename), directory))
+    return sorted(files)
+
+# Build Cache --------------------------------------------------------------------------------------
+
+class BuildCache:
+    """Build Cache
+
+    Each entry is a `directory`/<key> directory holding the build outputs and a manifest.json.
+    Entries are written to a temporary directory and renamed, so that concurrent builds never see
+    partial entries.
+    """
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory) # Toolchains change the working directory.
+        self.hits      = 0
+        self.misses    = 0
+
+    def key(self, build_dir, extra_files=[], options={}):
+        """Hash the sources of `build_dir`, `extra_files` and the toolchain `options`."""
+        h = hashlib.sha256()
+        h.update(json.dumps(options, sort_keys=True).encode())
+        files  = [(name, os.path.join(build_dir, name)) for name in source_files(build_dir)]
+        files += [(os.path.basename(filename), filename) for filename in sorted(extra_files)]
+        for name, filename in files:
+            h.update(name.encode() + b"\0")
+            with open(filename, "rb") as f:
+                h.update(hashlib.sha256(f.read()).digest())
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def restore(self, key, build_dir):
+        """Copy the cached outputs (files or directories) of `key` to `build_dir`, returns the
+        restored outputs (None on miss)."""
+        path = self.path(key)
+        try:
+            with open(os.path.join(path, "manifest.json")) as f:
+                outputs = json.load(f)["outputs"]
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        for output in outputs:
+            src = os.path.join(path, output)
+            dst = os.path.join(build_dir, output)
+            if os.path.isdir(src):
+                shutil.rmtree(dst, ignore_errors=True)
+                shutil.copytree(src, dst, symlinks=True)
+            else:
+                shutil.copy2(src, dst)
+        self.hits += 1
+        return outputs
+
+    def store(self, key, build_dir, outputs, options={}):
+        """Store the `outputs` (files or directories) of `build_dir` under `key`, missing outputs
+        are skipped."""
+        outputs = [output for output in outputs if os.path.exists(os.path.join(build_dir, output))]
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self.path(key) + ".tmp{}".format(os.getpid())
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for output in outputs:
+            src = os.path.join(build_dir, output)
+            dst = os.path.join(tmp, output)
+            if os.path.isdir(src):
+                shutil.copytree(src, dst, symlinks=True)
+            else:
+                shutil.copy2(src, dst)
+        with open(os.path.join(tmp, "manifest.json"), "w") as f:
+            json.dump({
+                "created" : time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "sources" : source_files(build_dir),
+                "outputs" : outputs,
+                "options" : options,
+            }, f, indent=4)
+        shutil.rmtree(self.path(key), ignore_errors=True)
+        os.rename(tmp, self.path(key))
+
+# Vivado -------------------------------------------------------------------------------------------
+
+def platform_sources(platform):
+    """Sources added to the platform outside of the build directory (ex: CPU Verilog)."""
+    return [os.path.abspath(source[0]) for source in platform.sources if os.path.isfile(source[0])]
+
+def cached_vivado_build(builder, cache, **kwargs):
+    """Generate the sources of `builder` and run the Vivado build script only when they are not
+    in `cache` (bitstream restored otherwise). Returns True on cache hit."""
+    soc = builder.soc
+    builder.build(run=False, **kwargs)
+    build_dir = builder.gateware_dir
+    name      = soc.build_name
+    outputs   = [name + ".bit", name + ".bin"]
+    options   = {
+        "kwargs" : {k: str(v) for k, v in kwargs.items()},
+        "vivado" : toolchain_version(["vivado", "-version"]),
+    }
+    key = cache.key(build_dir, platform_sources(soc.platform), options)
+    restored = cache.restore(key, build_dir)
+    if restored is not None:
+        print("Build cache hit ({}): reusing {}".format(key[:16], ", ".join(restored)))
+        return True
+    print("Build cache miss ({}): running Vivado".format(key[:16]))
+    subprocess.check_call(["bash", "build_" + name + ".sh"], cwd=build_dir)
+    cache.store(key, build_dir, outputs, options)
+    return False
+
+# Verilator ----------------------------------------------------------------------------------------
+
+def cached_verilator_build(builder, cache, run=True, **kwargs):
+    """Generate the sources of the LiteX simulation of `builder` and run the Verilator build script
+    only when they are not in `cache` (binary restored otherwise), then run the simulation. Returns
+    True on cache hit."""
+    from litex.build.sim.verilator import core_directory
+
+    builder.build(run=False, **kwargs)
+    build_dir  = builder.gateware_dir
+    name       = builder.soc.build_name
+    outputs    = ["obj_dir", "modules"]
+    core_files = [os.path.join(core_directory, f) for f in source_files(core_directory, exclude=[])]
+    options    = {
+        "kwargs"    : {k: str(v) for k, v in kwargs.items() if isinstance(v, (bool, int, float, str))},
+        "verilator" : toolchain_version(["verilator", "--version"]),
+    }
+    key = cache.key(build_dir, core_files, options)
+    hit = cache.restore(key, build_dir) is not None
+    if hit:
+        print("Build cache hit ({}): reusing Verilator binary".format(key[:16]))
+    else:
+        print("Build cache miss ({}): running Verilator".format(key[:16]))
+        subprocess.check_call(["bash", "build_" + name + ".sh"], cwd=build_dir)
+        cache.store(key, build_dir, outputs, options)
+    if run:
+        sim_config = kwargs.get("sim_config", None)
+        sudo       = sim_config is not None and sim_config.has_module("ethernet") # TAP interface.
+        subprocess.call((["sudo"] if sudo else []) + [os.path.join("obj_dir", "Vsim")], cwd=build_dir)
+    return hit
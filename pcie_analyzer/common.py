@@ -0,0 +1,10 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+# Constants shared by the gateware and the host software (no Migen dependency).
+
+# SKP Ordered Sets ---------------------------------------------------------------------------------
+
+# Average interval (symbols) between the SKP Ordered Sets transmitted for clock compensation: used
+# by the replay (TXSKPInserter), the capture simulation and the synthetic traffic generator.
+SKP_INTERVAL = 354
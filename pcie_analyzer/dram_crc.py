@@ -0,0 +1,127 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+from migen import *
+
+from litex.soc.interconnect.csr import *
+
+from litedram.frontend.dma import LiteDRAMDMAReader
+
+from liteeth.mac.crc import LiteEthMACCRCEngine
+
+# DRAM CRC -----------------------------------------------------------------------------------------
+
+class DRAMCRC(Module, AutoCSR):
+    """DRAM CRC
+
+    Reads a DRAM region (`base`/`length` in bytes, multiples of the port's word size) at DRAM
+    speed and computes its CRC-32 (IEEE 802.3, same as zlib.crc32 over the bytes of the region) to
+    check uploads integrity without transferring the data twice.
+
+    Along with the CRC of the whole region (`crc`), the CRC-32 of each block of 2^`block_shift`
+    bytes is stored in a table of `nblocks` entries, read with `block_index`/`block_crc`, so that
+    only the blocks that don't match have to be fetched again. `blocks` is the number of blocks of
+    the region (blocks after `nblocks` are not stored).
+
+    Writing `start` computes the CRCs of the region, `done` is set when finished.
+    """
+    def __init__(self, port, nblocks=1024, block_shift=16):
+        data_width = port.data_width
+        word_shift = log2_int(data_width//8)
+
+        self.base        = CSRStorage(32)
+        self.length      = CSRStorage(32)
+        self.block_shift = CSRStorage(5, reset=block_shift)
+        self.start       = CSR()
+        self.done        = CSRStatus()
+        self.crc         = CSRStatus(32)
+        self.blocks      = CSRStatus(32)
+        self.block_index = CSRStorage(bits_for(nblocks - 1))
+        self.block_crc   = CSRStatus(32)
+        self.nblocks     = CSRConstant(nblocks)
+
+        # # #
+
+        init = 2**32 - 1
+
+        # DMA Reader -------------------------------------------------------------------------------
+        self.submodules.dma = dma = LiteDRAMDMAReader(port, fifo_depth=32, fifo_buffered=True)
+
+        length    = Signal(32 - word_shift) # In words.
+        requested = Signal(32 - word_shift)
+        received  = Signal(32 - word_shift)
+        running   = Signal()
+        done      = Signal()
+        self.comb += [
+            length.eq(self.length.storage[word_shift:]),
+            dma.sink.valid.eq(running & (requested != length)),
+            dma.sink.address.eq(self.base.storage[word_shift:] + requested),
+            dma.source.ready.eq(1),
+            self.done.status.eq(done),
+        ]
+        self.sync += [
+            If(self.start.re,
+                running.eq(1),
+                done.eq(0),
+                requested.eq(0)
+            ).Elif(running & (received == length),
+                running.eq(0),
+                done.eq(1)
+            ).Elif(dma.sink.valid & dma.sink.ready,
+                requested.eq(requested + 1)
+            )
+        ]
+
+        # CRCs (one word per cycle) ----------------------------------------------------------------
+        region_engine = LiteEthMACCRCEngine(data_width, 32, 0x04c11db7)
+        block_engine  = LiteEthMACCRCEngine(data_width, 32, 0x04c11db7)
+        self.submodules += region_engine, block_engine
+        region_crc = Signal(32, reset=init)
+        block_crc  = Signal(32, reset=init)
+        block      = Signal(32)
+        self.comb += [
+            region_engine.data.eq(dma.source.data),
+            region_engine.crc_prev.eq(region_crc),
+            block_engine.data.eq(dma.source.data),
+            block_engine.crc_prev.eq(block_crc),
+            self.crc.status.eq(~region_crc[::-1]),
+            self.blocks.status.eq(block),
+        ]
+
+        # Last word of a block or of the region.
+        block_mask = Signal(32 - word_shift)
+        block_end  = Signal()
+        self.comb += [
+            block_mask.eq((1 << (self.block_shift.storage - word_shift)) - 1),
+            block_end.eq((((received + 1) & block_mask) == 0) | (received + 1 == length)),
+        ]
+        self.sync += [
+            If(self.start.re,
+                region_crc.eq(init),
+                block_crc.eq(init),
+                received.eq(0),
+                block.eq(0)
+            ).Elif(dma.source.valid,
+                received.eq(received + 1),
+                region_crc.eq(region_engine.crc_next),
+                If(block_end,
+                    block_crc.eq(init),
+                    block.eq(block + 1)
+                ).Else(
+                    block_crc.eq(block_engine.crc_next)
+                )
+            )
+        ]
+
+        # Block CRCs table -------------------------------------------------------------------------
+        mem = Memory(32, nblocks)
+        wr  = mem.get_port(write_capable=True)
+        rd  = mem.get_port()
+        self.specials += mem, wr, rd
+        self.comb += [
+            wr.adr.eq(block),
+            wr.dat_w.eq(~block_engine.crc_next[::-1]),
+            wr.we.eq(dma.source.valid & block_end & (block < nblocks)),
+            rd.adr.eq(self.block_index.storage),
+            self.block_crc.status.eq(rd.dat_r),
+        ]
@@ -0,0 +1,315 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+from functools import reduce
+from operator import add
+
+from migen import *
+
+from litex.soc.interconnect.csr import *
+from litex.soc.interconnect import stream
+
+from pcie_analyzer.rx_skp_remover import RXSKPRemover
+from pcie_analyzer.scrambling import Descrambler
+from pcie_analyzer.packet_filter import PacketParser
+from pcie_analyzer.link_health import Histogram
+
+# Layouts ------------------------------------------------------------------------------------------
+
+latency_event_layout = [
+    ("completion",   1), # 0: Non-Posted Request, 1: Completion.
+    ("final",        1), # Last Completion of the Request.
+    ("requester_id", 16),
+    ("tag",          8),
+]
+
+# TLP Events ---------------------------------------------------------------------------------------
+
+class TLPEvents(Module):
+    """TLP Events
+
+    Observes the RX stream of a GTP (always accepted, the observed stream is not altered) and
+    extracts Non-Posted Requests (Memory Read, IO, Configuration) and Completions (`source`).
+    """
+    def __init__(self, data_width=16):
+        self.sink   = sink   = stream.Endpoint([("data", data_width), ("ctrl", data_width//8)])
+        self.source = source = stream.Endpoint(latency_event_layout)
+
+        # # #
+
+        # Observe as 32-bit: Descrambler -> RXSKPRemover -> PacketParser ---------------------------
+        converter = stream.StrideConverter(
+            [("data", data_width), ("ctrl", data_width//8)],
+            [("data",         32), ("ctrl",              4)],
+            reverse = False)
+        descrambler = Descrambler()
+        skp_remover = RXSKPRemover()
+        parser      = PacketParser()
+        self.submodules += converter, descrambler, skp_remover, parser
+        self.comb += [
+            sink.connect(converter.sink, omit={"ready"}),
+            converter.source.connect(descrambler.sink),
+            descrambler.source.connect(skp_remover.sink),
+            skp_remover.source.connect(parser.sink),
+        ]
+
+        # Header fields ----------------------------------------------------------------------------
+        hdr = parser.symbols[2:] # Sequence Number excluded.
+        fmt = hdr[0][5:8]
+        typ = hdr[0][0:5]
+
+        non_posted = Signal()
+        completion = Signal()
+        self.comb += [
+            non_posted.eq(
+                ((typ[1:5] == 0b0000) & ~fmt[1]) | # MRd/MRdLk.
+                (typ == 0b00010)                 | # IORd/IOWr.
+                (typ[1:5] == 0b0010)),             # CfgRd/CfgWr.
+            completion.eq(typ[1:5] == 0b0101),     # Cpl/CplD/CplLk/CplDLk.
+        ]
+
+        # Last Completion: no data, unsuccessful or Byte Count within the payload.
+        length     = Signal(11)
+        byte_count = Signal(13)
+        final      = Signal()
+        self.comb += [
+            length.eq(Mux(Cat(hdr[3], hdr[2][0:2]) == 0, 1024, Cat(hdr[3], hdr[2][0:2]))),
+            byte_count.eq(Mux(Cat(hdr[7], hdr[6][0:4]) == 0, 4096, Cat(hdr[7], hdr[6][0:4]))),
+            final.eq(~fmt[1] | (hdr[6][5:8] != 0) | (byte_count + hdr[11][0:2] <= 4*length)),
+        ]
+
+        # Events -----------------------------------------------------------------------------------
+        self.comb += [
+            source.valid.eq(parser.decide & ~parser.truncated & ~parser.dllp &
+                (non_posted | completion)),
+            source.completion.eq(completion),
+            source.final.eq(final),
+            If(completion,
+                source.requester_id.eq(Cat(hdr[9], hdr[8])),
+                source.tag.eq(hdr[10])
+            ).Else(
+                source.requester_id.eq(Cat(hdr[5], hdr[4])),
+                source.tag.eq(hdr[6])
+            )
+        ]
+
+# Latency Monitor ----------------------------------------------------------------------------------
+
+class LatencyMonitor(Module, AutoCSR):
+    """Request -> Completion Latency Monitor
+
+    Observes the RX streams of the two directions of the link (`cds`, GTP RX domains) and measures
+    the latency of Non-Posted Requests, without recording any traffic.
+
+    Requests are stored in a table of `ntags` outstanding Requests (Requester ID, Tag, direction and
+    timestamp). A Completion seen in the other direction with the same Requester ID/Tag gives the
+    latency (first Completion of split Completions), the entry is freed on the last Completion.
+    Requests of a direction are only tracked when its bit is set in `directions`.
+
+    Latencies are in sys clock cycles (events are timestamped when received in the sys domain) and
+    are counted in a BRAM histogram of `nbins` bins of 2^`shift` cycles, the last bin also counts
+    longer latencies. Writing `snapshot` freezes the histogram and latches the latency min/max/
+    count/sum and the max number of outstanding Requests since the previous snapshot, then
+    restarts from 0. The frozen histogram is read with `index` and `value`.
+
+    Entries without Completion for more than `timeout` cycles are freed (0: never). `requests`,
+    `completions`, `unexpected` (no matching Request), `replaced` (Request with the Requester ID/Tag
+    of an outstanding Request), `overflows` (table full) and `timeouts` count the events.
+    """
+    def __init__(self, cds, data_width=16, ntags=32, nbins=64, shift=3, timestamp_width=32):
+        assert len(cds) == 2
+        self.sinks = []
+
+        self.directions      = CSRStorage(2, reset=0b11)
+        self.timeout         = CSRStorage(timestamp_width)
+        self.shift           = CSRStorage(5, reset=shift)
+        self.snapshot        = CSR()
+        self.index           = CSRStorage(bits_for(nbins - 1))
+        self.value           = CSRStatus(32)
+        self.latency_min     = CSRStatus(timestamp_width)
+        self.latency_max     = CSRStatus(timestamp_width)
+        self.latency_count   = CSRStatus(32)
+        self.latency_sum     = CSRStatus(64)
+        self.outstanding     = CSRStatus(bits_for(ntags))
+        self.outstanding_max = CSRStatus(bits_for(ntags))
+        self.requests        = CSRStatus(32)
+        self.completions     = CSRStatus(32)
+        self.unexpected      = CSRStatus(32)
+        self.replaced        = CSRStatus(32)
+        self.overflows       = CSRStatus(32)
+        self.timeouts        = CSRStatus(32)
+        self.ntags           = CSRConstant(ntags)
+        self.nbins           = CSRConstant(nbins)
+
+        # # #
+
+        # Events of each direction (GTP RX domain -> sys) ------------------------------------------
+        fifos = []
+        for cd in cds:
+            events = ClockDomainsRenamer(cd)(TLPEvents(data_width))
+            # At most one event every 5 words (20 symbols): never overflows with sys >= 25MHz.
+            fifo   = stream.AsyncFIFO(latency_event_layout, 16)
+            fifo   = ClockDomainsRenamer({"write": cd, "read": "sys"})(fifo)
+            self.submodules += events, fifo
+            self.comb += events.source.connect(fifo.sink)
+            self.sinks.append(events.sink)
+            fifos.append(fifo)
+
+        # Timestamp --------------------------------------------------------------------------------
+        now = Signal(timestamp_width)
+        self.sync += now.eq(now + 1)
+
+        # Event selection (round-robin) ------------------------------------------------------------
+        sel  = Signal()
+        last = Signal()
+        self.comb += [
+            sel.eq(fifos[1].source.valid & (~fifos[0].source.valid | ~last)),
+            fifos[0].source.ready.eq(~sel),
+            fifos[1].source.ready.eq(sel),
+        ]
+        ev           = Record(latency_event_layout)
+        ev_valid     = Signal()
+        ev_direction = Signal()
+        ev_time      = Signal(timestamp_width)
+        self.sync += [
+            ev_valid.eq(fifos[0].source.valid | fifos[1].source.valid),
+            ev.raw_bits().eq(Mux(sel,
+                fifos[1].source.payload.raw_bits(),
+                fifos[0].source.payload.raw_bits())),
+            ev_direction.eq(sel),
+            ev_time.eq(now),
+            If(fifos[0].source.valid | fifos[1].source.valid,
+                last.eq(sel)
+            )
+        ]
+
+        # Outstanding Requests table ---------------------------------------------------------------
+        valid      = Signal(ntags)
+        answered   = Signal(ntags)
+        rids       = Array(Signal(16)              for i in range(ntags))
+        tags       = Array(Signal(8)               for i in range(ntags))
+        directions = Array(Signal()                for i in range(ntags))
+        timestamps = Array(Signal(timestamp_width) for i in range(ntags))
+
+        # Matching entry (same direction for Requests, other direction for Completions) and first
+        # free entry.
+        match       = Signal()
+        match_index = Signal(max=ntags)
+        free        = Signal()
+        free_index  = Signal(max=ntags)
+        for i in reversed(range(ntags)):
+            self.comb += [
+                If(valid[i] & (rids[i] == ev.requester_id) & (tags[i] == ev.tag) &
+                    (directions[i] == (ev_direction ^ ev.completion)),
+                    match.eq(1),
+                    match_index.eq(i)
+                ),
+                If(~valid[i],
+                    free.eq(1),
+                    free_index.eq(i)
+                )
+            ]
+
+        # Timeout scan (one entry per cycle).
+        scan        = Signal(max=ntags)
+        scan_expire = Signal()
+        self.sync += scan.eq(Mux(scan == ntags - 1, 0, scan + 1))
+        self.comb += scan_expire.eq((self.timeout.storage != 0) & (valid >> scan)[0] &
+            (now - timestamps[scan] > self.timeout.storage))
+
+        # Update.
+        request = Signal()
+        insert  = Signal()
+        index   = Signal(max=ntags)
+        measure = Signal()
+        release = Signal()
+        expire  = Signal()
+        latency = Signal(timestamp_width)
+        self.comb += [
+            request.eq(ev_valid & ~ev.completion & (self.directions.storage >> ev_direction)[0]),
+            insert.eq(request & (match | free)),
+            index.eq(Mux(match, match_index, free_index)),
+            measure.eq(ev_valid & ev.completion & match & ~(answered >> match_index)[0]),
+            release.eq(ev_valid & ev.completion & match & ev.final),
+            expire.eq(scan_expire & ~(ev_valid & (match | insert) & (index == scan))),
+            latency.eq(ev_time - timestamps[match_index]),
+        ]
+        self.sync += [
+            If(insert,
+                rids[index].eq(ev.requester_id),
+                tags[index].eq(ev.tag),
+                directions[index].eq(ev_direction),
+                timestamps[index].eq(ev_time),
+                answered.eq(answered & ~(1 << index))
+            ),
+            If(measure,
+                answered.eq(answered | (1 << match_index))
+            ),
+            valid.eq((valid & ~(release << match_index) & ~(expire << scan)) | (insert << index)),
+            If(expire,
+                self.timeouts.status.eq(self.timeouts.status + 1)
+            ),
+            If(request,
+                self.requests.status.eq(self.requests.status + 1),
+                If(match,
+                    self.replaced.status.eq(self.replaced.status + 1)
+                ).Elif(~free,
+                    self.overflows.status.eq(self.overflows.status + 1)
+                )
+            ),
+            If(ev_valid & ev.completion,
+                self.completions.status.eq(self.completions.status + 1),
+                If(~match,
+                    self.unexpected.status.eq(self.unexpected.status + 1)
+                )
+            )
+        ]
+
+        # Outstanding Requests.
+        self.sync += self.outstanding.status.eq(reduce(add, [valid[i] for i in range(ntags)]))
+
+        # Histogram / Statistics -------------------------------------------------------------------
+        self.submodules.histogram = histogram = Histogram(nbins)
+        bank    = Signal()
+        bin     = Signal(timestamp_width)
+        self.comb += [
+            histogram.bank.eq(bank),
+            histogram.index.eq(self.index.storage),
+            self.value.status.eq(histogram.value),
+            bin.eq(latency >> self.shift.storage),
+        ]
+        self.sync += [
+            histogram.strobe.eq(measure),
+            histogram.bin.eq(Mux(bin < nbins - 1, bin, nbins - 1)),
+        ]
+
+        latency_min     = Signal(timestamp_width, reset=2**timestamp_width - 1)
+        latency_max     = Signal(timestamp_width)
+        latency_count   = Signal(32)
+        latency_sum     = Signal(64)
+        outstanding_max = Signal(bits_for(ntags))
+        self.sync += [
+            If(self.snapshot.re,
+                bank.eq(~bank),
+                self.latency_min.status.eq(latency_min),
+                self.latency_max.status.eq(latency_max),
+                self.latency_count.status.eq(latency_count),
+                self.latency_sum.status.eq(latency_sum),
+                self.outstanding_max.status.eq(outstanding_max),
+                latency_min.eq(latency_min.reset),
+                latency_max.eq(0),
+                latency_count.eq(0),
+                latency_sum.eq(0),
+                outstanding_max.eq(0)
+            ).Else(
+                If(measure,
+                    If(latency < latency_min, latency_min.eq(latency)),
+                    If(latency > latency_max, latency_max.eq(latency)),
+                    latency_count.eq(latency_count + 1),
+                    latency_sum.eq(latency_sum + latency)
+                ),
+                If(self.outstanding.status > outstanding_max,
+                    outstanding_max.eq(self.outstanding.status)
+                )
+            )
+        ]
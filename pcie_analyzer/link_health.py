@@ -0,0 +1,217 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+from migen import *
+from migen.genlib.cdc import MultiReg, PulseSynchronizer
+
+from litex.soc.interconnect.csr import *
+from litex.soc.interconnect import stream
+
+from pcie_analyzer.rx_skp_remover import RXSKPRemover
+from pcie_analyzer.scrambling import Descrambler
+
+# Helpers ------------------------------------------------------------------------------------------
+
+def gtp_rx_buffer_status(gtp):
+    """Return the RXBUFSTATUS output of a liteiclink GTP (left open by liteiclink, rx domain).
+
+    0b000: nominal, 0b001: SKPs removed, 0b010: SKPs added, 0b101: underflow, 0b110: overflow.
+    """
+    status = Signal(3)
+    if hasattr(gtp, "gtp_params"):
+        # GTPE2_CHANNEL instantiated at finalization.
+        gtp.gtp_params["o_RXBUFSTATUS"] = status
+    else:
+        for special in gtp._fragment.specials:
+            if isinstance(special, Instance) and special.of == "GTPE2_CHANNEL":
+                for item in special.items:
+                    if isinstance(item, Instance.Output) and item.name == "RXBUFSTATUS":
+                        item.expr = status
+    return status
+
+# Histogram ----------------------------------------------------------------------------------------
+
+class Histogram(Module):
+    """BRAM Histogram
+
+    Counts `strobe` events in `nbins` bins (`bin`) in `cd`. The BRAM holds two banks: events are
+    counted in the active bank (`bank`) while the other one is frozen for readout (`index`/`value`,
+    sys domain). Banks are cleared lazily with a valid bit per bin when they become active.
+
+    Counting is a read-modify-write pipelined over two cycles with forwarding, so that an event can
+    be counted every cycle.
+    """
+    def __init__(self, nbins, cd="sys", count_width=32):
+        self.strobe = Signal()
+        self.bin    = Signal(max=nbins)
+        self.bank   = Signal() # Active bank (cd).
+        self.index  = Signal(max=nbins)
+        self.value  = Signal(count_width)
+
+        # # #
+
+        mem = Memory(count_width, 2*nbins)
+        rd  = mem.get_port(clock_domain=cd)
+        wr  = mem.get_port(write_capable=True, clock_domain=cd)
+        out = mem.get_port(clock_domain="sys")
+        self.specials += mem, rd, wr, out
+        sync = getattr(self.sync, cd)
+
+        # Valid bits of each bank, cleared when the bank becomes active.
+        valid = Array(Signal(nbins) for i in range(2))
+        bank  = Signal()
+        sync += bank.eq(self.bank)
+        sync += If(bank != self.bank, valid[self.bank].eq(0))
+
+        # Stage 0: read the bin.
+        s1_valid = Signal()
+        s1_bin   = Signal(max=nbins)
+        s1_bank  = Signal()
+        self.comb += rd.adr.eq(Cat(self.bin, self.bank))
+        sync += [
+            s1_valid.eq(self.strobe),
+            s1_bin.eq(self.bin),
+            s1_bank.eq(self.bank),
+        ]
+
+        # Stage 1: increment (forwarding the previous write) and write the bin.
+        s2_valid = Signal()
+        s2_bin   = Signal(max=nbins)
+        s2_bank  = Signal()
+        s2_count = Signal(count_width)
+        count    = Signal(count_width)
+        self.comb += [
+            If(s2_valid & (s2_bin == s1_bin) & (s2_bank == s1_bank),
+                count.eq(s2_count + 1)
+            ).Elif((valid[s1_bank] >> s1_bin)[0],
+                count.eq(rd.dat_r + 1)
+            ).Else(
+                count.eq(1)
+            ),
+            wr.adr.eq(Cat(s1_bin, s1_bank)),
+            wr.dat_w.eq(count),
+            wr.we.eq(s1_valid),
+        ]
+        sync += [
+            s2_valid.eq(s1_valid),
+            s2_bin.eq(s1_bin),
+            s2_bank.eq(s1_bank),
+            s2_count.eq(count),
+            If(s1_valid,
+                valid[s1_bank].eq(valid[s1_bank] | (1 << s1_bin))
+            )
+        ]
+
+        # Readout of the frozen bank (valid bits are static while frozen).
+        frozen_bank  = Signal()
+        frozen_valid = Signal(nbins)
+        valid_cd     = Signal(nbins)
+        self.comb += valid_cd.eq(valid[~self.bank])
+        self.specials += [
+            MultiReg(~self.bank, frozen_bank,  "sys"),
+            MultiReg(valid_cd,   frozen_valid, "sys"),
+        ]
+        index = Signal(max=nbins)
+        self.comb += out.adr.eq(Cat(self.index, frozen_bank))
+        self.sync += index.eq(self.index)
+        self.comb += If((frozen_valid >> index)[0], self.value.eq(out.dat_r))
+
+# Link Health --------------------------------------------------------------------------------------
+
+class LinkHealth(Module, AutoCSR):
+    """Link Health Monitor
+
+    Observes the RX stream of a GTP (always accepted, the observed stream is not altered) and keeps
+    link-layer health histograms in BRAM, without recording any traffic:
+    - SKP: interval (in symbols) between SKP Ordered Sets, to be compared with the 354-symbol
+      nominal to detect clock compensation issues (`RXSKPRemover.skip`).
+    - COM: interval (in symbols) between Descrambler resynchronizations on COM (`resync`).
+    - Buffer: GTP elastic-buffer status (RXBUFSTATUS) of each cycle where it is not nominal.
+
+    Interval bins are `bin_width` symbols wide (power of 2), the last bin also counts longer
+    intervals.
+
+    Writing `snapshot` freezes all the histograms at once (bank swap, `bank` toggles when done) and
+    restarts counting from 0. The frozen histograms are then read with `select` (0: SKP, 1: COM,
+    2: Buffer), `index` and `value`.
+    """
+    def __init__(self, cd, data_width=16, buffer_status=None, nbins=64, bin_width=16):
+        self.sink = sink = stream.Endpoint([("data", data_width), ("ctrl", data_width//8)])
+
+        self.snapshot  = CSR()
+        self.bank      = CSRStatus()
+        self.select    = CSRStorage(2)
+        self.index     = CSRStorage(bits_for(nbins - 1))
+        self.value     = CSRStatus(32)
+        self.nbins     = CSRConstant(nbins)
+        self.bin_width = CSRConstant(bin_width)
+
+        # # #
+
+        sync = getattr(self.sync, cd)
+
+        # Observe as 32-bit: RXSKPRemover (SKP strobe) -> Descrambler (COM resync strobe) ---------
+        converter = stream.StrideConverter(
+            [("data", data_width), ("ctrl", data_width//8)],
+            [("data",         32), ("ctrl",              4)],
+            reverse = False)
+        converter    = ClockDomainsRenamer(cd)(converter)
+        skp_remover  = ClockDomainsRenamer(cd)(RXSKPRemover())
+        descrambler  = ClockDomainsRenamer(cd)(Descrambler())
+        self.submodules += converter, skp_remover, descrambler
+        self.comb += [
+            sink.connect(converter.sink, omit={"ready"}),
+            converter.source.connect(skp_remover.sink),
+            skp_remover.source.connect(descrambler.sink),
+            descrambler.source.ready.eq(1),
+        ]
+
+        # Snapshot (bank swap) ---------------------------------------------------------------------
+        bank = Signal()
+        self.submodules.ps = ps = PulseSynchronizer("sys", cd)
+        self.comb += ps.i.eq(self.snapshot.re)
+        sync += If(ps.o, bank.eq(~bank))
+        self.specials += MultiReg(bank, self.bank.status, "sys")
+
+        # Histograms -------------------------------------------------------------------------------
+        histograms = []
+        def histogram(nbins):
+            h = Histogram(nbins, cd)
+            self.submodules += h
+            self.comb += h.bank.eq(bank)
+            self.comb += h.index.eq(self.index.storage)
+            histograms.append(h)
+            return h
+
+        skp = histogram(nbins)
+        com = histogram(nbins)
+        for h, word, event in [
+            (skp, skp_remover.sink.valid & skp_remover.sink.ready, skp_remover.skip),
+            (com, descrambler.sink.valid,                          descrambler.resync)]:
+            # Symbols since the last event (saturated to the last bin).
+            count = Signal(max=nbins*bin_width + 1)
+            last  = Signal()
+            seen  = Signal()
+            sync += [
+                h.strobe.eq(0),
+                If(word,
+                    last.eq(event),
+                    If(event & ~last,
+                        seen.eq(1),
+                        h.strobe.eq(seen),
+                        h.bin.eq(count[log2_int(bin_width):]),
+                        count.eq(4)
+                    ).Elif(count < (nbins - 1)*bin_width,
+                        count.eq(count + 4)
+                    )
+                )
+            ]
+
+        buf = histogram(8)
+        if buffer_status is not None:
+            sync += [
+                buf.strobe.eq(sink.valid & (buffer_status != 0b000)),
+                buf.bin.eq(buffer_status),
+            ]
+
+        self.comb += self.value.status.eq(Array(h.value for h in histograms)[self.select.storage])
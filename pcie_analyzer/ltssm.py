@@ -0,0 +1,274 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+from functools import reduce
+from operator import and_
+
+from migen import *
+from migen.genlib.cdc import MultiReg
+
+from litex.soc.interconnect.csr import *
+from litex.soc.interconnect import stream
+
+# Helpers ------------------------------------------------------------------------------------------
+
+def K(x, y):
+    """K code generator ex: K(28, 5) is COM Symbol"""
+    return (y << 5) | x
+
+COM = K(28, 5)
+SKP = K(28, 0)
+FTS = K(28, 1)
+IDL = K(28, 3)
+EIE = K(28, 7)
+PAD = K(23, 7)
+STP = K(27, 7)
+SDP = K(28, 2)
+
+TS1_ID = 0x4a # D10.2
+TS2_ID = 0x45 # D5.2
+
+# LTSSM States -------------------------------------------------------------------------------------
+
+LTSSM_DETECT          = 0
+LTSSM_POLLING         = 1
+LTSSM_CONFIGURATION   = 2
+LTSSM_L0              = 3
+LTSSM_RECOVERY        = 4
+LTSSM_ELECTRICAL_IDLE = 5 # L0s/L1/L2 (not distinguishable from one direction).
+LTSSM_L0S_EXIT        = 6 # FTS after Electrical Idle.
+
+ltssm_state_names = {
+    LTSSM_DETECT          : "Detect",
+    LTSSM_POLLING         : "Polling",
+    LTSSM_CONFIGURATION   : "Configuration",
+    LTSSM_L0              : "L0",
+    LTSSM_RECOVERY        : "Recovery",
+    LTSSM_ELECTRICAL_IDLE : "ElectricalIdle",
+    LTSSM_L0S_EXIT        : "L0sExit",
+}
+
+# LTSSM Observer -----------------------------------------------------------------------------------
+
+class LTSSMObserver(Module, AutoCSR):
+    """LTSSM Observer
+
+    This module observes the RX stream of a GTP (symbols of a x1 link, `data_width//8` symbols per
+    cycle, always accepted) and recognizes the Ordered Sets sent during link training and power
+    management: TS1/TS2 (with their Link/Lane Numbers, N_FTS, Data Rate Identifier and Training
+    Control fields), EIOS, EIEOS, FTS and SKP. Ordered Sets are searched at every symbol position in
+    a sliding window of the last 16 symbols, so no alignment is assumed.
+
+    The link state is tracked from the Ordered Sets seen:
+    - TS1/TS2 with PAD Link Number: Polling, with a Link Number: Configuration (Recovery if the link
+      was up).
+    - Logical Idle/data (32 symbols without COM) after Configuration/Recovery/FTS: L0.
+    - EIOS: Electrical Idle, FTS: L0s exit.
+
+    Each state change is stored as a compact event (cycle timestamp, previous/new state, Link/Lane
+    Numbers and Data Rate Identifier of the last TS) in a FIFO read over CSRs (`event_*`) instead of
+    recording the training symbols.
+
+    Auto-arm: when `trigger_enable` is set, `trigger` (cd) stays low until the link enters one of the
+    states of `trigger_mask` (ex: L0 or Recovery), then stays high until `trigger_enable` is written
+    again. `trigger` is high when `trigger_enable` is not set. It is used to gate the recorder.
+    """
+    def __init__(self, cd, data_width=16, events_depth=16):
+        self.sink    = sink = stream.Endpoint([("data", data_width), ("ctrl", data_width//8)])
+        self.trigger = Signal() # cd.
+
+        self.state          = CSRStatus(3)
+        self.link           = CSRStatus(8)
+        self.lane           = CSRStatus(8)
+        self.n_fts          = CSRStatus(8)
+        self.rate           = CSRStatus(8)
+        self.control        = CSRStatus(8)
+        self.ts1_count      = CSRStatus(32)
+        self.ts2_count      = CSRStatus(32)
+        self.eios_count     = CSRStatus(32)
+        self.eieos_count    = CSRStatus(32)
+        self.fts_count      = CSRStatus(32)
+        self.skp_count      = CSRStatus(32)
+        self.trigger_enable = CSRStorage()
+        self.trigger_mask   = CSRStorage(8)
+        self.triggered      = CSRStatus()
+        self.event_valid    = CSRStatus()
+        self.event_time     = CSRStatus(32)
+        self.event_data     = CSRStatus(32, fields=[
+            CSRField("previous", size=3, offset=0),
+            CSRField("state",    size=3, offset=4),
+            CSRField("link",     size=8, offset=8),
+            CSRField("lane",     size=8, offset=16),
+            CSRField("rate",     size=8, offset=24),
+        ])
+        self.event_next     = CSR()
+        self.event_dropped  = CSRStatus(32)
+
+        # # #
+
+        n    = data_width//8
+        sync = getattr(self.sync, cd)
+
+        # Sliding window: 15 previous symbols + the n symbols of the cycle -------------------------
+        history_data = [Signal(8) for i in range(15)]
+        history_ctrl = [Signal()  for i in range(15)]
+        data = history_data + [sink.data[8*i:8*(i+1)] for i in range(n)]
+        ctrl = history_ctrl + [sink.ctrl[i]           for i in range(n)]
+        window = list(zip(data, ctrl))
+        sync += If(sink.valid, [history_data[i].eq(data[i + n]) for i in range(15)])
+        sync += If(sink.valid, [history_ctrl[i].eq(ctrl[i + n]) for i in range(15)])
+
+        def k(symbol, value):
+            return symbol[1] & (symbol[0] == value)
+
+        def d(symbol, value):
+            return ~symbol[1] & (symbol[0] == value)
+
+        # Ordered Sets ending on each symbol of the cycle ------------------------------------------
+        ts1   = Signal()
+        ts2   = Signal()
+        eios  = Signal()
+        eieos = Signal()
+        fts   = Signal()
+        skp   = Signal()
+        pkt   = Signal()
+        com   = Signal()
+        fields = [Signal(8) for i in range(5)] # Link, Lane, N_FTS, Rate, Control.
+        pad    = Signal() # PAD Link Number.
+        for i in range(n):
+            ts = window[i:i + 16]
+            os = window[i + 12:i + 16]
+            def ordered_set(value):
+                return reduce(and_, [k(os[0], COM)] + [k(s, value) for s in os[1:]])
+            is_ts1 = k(ts[0], COM) & reduce(and_, [d(s, TS1_ID) for s in ts[6:]])
+            is_ts2 = k(ts[0], COM) & reduce(and_, [d(s, TS2_ID) for s in ts[6:]])
+            self.comb += [
+                If(is_ts1 | is_ts2,
+                    [fields[j].eq(ts[1 + j][0]) for j in range(5)],
+                    pad.eq(k(ts[1], PAD))
+                ),
+                If(sink.valid,
+                    If(is_ts1, ts1.eq(1)),
+                    If(is_ts2, ts2.eq(1)),
+                    If(ordered_set(IDL), eios.eq(1)),
+                    If(ordered_set(EIE), eieos.eq(1)),
+                    If(ordered_set(FTS), fts.eq(1)),
+                    If(ordered_set(SKP), skp.eq(1)),
+                    If(k(os[3], STP) | k(os[3], SDP), pkt.eq(1)),
+                    If(k(os[3], COM), com.eq(1)),
+                )
+            ]
+
+        # Last TS fields ---------------------------------------------------------------------------
+        link     = Signal(8)
+        lane     = Signal(8)
+        n_fts    = Signal(8)
+        rate     = Signal(8)
+        control  = Signal(8)
+        sync += If(ts1 | ts2,
+            link.eq(fields[0]),
+            lane.eq(fields[1]),
+            n_fts.eq(fields[2]),
+            rate.eq(fields[3]),
+            control.eq(fields[4]),
+        )
+
+        # Symbols since last COM (Logical Idle/data detection) -------------------------------------
+        idle = Signal(max=64)
+        sync += If(sink.valid,
+            If(com,
+                idle.eq(0)
+            ).Elif(idle < 32,
+                idle.eq(idle + n)
+            )
+        )
+
+        # State tracking ---------------------------------------------------------------------------
+        state      = Signal(3, reset=LTSSM_DETECT)
+        next_state = Signal(3)
+        self.comb += [
+            next_state.eq(state),
+            If(ts1 | ts2,
+                If(pad,
+                    next_state.eq(LTSSM_POLLING)
+                ).Elif((state == LTSSM_L0) | (state == LTSSM_RECOVERY) |
+                       (state == LTSSM_ELECTRICAL_IDLE) | (state == LTSSM_L0S_EXIT),
+                    next_state.eq(LTSSM_RECOVERY)
+                ).Else(
+                    next_state.eq(LTSSM_CONFIGURATION)
+                )
+            ).Elif(eios,
+                next_state.eq(LTSSM_ELECTRICAL_IDLE)
+            ).Elif(fts & (state == LTSSM_ELECTRICAL_IDLE),
+                next_state.eq(LTSSM_L0S_EXIT)
+            ).Elif((pkt | (idle >= 32)) &
+                   ((state == LTSSM_CONFIGURATION) | (state == LTSSM_RECOVERY) |
+                    (state == LTSSM_L0S_EXIT)),
+                next_state.eq(LTSSM_L0)
+            )
+        ]
+        sync += state.eq(next_state)
+
+        # Counters ---------------------------------------------------------------------------------
+        for event, csr in [(ts1, self.ts1_count), (ts2, self.ts2_count), (eios, self.eios_count),
+                           (eieos, self.eieos_count), (fts, self.fts_count), (skp, self.skp_count)]:
+            counter = Signal(32)
+            sync += If(event, counter.eq(counter + 1))
+            self.specials += MultiReg(counter, csr.status, "sys")
+
+        for signal, csr in [(state, self.state), (link, self.link), (lane, self.lane),
+                            (n_fts, self.n_fts), (rate, self.rate), (control, self.control)]:
+            self.specials += MultiReg(signal, csr.status, "sys")
+
+        # Trigger ----------------------------------------------------------------------------------
+        trigger_enable = Signal()
+        trigger_rearm  = Signal()
+        trigger_mask   = Signal(8)
+        triggered      = Signal()
+        self.specials += [
+            MultiReg(self.trigger_enable.storage, trigger_enable, cd),
+            MultiReg(self.trigger_mask.storage,   trigger_mask,   cd),
+            MultiReg(triggered, self.triggered.status, "sys"),
+        ]
+        # Re-arm when trigger_enable is written (toggle crossing).
+        rearm_toggle    = Signal()
+        rearm_toggle_cd = Signal()
+        rearm_toggle_d  = Signal()
+        self.sync += If(self.trigger_enable.re, rearm_toggle.eq(~rearm_toggle))
+        self.specials += MultiReg(rearm_toggle, rearm_toggle_cd, cd)
+        sync += rearm_toggle_d.eq(rearm_toggle_cd)
+        self.comb += trigger_rearm.eq(rearm_toggle_cd != rearm_toggle_d)
+        sync += [
+            If(trigger_rearm,
+                triggered.eq(0)
+            ).Elif((next_state != state) & (trigger_mask >> next_state)[0],
+                triggered.eq(1)
+            )
+        ]
+        self.comb += self.trigger.eq(~trigger_enable | triggered)
+
+        # Events -----------------------------------------------------------------------------------
+        time = Signal(32)
+        sync += time.eq(time + 1)
+        events = stream.AsyncFIFO([("time", 32), ("data", 32)], events_depth)
+        events = ClockDomainsRenamer({"write": cd, "read": "sys"})(events)
+        self.submodules.events = events
+        dropped = Signal(32)
+        self.specials += MultiReg(dropped, self.event_dropped.status, "sys")
+        sync += [
+            events.sink.valid.eq(next_state != state),
+            events.sink.time.eq(time),
+            events.sink.data.eq(Cat(state, Signal(1), next_state, Signal(1),
+                Mux(ts1 | ts2, fields[0], link),
+                Mux(ts1 | ts2, fields[1], lane),
+                Mux(ts1 | ts2, fields[3], rate))),
+            If(events.sink.valid & ~events.sink.ready,
+                dropped.eq(dropped + 1)
+            )
+        ]
+        self.comb += [
+            self.event_valid.status.eq(events.source.valid),
+            self.event_time.status.eq(events.source.time),
+            self.event_data.status.eq(events.source.data),
+            events.source.ready.eq(self.event_next.re),
+        ]
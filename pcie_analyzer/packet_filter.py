@@ -0,0 +1,399 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+from migen import *
+from migen.genlib.cdc import MultiReg
+
+from litex.soc.interconnect.csr import *
+from litex.soc.interconnect import stream
+
+from pcie_analyzer.rx_skp_remover import RXSymbolRemover
+
+# Helpers ------------------------------------------------------------------------------------------
+
+def K(x, y):
+    """K code generator ex: K(28, 5) is COM Symbol"""
+    return (y << 5) | x
+
+STP = K(27, 7)
+SDP = K(28, 2)
+END = K(29, 7)
+EDB = K(30, 7)
+GAP = K(28, 4) # Not used by PCIe: marks the symbols of a filtered packet.
+
+# Packet Parser ------------------------------------------------------------------------------------
+
+class PacketParser(Module):
+    """Packet Parser
+
+    Tracks TLPs (STP ... END) and DLLPs (SDP ... END) in a plain 32-bit stream and captures the
+    symbols following STP/SDP. `symbols` are valid when `decide` is set: once the 16 header bytes of a
+    TLP are received (Sequence Number excluded), at END for DLLPs and shorter packets, or when the
+    packet is truncated by another STP/SDP (`truncated`). Only the first STP/SDP of a word starts a
+    packet (packets are at least 8 symbols long).
+    """
+    def __init__(self, nbytes=18):
+        self.sink      = sink = stream.Endpoint([("data", 32), ("ctrl", 4)])
+        self.decide    = Signal()
+        self.truncated = Signal()
+        self.dllp      = Signal()
+        self.symbols   = [Signal(8) for i in range(nbytes)] # Symbols after STP/SDP.
+
+        # # #
+
+        active  = Signal()
+        dllp    = Signal()
+        decided = Signal()
+        pos     = Signal(max=nbytes + 2) # Symbols since STP/SDP (saturated).
+        symbols = [Signal(8) for i in range(nbytes)]
+
+        # Unrolled symbol by symbol tracking -------------------------------------------------------
+        c_active, c_dllp, c_decided, c_pos, c_symbols = active, dllp, decided, pos, symbols
+        c_started = Constant(0)
+        decide    = []
+        for i in range(4):
+            symbol = sink.data[8*i:8*(i+1)]
+            start  = Signal()
+            end    = Signal()
+            self.comb += [
+                start.eq(sink.ctrl[i] & ((symbol == STP) | (symbol == SDP)) & ~c_started),
+                end.eq(sink.ctrl[i] & ((symbol == END) | (symbol == EDB))),
+            ]
+            n_active  = Signal()
+            n_dllp    = Signal()
+            n_decided = Signal()
+            n_pos     = Signal(max=nbytes + 2)
+            n_symbols = [Signal(8) for j in range(nbytes)]
+            d_normal    = Signal()
+            d_truncated = Signal()
+            self.comb += [
+                n_active.eq(c_active),
+                n_dllp.eq(c_dllp),
+                n_decided.eq(c_decided),
+                n_pos.eq(c_pos),
+                If(start,
+                    d_truncated.eq(c_active & ~c_decided),
+                    n_active.eq(1),
+                    n_dllp.eq(symbol == SDP),
+                    n_decided.eq(0),
+                    n_pos.eq(0)
+                ).Elif(c_active,
+                    If(c_pos < nbytes + 1,
+                        n_pos.eq(c_pos + 1)
+                    ),
+                    If(end,
+                        n_active.eq(0)
+                    ),
+                    If(~c_decided & (end | (c_pos + 1 == nbytes)),
+                        d_normal.eq(1),
+                        n_decided.eq(1)
+                    )
+                )
+            ]
+            for j in range(nbytes):
+                self.comb += n_symbols[j].eq(Mux(c_active & ~start & (c_pos == j), symbol, c_symbols[j]))
+            decide.append((d_normal, d_truncated, c_dllp, n_symbols))
+            c_started = c_started | start
+            c_active, c_dllp, c_decided, c_pos, c_symbols = n_active, n_dllp, n_decided, n_pos, n_symbols
+
+        self.sync += [
+            self.decide.eq(0),
+            If(sink.valid & sink.ready,
+                active.eq(c_active),
+                dllp.eq(c_dllp),
+                decided.eq(c_decided),
+                pos.eq(c_pos),
+                [symbols[j].eq(c_symbols[j]) for j in range(nbytes)],
+                # At most one decision per word.
+                [If(d_normal | d_truncated,
+                    self.decide.eq(1),
+                    self.truncated.eq(d_truncated),
+                    self.dllp.eq(d_dllp),
+                    [self.symbols[j].eq(d_symbols[j]) for j in range(nbytes)]
+                ) for d_normal, d_truncated, d_dllp, d_symbols in decide]
+            )
+        ]
+        self.comb += sink.ready.eq(1)
+
+# Packet Filter ------------------------------------------------------------------------------------
+
+class PacketFilter(Module, AutoCSR):
+    """Packet Filter
+
+    Filters the plain (descrambled, SKP removed) 32-bit stream of a GTP in `cd` before it is
+    recorded: whole TLPs/DLLPs are kept or dropped at line rate according to a table of `nrules`
+    rules, so that the DRAM only holds the relevant packets.
+
+    Each rule matches on packet kind (TLP/DLLP), Type byte (TLP Fmt/Type or DLLP Type, value/mask),
+    Requester ID and Tag (value/mask, taken from the Completion header for Completions) and Address
+    range (Memory/IO Requests), and gives an action (keep/drop). The first enabled matching rule
+    applies, `default` applies when none matches. When `enable` is not set, all packets are kept.
+
+    Rules are loaded with `rule_index` and the `rule_*` fields, then `rule_write`; they should only
+    be changed while `enable` is not set. Logical Idle/Ordered Sets are always kept.
+
+    Each dropped packet is replaced by a 4-symbol marker: GAP (K28.4) followed by the 24-bit length
+    (little endian) of the packet in symbols (from its header), so that the original timing can be
+    reconstructed from the recording. `kept`/`filtered` count the packets.
+
+    Up to `depth` words are buffered while the headers are parsed and the rules evaluated: a word
+    starting a packet is released once the decision for the packet is known, the other words as
+    soon as possible (so that the buffered words are flushed when the stream pauses).
+    """
+    def __init__(self, cd, nrules=4, depth=16, decisions=8):
+        self.sink   = sink   = stream.Endpoint([("data", 32), ("ctrl", 4)])
+        self.source = source = stream.Endpoint([("data", 32), ("ctrl", 4)])
+
+        self.enable       = CSRStorage()
+        self.default      = CSRStorage(reset=1) # 1: keep, 0: drop.
+        self.rule_index   = CSRStorage(bits_for(nrules - 1))
+        self.rule_control = CSRStorage(fields=[
+            CSRField("enable",  size=1, offset=0),
+            CSRField("action",  size=1, offset=1, description="1: keep, 0: drop."),
+            CSRField("tlp",     size=1, offset=2, description="Match TLPs."),
+            CSRField("dllp",    size=1, offset=3, description="Match DLLPs."),
+            CSRField("address", size=1, offset=4, description="Match Address range (TLPs)."),
+        ])
+        self.rule_type         = CSRStorage(fields=[
+            CSRField("value", size=8, offset=0),
+            CSRField("mask",  size=8, offset=8),
+        ])
+        self.rule_requester_id = CSRStorage(fields=[
+            CSRField("value", size=16, offset=0),
+            CSRField("mask",  size=16, offset=16),
+        ])
+        self.rule_tag          = CSRStorage(fields=[
+            CSRField("value", size=8, offset=0),
+            CSRField("mask",  size=8, offset=8),
+        ])
+        self.rule_address_min = CSRStorage(64)
+        self.rule_address_max = CSRStorage(64)
+        self.rule_write       = CSR()
+        self.kept             = CSRStatus(32)
+        self.filtered         = CSRStatus(32)
+        self.nrules           = CSRConstant(nrules)
+
+        # # #
+
+        sync = getattr(self.sync, cd)
+
+        # Rules (sys, quasi-static in cd) ----------------------------------------------------------
+        rule_layout = [
+            ("enable",            1),
+            ("action",            1),
+            ("tlp",               1),
+            ("dllp",              1),
+            ("address",           1),
+            ("type_value",        8),
+            ("type_mask",         8),
+            ("requester_id_value",16),
+            ("requester_id_mask", 16),
+            ("tag_value",         8),
+            ("tag_mask",          8),
+            ("address_min",      64),
+            ("address_max",      64),
+        ]
+        rules    = []
+        rules_cd = []
+        for i in range(nrules):
+            rule    = Record(rule_layout)
+            rule_cd = Record(rule_layout)
+            self.sync += If(self.rule_write.re & (self.rule_index.storage == i),
+                rule.enable.eq(self.rule_control.fields.enable),
+                rule.action.eq(self.rule_control.fields.action),
+                rule.tlp.eq(self.rule_control.fields.tlp),
+                rule.dllp.eq(self.rule_control.fields.dllp),
+                rule.address.eq(self.rule_control.fields.address),
+                rule.type_value.eq(self.rule_type.fields.value),
+                rule.type_mask.eq(self.rule_type.fields.mask),
+                rule.requester_id_value.eq(self.rule_requester_id.fields.value),
+                rule.requester_id_mask.eq(self.rule_requester_id.fields.mask),
+                rule.tag_value.eq(self.rule_tag.fields.value),
+                rule.tag_mask.eq(self.rule_tag.fields.mask),
+                rule.address_min.eq(self.rule_address_min.storage),
+                rule.address_max.eq(self.rule_address_max.storage),
+            )
+            self.specials += MultiReg(rule.raw_bits(), rule_cd.raw_bits(), cd)
+            rules.append(rule)
+            rules_cd.append(rule_cd)
+        enable  = Signal()
+        default = Signal()
+        self.specials += [
+            MultiReg(self.enable.storage,  enable,  cd),
+            MultiReg(self.default.storage, default, cd),
+        ]
+
+        # Parser -----------------------------------------------------------------------------------
+        parser = ClockDomainsRenamer(cd)(PacketParser())
+        self.submodules.parser = parser
+        self.comb += [
+            parser.sink.valid.eq(sink.valid & sink.ready),
+            parser.sink.data.eq(sink.data),
+            parser.sink.ctrl.eq(sink.ctrl),
+        ]
+
+        # Header fields ----------------------------------------------------------------------------
+        s   = parser.symbols # s[0:2]: Sequence Number, s[2:18]: TLP header / s[0:6]: DLLP.
+        hdr = s[2:]
+        is_4dw        = hdr[0][5]
+        with_data     = hdr[0][6]
+        is_completion = hdr[0][0:5] == 0b01010
+        is_request    = hdr[0][2:5] == 0b000 # Memory/IO Requests.
+        tlp_length    = Cat(hdr[3], hdr[2][0:2])
+        packet_length = Signal(24)
+        self.comb += [
+            If(parser.dllp,
+                packet_length.eq(8)
+            ).Else(
+                packet_length.eq(1 + 2 + Mux(is_4dw, 16, 12) + 4 + 1 + Mux(hdr[2][7], 4, 0) +
+                    Mux(with_data, Mux(tlp_length == 0, 1024, tlp_length), 0)*4)
+            )
+        ]
+
+        # Rules evaluation -------------------------------------------------------------------------
+        d_valid     = Signal()
+        d_truncated = Signal()
+        d_length    = Signal(24)
+        d_match     = Signal(nrules)
+        d_action    = Signal(nrules)
+        ptype        = Mux(parser.dllp, s[0], hdr[0])
+        requester_id = Mux(is_completion, Cat(hdr[9], hdr[8]), Cat(hdr[5], hdr[4]))
+        tag          = Mux(is_completion, hdr[10], hdr[6])
+        address      = Mux(is_4dw,
+            Cat(hdr[15], hdr[14], hdr[13], hdr[12], hdr[11], hdr[10], hdr[9], hdr[8]),
+            Cat(hdr[11], hdr[10], hdr[9], hdr[8]))
+        address      = Cat(Constant(0, 2), address[2:])
+        for i, rule in enumerate(rules_cd):
+            sync += [
+                d_match[i].eq(rule.enable &
+                    Mux(parser.dllp, rule.dllp, rule.tlp) &
+                    (((ptype ^ rule.type_value) & rule.type_mask) == 0) &
+                    (parser.dllp | (
+                        (((requester_id ^ rule.requester_id_value) & rule.requester_id_mask) == 0) &
+                        (((tag ^ rule.tag_value) & rule.tag_mask) == 0) &
+                        (~rule.address | (is_request &
+                            (address >= rule.address_min) &
+                            (address <= rule.address_max)))))),
+                d_action[i].eq(rule.action),
+            ]
+        sync += [
+            d_valid.eq(parser.decide),
+            d_truncated.eq(parser.truncated),
+            d_length.eq(packet_length),
+        ]
+
+        # Decision: first matching rule, truncated packets are kept --------------------------------
+        keep = Signal()
+        self.comb += keep.eq(default)
+        for i in reversed(range(nrules)):
+            self.comb += If(d_match[i], keep.eq(d_action[i]))
+        fifo = stream.SyncFIFO([("keep", 1), ("length", 24)], decisions)
+        fifo = ClockDomainsRenamer(cd)(fifo)
+        self.submodules.fifo = fifo
+        sync += [
+            fifo.sink.valid.eq(d_valid),
+            fifo.sink.keep.eq(~enable | d_truncated | keep),
+            fifo.sink.length.eq(d_length),
+        ]
+
+        kept     = Signal(32)
+        filtered = Signal(32)
+        sync += If(fifo.sink.valid,
+            If(fifo.sink.keep,
+                kept.eq(kept + 1)
+            ).Else(
+                filtered.eq(filtered + 1)
+            )
+        )
+        self.specials += [
+            MultiReg(kept,     self.kept.status,     "sys"),
+            MultiReg(filtered, self.filtered.status, "sys"),
+        ]
+
+        # Buffering (decisions are known some words after packets start) --------------------------
+        buf = stream.SyncFIFO([("data", 32), ("ctrl", 4)], depth)
+        buf = ClockDomainsRenamer(cd)(buf)
+        self.submodules.buf = buf
+        self.comb += sink.connect(buf.sink)
+
+        remover = ClockDomainsRenamer(cd)(RXSymbolRemover())
+        self.submodules.remover = remover
+
+        # Output: dropped packets are replaced by GAP markers and removed --------------------------
+        dropping = Signal()
+        count    = Signal(3)
+        length   = Signal(24)
+        c_dropping, c_count, c_length = dropping, count, length
+        c_started = Constant(0)
+        o_data    = []
+        o_ctrl    = []
+        o_remove  = []
+        for i in range(4):
+            symbol = buf.source.data[8*i:8*(i+1)]
+            ctrl   = buf.source.ctrl[i]
+            start  = Signal()
+            end    = Signal()
+            self.comb += [
+                start.eq(ctrl & ((symbol == STP) | (symbol == SDP)) & ~c_started),
+                end.eq(ctrl & ((symbol == END) | (symbol == EDB))),
+            ]
+            n_dropping = Signal()
+            n_count    = Signal(3)
+            n_length   = Signal(24)
+            data   = Signal(8)
+            k      = Signal()
+            remove = Signal()
+            self.comb += [
+                n_dropping.eq(c_dropping),
+                n_count.eq(c_count),
+                n_length.eq(c_length),
+                data.eq(symbol),
+                k.eq(ctrl),
+                If(start,
+                    If(fifo.source.valid & ~fifo.source.keep,
+                        n_dropping.eq(1),
+                        n_count.eq(1),
+                        n_length.eq(fifo.source.length),
+                        data.eq(GAP),
+                        k.eq(1)
+                    ).Else(
+                        n_dropping.eq(0)
+                    )
+                ).Elif(c_dropping,
+                    If(c_count < 4,
+                        n_count.eq(c_count + 1),
+                        data.eq(Mux(c_count == 1, c_length[0:8], Mux(c_count == 2, c_length[8:16], c_length[16:24]))),
+                        k.eq(0)
+                    ).Else(
+                        remove.eq(1)
+                    ),
+                    If(end,
+                        n_dropping.eq(0)
+                    )
+                )
+            ]
+            o_data.append(data)
+            o_ctrl.append(k)
+            o_remove.append(remove)
+            c_started = c_started | start
+            c_dropping, c_count, c_length = n_dropping, n_count, n_length
+
+        # Words starting a packet are only released with the decision of the packet.
+        started = Signal()
+        release = Signal()
+        self.comb += [
+            started.eq(c_started),
+            release.eq(~started | fifo.source.valid),
+            remover.sink.valid.eq(buf.source.valid & release),
+            remover.sink.data.eq(Cat(*o_data)),
+            remover.sink.ctrl.eq(Cat(*o_ctrl)),
+            remover.remove.eq(Cat(*o_remove)),
+            buf.source.ready.eq(remover.sink.ready & release),
+            fifo.source.ready.eq(buf.source.valid & remover.sink.ready & started),
+            remover.source.connect(source),
+        ]
+        sync += If(remover.sink.valid & remover.sink.ready,
+            dropping.eq(c_dropping),
+            count.eq(c_count),
+            length.eq(c_length),
+        )
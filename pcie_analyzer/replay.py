@@ -0,0 +1,148 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+from migen import *
+from migen.genlib.cdc import MultiReg, GrayCounter, GrayDecoder
+
+from litex.soc.interconnect.csr import *
+from litex.soc.interconnect import stream
+
+from litedram.frontend.dma import LiteDRAMDMAReader
+
+from pcie_analyzer.common import SKP_INTERVAL
+from pcie_analyzer.tx_skp_inserter import TXSKPInserter
+from pcie_analyzer.scrambling import Descrambler
+
+# Replay -------------------------------------------------------------------------------------------
+
+class Replay(Module, AutoCSR):
+    """Capture Replay
+
+    This module reads a capture from DRAM and transmits it on the GTP at line rate. The capture is
+    expected to be plain (descrambled and without SKP Ordered Sets) and stored with the recorder's
+    layout: `data_width` bits of data in the lower bits of each DRAM word followed by the
+    `data_width//8` ctrl bits.
+
+    The stream is converted to 32-bit, SKP Ordered Sets are re-inserted, the stream is re-scrambled
+    (re-synchronized on COM and with TS1/TS2 Ordered Sets unscrambled, as the Descrambler does on RX)
+    and converted to the GTP's width. When no data is available, Logical Idle is transmitted;
+    underflows during a replay are counted. A replay only starts once `prefill_depth//2` words (or
+    the whole capture when shorter) are buffered, so that the DRAM latency doesn't cause underflows
+    at the start.
+
+    The DMA CSRs (base, length, loop, ...) are exposed through the `dma` submodule.
+    """
+    def __init__(self, port, gtp, cd, data_width=96, skp_interval=SKP_INTERVAL, cdc_depth=64,
+        prefill_depth=32):
+        assert (data_width % 32 == 0) or (32 % data_width == 0)
+        ctrl_width = data_width//8
+        assert data_width + ctrl_width <= port.data_width
+        self.underflows = CSRStatus(32)
+
+        # # #
+
+        # DMA Reader -------------------------------------------------------------------------------
+        self.submodules.dma = dma = LiteDRAMDMAReader(port, fifo_depth=32, fifo_buffered=True)
+        dma.add_csr()
+
+        # Clock Domain Crossing --------------------------------------------------------------------
+        cdc = stream.AsyncFIFO([("data", data_width), ("ctrl", ctrl_width)], cdc_depth, buffered=True)
+        cdc = ClockDomainsRenamer({"write": "sys", "read": cd})(cdc)
+        self.submodules.cdc = cdc
+        self.comb += [
+            cdc.sink.valid.eq(dma.source.valid),
+            cdc.sink.last.eq(dma.source.last),
+            cdc.sink.data.eq(dma.source.data[0:data_width]),
+            cdc.sink.ctrl.eq(dma.source.data[data_width:data_width + ctrl_width]),
+            dma.source.ready.eq(cdc.sink.ready),
+        ]
+
+        # Convert to 32-bit ------------------------------------------------------------------------
+        converter = stream.StrideConverter(
+            [("data", data_width), ("ctrl", ctrl_width)],
+            [("data",         32), ("ctrl",          4)],
+            reverse = False)
+        converter = ClockDomainsRenamer(cd)(converter)
+        self.submodules.converter = converter
+
+        # Prefill ----------------------------------------------------------------------------------
+        prefill = stream.SyncFIFO([("data", data_width), ("ctrl", ctrl_width)], prefill_depth)
+        prefill = ClockDomainsRenamer(cd)(prefill)
+        self.submodules.prefill = prefill
+        self.comb += [
+            cdc.source.connect(prefill.sink),
+            prefill.source.connect(converter.sink),
+        ]
+
+        # Start when prefilled or when the end of the capture is buffered, stay active until the end.
+        active = Signal()
+        start  = Signal()
+        lasts  = Signal(max=prefill_depth + 2) # Ends of capture buffered (Prefill FIFO/converter).
+        sync = getattr(self.sync, cd)
+        sync += [
+            If(converter.source.valid & converter.source.ready,
+                active.eq(~converter.source.last)
+            ),
+            If(prefill.sink.valid & prefill.sink.ready & prefill.sink.last,
+                If(~(converter.source.valid & converter.source.ready & converter.source.last),
+                    lasts.eq(lasts + 1)
+                )
+            ).Elif(converter.source.valid & converter.source.ready & converter.source.last,
+                lasts.eq(lasts - 1)
+            )
+        ]
+        self.comb += start.eq(active | (prefill.level >= prefill_depth//2) | (lasts != 0))
+
+        # SKP Insertion (Logical Idle when no data available) --------------------------------------
+        # Buffer registers the Data/Logical Idle selection so that it stays stable until accepted.
+        buf = stream.Buffer([("data", 32), ("ctrl", 4)])
+        buf = ClockDomainsRenamer(cd)(buf)
+        self.submodules.buf = buf
+        self.comb += [
+            buf.sink.valid.eq(1),
+            If(converter.source.valid & start,
+                buf.sink.data.eq(converter.source.data),
+                buf.sink.ctrl.eq(converter.source.ctrl),
+                converter.source.ready.eq(buf.sink.ready)
+            )
+        ]
+
+        # Count underflows (Logical Idle inserted while replaying)
+        # Gray-coded counter in the GTP TX domain (a single bit changes per increment) resynchronized
+        # and decoded in the sys domain.
+        underflows = GrayCounter(32)
+        underflows = ClockDomainsRenamer(cd)(underflows)
+        self.submodules.underflows_counter = underflows
+        self.comb += underflows.ce.eq(active & buf.sink.ready & ~converter.source.valid)
+        underflows_gray = Signal(32)
+        self.specials += MultiReg(underflows.q, underflows_gray, "sys")
+        self.submodules.underflows_decoder = underflows_decoder = GrayDecoder(32)
+        self.comb += [
+            underflows_decoder.i.eq(underflows_gray),
+            self.underflows.status.eq(underflows_decoder.o)
+        ]
+
+        skp_inserter = TXSKPInserter(interval=skp_interval)
+        skp_inserter = ClockDomainsRenamer(cd)(skp_inserter)
+        self.submodules.skp_inserter = skp_inserter
+        self.comb += buf.source.connect(skp_inserter.sink)
+
+        # Scrambling -------------------------------------------------------------------------------
+        # Scrambling and descrambling are the same operation: the Descrambler re-scrambles the plain
+        # stream with the same COM synchronization and TS1/TS2 Ordered Sets bypass as on RX.
+        scrambler = Descrambler(reset=0xffff)
+        scrambler = ClockDomainsRenamer(cd)(scrambler)
+        self.submodules.scrambler = scrambler
+        self.comb += skp_inserter.source.connect(scrambler.sink)
+
+        # Convert to GTP width ---------------------------------------------------------------------
+        tx_converter = stream.StrideConverter(
+            [("data",                32), ("ctrl",                 4)],
+            [("data", len(gtp.sink.data)), ("ctrl", len(gtp.sink.ctrl))],
+            reverse = False)
+        tx_converter = ClockDomainsRenamer(cd)(tx_converter)
+        self.submodules.tx_converter = tx_converter
+        self.comb += [
+            scrambler.source.connect(tx_converter.sink),
+            tx_converter.source.connect(gtp.sink),
+        ]
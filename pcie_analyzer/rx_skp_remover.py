@@ -11,28 +11,21 @@ def K(x, y):
     """K code generator ex: K(28, 5) is COM Symbol"""
     return (y << 5) | x
 
-# RX SKP Remover ------- ---------------------------------------------------------------------------
+# RX Symbol Remover --------------------------------------------------------------------------------
 
-class RXSKPRemover(Module):
-    """RX SKP Remover
+class RXSymbolRemover(Module):
+    """RX Symbol Remover
 
-    SKP Ordered Sets are inserted in the stream for clock compensation between partners with an
-    average of 1 SKP Ordered Set every 354 symbols. This module removes SKP Ordered Sets from
-    the RX stream.
+    This module removes the symbols flagged in `remove` (one bit per symbol of the sink) from the
+    RX stream and packs the remaining ones in 32-bit words.
     """
     def __init__(self):
         self.sink   = sink   = stream.Endpoint([("data", 32), ("ctrl", 4)])
         self.source = source = stream.Endpoint([("data", 32), ("ctrl", 4)])
-        self.skip   = Signal()
+        self.remove = skp    = Signal(4)
 
         # # #
 
-        # Find SKP symbols -------------------------------------------------------------------------
-        skp = Signal(4)
-        for i in range(4):
-            self.comb += skp[i].eq(sink.ctrl[i] & (sink.data[8*i:8*(i+1)] == K(28, 1)))
-        self.comb += self.skip.eq(self.sink.valid & self.sink.ready & (skp != 0))
-
         # Select valid Data/Ctrl fragments ---------------------------------------------------------
         frag_data  = Signal(32)
         frag_ctrl  = Signal(4)
@@ -66,7 +59,9 @@ class RXSKPRemover(Module):
                 sr_data.eq(Cat(sr_data[8*i:], frag_data[0:8*i])),
                 sr_ctrl.eq(Cat(sr_ctrl[1*i:], frag_ctrl[0:1*i])),
             ]
-        self.comb += sink.ready.eq(sr_bytes <= 7)
+        # Only accept a word when it fits in the 8-byte Shift Register (at most 4 bytes stored or a
+        # word output at the same time). Without back-pressure, sink is always ready.
+        self.comb += sink.ready.eq((sr_bytes <= 4) | source.ready)
         self.sync += [
             If(sink.valid & sink.ready,
                 If(source.valid & source.ready,
@@ -83,9 +78,29 @@ class RXSKPRemover(Module):
         # Output Data/Ctrl when there is a full 32/4-bit word --------------------------------------
         self.comb += source.valid.eq(sr_bytes >= 4)
         cases = {}
-        for i in range(4, 8):
+        for i in range(4, 9):
             cases[i] = [
                 source.data.eq(sr_data[8*(8-i):8*(8-i+4)]),
                 source.ctrl.eq(sr_ctrl[1*(8-i):1*(8-i+4)]),
             ]
         self.comb += Case(sr_bytes, cases)
+
+# RX SKP Remover -----------------------------------------------------------------------------------
+
+class RXSKPRemover(RXSymbolRemover):
+    """RX SKP Remover
+
+    SKP Ordered Sets are inserted in the stream for clock compensation between partners with an
+    average of 1 SKP Ordered Set every 354 symbols. This module removes SKP Ordered Sets from
+    the RX stream.
+    """
+    def __init__(self):
+        RXSymbolRemover.__init__(self)
+        self.skip = Signal()
+
+        # # #
+
+        # Find SKP symbols -------------------------------------------------------------------------
+        for i in range(4):
+            self.comb += self.remove[i].eq(self.sink.ctrl[i] & (self.sink.data[8*i:8*(i+1)] == K(28, 0)))
+        self.comb += self.skip.eq(self.sink.valid & self.sink.ready & (self.remove != 0))
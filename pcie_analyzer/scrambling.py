@@ -14,6 +14,12 @@ def K(x, y):
     """K code generator ex: K(28, 5) is COM Symbol"""
     return (y << 5) | x
 
+def lfsr_advance(value, n):
+    """LFSR value (X^16 + X^5 + X^4 + X^3 + 1 polynom) after `n` bits."""
+    for i in range(n):
+        value = ((value << 1) & 0xffff) ^ (0x0039 if value & 0x8000 else 0x0000)
+    return value
+
 # Scrambler Unit -----------------------------------------------------------------------------------
 
 @ResetInserter()
@@ -24,7 +30,9 @@ class ScramblerUnit(Module):
     This module generates the scrambled datas for the PCIe link (X^16 + X^5 + X^4 + X^3 + 1 polynom).
     """
     def __init__(self, reset=0xffff):
-        self.value = Signal(32)
+        self.value      = Signal(32)
+        self.load       = Signal()
+        self.load_value = Signal(16)
 
         # # #
 
@@ -82,7 +90,7 @@ class ScramblerUnit(Module):
             self.value[30].eq(cur[1]  ^ cur[7]  ^ cur[9]  ^ cur[11]),
             self.value[31].eq(cur[0]  ^ cur[6]  ^ cur[8]  ^ cur[10]),
         ]
-        self.sync += cur.eq(new)
+        self.sync += If(self.load, cur.eq(self.load_value)).Else(cur.eq(new))
 
 # Scrambler ----------------------------------------------------------------------------------------
 
@@ -117,10 +125,15 @@ class Descrambler(Module):
 
     This module descrambles the RX data/ctrl stream. K codes shall not be scrambled. The descrambler
     automatically synchronizes itself to the incoming stream and resets the scrambler unit when COM
-    characters are seen.
+    characters are seen (`resync` strobe).
+
+    TS1/TS2 Ordered Sets (COM followed by a Link Number or PAD, aligned on words as all Ordered
+    Sets) are not scrambled: descrambling is bypassed for their 4 words. Their symbols still advance
+    the LFSR, including the 3 symbols following COM in its word (unlike SKPs).
     """
     def __init__(self, reset=0xffff):
         self.enable = Signal(reset=1)
+        self.resync = Signal()
         self.sink   =   sink = stream.Endpoint([("data", 32), ("ctrl", 4)])
         self.source = source = stream.Endpoint([("data", 32), ("ctrl", 4)])
 
@@ -128,7 +141,23 @@ class Descrambler(Module):
 
         scrambler = Scrambler(reset=reset)
         self.submodules += scrambler
-        self.comb += scrambler.enable.eq(self.enable)
+
+        # Bypass TS1/TS2 Ordered Sets
+        ts_start = Signal()
+        ts_words = Signal(2)
+        self.comb += ts_start.eq(
+            (sink.data[0:8] == K(28, 5)) & sink.ctrl[0] &
+            (~sink.ctrl[1] | (sink.data[8:16] == K(23, 7))))
+        self.sync += [
+            If(sink.valid & sink.ready,
+                If(ts_start,
+                    ts_words.eq(3)
+                ).Elif(ts_words != 0,
+                    ts_words.eq(ts_words - 1)
+                )
+            )
+        ]
+        self.comb += scrambler.enable.eq(self.enable & ~ts_start & (ts_words == 0))
 
         # Synchronize on COM
         for i in range(4):
@@ -137,9 +166,16 @@ class Descrambler(Module):
                    sink.ready &
                    (sink.data[8*i:8*(i+1)] == K(28, 5)) &
                    sink.ctrl[i],
-                   scrambler.unit.reset.eq(1)
+                   If(ts_start,
+                       # LFSR reset and advanced by the 3 symbols following COM.
+                       scrambler.unit.load.eq(1),
+                       scrambler.unit.load_value.eq(lfsr_advance(reset, 24))
+                   ).Else(
+                       scrambler.unit.reset.eq(1)
+                   )
                 )
             ]
+        self.comb += self.resync.eq(scrambler.unit.reset | scrambler.unit.load)
 
         # Descramble data
         self.comb += [
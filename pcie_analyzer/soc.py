@@ -0,0 +1,287 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+import json
+from functools import reduce
+from operator import or_
+
+from migen import *
+from migen.genlib.cdc import MultiReg
+
+from litex.soc.interconnect import stream
+
+from litedram.frontend.dma import LiteDRAMDMAWriter
+
+from liteiclink.transceiver.gtp_7series import GTPQuadPLL, GTP
+
+from pcie_analyzer.rx_skp_remover import RXSKPRemover
+from pcie_analyzer.scrambling import K, Descrambler
+from pcie_analyzer.packet_filter import PacketFilter
+from pcie_analyzer.link_health import LinkHealth, gtp_rx_buffer_status
+from pcie_analyzer.ltssm import LTSSMObserver
+from pcie_analyzer.latency import LatencyMonitor
+from pcie_analyzer.dram_crc import DRAMCRC
+
+COM = K(28, 5)
+
+# Capture Configuration ----------------------------------------------------------------------------
+
+class CaptureConfig:
+    """Capture Configuration
+
+    Selects the stages of the capture pipeline of each recorder (`recorders`: name prefix -> GTP):
+
+        GTP RX -> [Descrambling] -> [SKP removal] -> [Packet filter] -> Packing -> [CDC] -> DMA
+
+    - descrambling/skp_removal: record plain symbols / without SKP symbols (32-bit path). The
+      Descrambler resynchronizes on the SKP Ordered Sets, so it is placed before SKP removal. With
+      descrambling, a sync flag after the ctrl flags tells whether the Descrambler was synchronized
+      for the whole word.
+    - filter: gateware packet filter (implies SKP removal and descrambling).
+    - trigger: gate recording with the LTSSM observer trigger (auto-arm).
+    - dma_width: DRAM port width, as many symbols as fit are packed per word: data in the low
+      bits, ctrl flags after them.
+    - dma_clock_domain: "sys" (DRAM port in sys, CDC FIFO) or "gtp" (DRAM port in the GTP RX
+      domain).
+    - link_health/ltssm: link health monitors and LTSSM observers on all GTPs.
+    - latency: Request -> Completion latency monitor between GTP 0 and 1 (the link directions).
+    """
+    def __init__(self,
+        recorders        = {"rx": 0},
+        skp_removal      = False,
+        descrambling     = False,
+        filter           = False,
+        trigger          = True,
+        dma_width        = 128,
+        dma_clock_domain = "sys",
+        link_health      = False,
+        ltssm            = False,
+        latency          = False):
+        assert dma_clock_domain in ["sys", "gtp"]
+        self.recorders        = recorders
+        self.skp_removal      = skp_removal or filter
+        self.descrambling     = descrambling or filter
+        self.filter           = filter
+        self.trigger          = trigger and ltssm
+        self.dma_width        = dma_width
+        self.dma_clock_domain = dma_clock_domain
+        self.link_health      = link_health
+        self.ltssm            = ltssm
+        self.latency          = latency
+
+    @property
+    def symbols_per_word(self):
+        # Multiple of the pipeline width (4 symbols), or 2 symbols for narrow ports.
+        n = self.dma_width//9
+        return n - n%4 if n >= 4 else n - n%2
+
+# PCIe Analyzer SoC --------------------------------------------------------------------------------
+
+class PCIeAnalyzerSoC:
+    """PCIe Analyzer SoC mixin
+
+    Adds the analyzer to a SoCSDRAM: targets only provide the platform, CRG, DRAM, Etherbone and the
+    GTP reference clock, then call `add_gtps` and `add_capture` (and `add_dram_crc` to check the
+    uploads).
+    """
+    def add_gtps(self, refclk, refclk_freq, linerate, connector="pcie", ngtps=2):
+        self.linerate = linerate
+        self.ngtps    = ngtps
+
+        # GTP PLL ----------------------------------------------------------------------------------
+        qpll = GTPQuadPLL(refclk, refclk_freq, linerate)
+        print(qpll)
+        self.submodules += qpll
+
+        # GTPs -------------------------------------------------------------------------------------
+        for i in range(ngtps):
+            tx_pads = self.platform.request(connector + "_tx", i)
+            rx_pads = self.platform.request(connector + "_rx", i)
+            gtp = GTP(qpll, tx_pads, rx_pads, self.clk_freq,
+                data_width       = 20,
+                clock_aligner    = False,
+                tx_buffer_enable = True,
+                rx_buffer_enable = True)
+            gtp.add_stream_endpoints()
+            setattr(self.submodules, "gtp"+str(i), gtp)
+            self.platform.add_period_constraint(gtp.cd_tx.clk, 1e9/gtp.tx_clk_freq)
+            self.platform.add_period_constraint(gtp.cd_rx.clk, 1e9/gtp.rx_clk_freq)
+            self.platform.add_false_path_constraints(
+                self.crg.cd_sys.clk,
+                gtp.cd_tx.clk,
+                gtp.cd_rx.clk)
+
+    def add_capture(self, config):
+        self.capture_config = config
+
+        # Link Health ------------------------------------------------------------------------------
+        if config.link_health:
+            for i in range(self.ngtps):
+                gtp = getattr(self, "gtp" + str(i))
+                link_health = LinkHealth("gtp{}_rx".format(i),
+                    data_width    = len(gtp.source.data),
+                    buffer_status = gtp_rx_buffer_status(gtp))
+                setattr(self.submodules, "gtp{}_link_health".format(i), link_health)
+                self.add_csr("gtp{}_link_health".format(i))
+                self.comb += [
+                    link_health.sink.valid.eq(gtp.source.valid),
+                    link_health.sink.data.eq(gtp.source.data),
+                    link_health.sink.ctrl.eq(gtp.source.ctrl),
+                ]
+
+        # LTSSM Observers --------------------------------------------------------------------------
+        if config.ltssm:
+            for i in range(self.ngtps):
+                gtp   = getattr(self, "gtp" + str(i))
+                ltssm = LTSSMObserver("gtp{}_rx".format(i), data_width=len(gtp.source.data))
+                setattr(self.submodules, "gtp{}_ltssm".format(i), ltssm)
+                self.add_csr("gtp{}_ltssm".format(i))
+                self.comb += [
+                    ltssm.sink.valid.eq(gtp.source.valid),
+                    ltssm.sink.data.eq(gtp.source.data),
+                    ltssm.sink.ctrl.eq(gtp.source.ctrl),
+                ]
+
+        # Latency Monitor --------------------------------------------------------------------------
+        if config.latency:
+            assert self.ngtps >= 2
+            self.submodules.latency = LatencyMonitor(["gtp0_rx", "gtp1_rx"],
+                data_width = len(self.gtp0.source.data))
+            self.add_csr("latency")
+            for i, sink in enumerate(self.latency.sinks):
+                gtp = getattr(self, "gtp" + str(i))
+                self.comb += [
+                    sink.valid.eq(gtp.source.valid),
+                    sink.data.eq(gtp.source.data),
+                    sink.ctrl.eq(gtp.source.ctrl),
+                ]
+
+        # Recorders --------------------------------------------------------------------------------
+        for name, i in sorted(config.recorders.items(), key=lambda r: r[1]):
+            self.add_recorder(name, i, config)
+
+    def add_recorder(self, name, i, config):
+        gtp = getattr(self, "gtp" + str(i))
+        cd  = "gtp{}_rx".format(i)
+        def add(module):
+            module = ClockDomainsRenamer(cd)(module)
+            self.submodules += module
+            return module
+
+        # Descrambling / SKP removal / Filter (32-bit) ---------------------------------------------
+        source = gtp.source
+        if config.skp_removal or config.descrambling:
+            converter = add(stream.StrideConverter(
+                [("data", 16), ("ctrl", 2)],
+                [("data", 32), ("ctrl", 4)],
+                reverse = False))
+            self.comb += source.connect(converter.sink)
+            source = converter.source
+        if config.descrambling:
+            descrambler = add(Descrambler())
+            self.comb += source.connect(descrambler.sink)
+            source = descrambler.source
+        if config.skp_removal:
+            skp_remover = add(RXSKPRemover())
+            self.comb += source.connect(skp_remover.sink)
+            source = skp_remover.source
+        if config.filter:
+            packet_filter = PacketFilter(cd)
+            setattr(self.submodules, name + "_filter", packet_filter)
+            self.add_csr(name + "_filter")
+            self.comb += source.connect(packet_filter.sink)
+            source = packet_filter.source
+
+        # Packing ----------------------------------------------------------------------------------
+        n = config.symbols_per_word
+        if n != len(source.ctrl):
+            converter = add(stream.StrideConverter(
+                [("data", len(source.data)), ("ctrl", len(source.ctrl))],
+                [("data",              8*n), ("ctrl",                n)],
+                reverse = False))
+            self.comb += source.connect(converter.sink)
+            source = converter.source
+
+        # Sync flag --------------------------------------------------------------------------------
+        # Descrambled words are flagged once a COM was recorded in a previous word (Descrambler
+        # synchronized on the whole word).
+        layout = [("data", 8*n), ("ctrl", n)]
+        if config.descrambling:
+            layout += [("synced", 1)]
+            com    = Signal()
+            synced = Signal()
+            self.comb += com.eq(reduce(or_, [source.ctrl[j] & (source.data[8*j:8*(j+1)] == COM)
+                for j in range(n)]))
+            sync    = getattr(self.sync, cd)
+            sync   += If(source.valid & source.ready & com, synced.eq(1))
+            flagged = stream.Endpoint(layout)
+            self.comb += [
+                source.connect(flagged),
+                flagged.synced.eq(synced),
+            ]
+            source = flagged
+
+        # Trigger (auto-arm) -----------------------------------------------------------------------
+        trigger = Signal(reset=1)
+        if config.trigger:
+            trigger_cd = getattr(self, "gtp{}_ltssm".format(i)).trigger
+            if config.dma_clock_domain == "sys":
+                self.specials += MultiReg(trigger_cd, trigger)
+            else:
+                self.comb += trigger.eq(trigger_cd)
+
+        # DMA --------------------------------------------------------------------------------------
+        if config.dma_clock_domain == "sys":
+            cdc = stream.AsyncFIFO(layout, 8, buffered=True)
+            cdc = ClockDomainsRenamer({"write": cd, "read": "sys"})(cdc)
+            setattr(self.submodules, name + "_cdc", cdc)
+            self.comb += source.connect(cdc.sink)
+            source = cdc.source
+            port   = self.sdram.crossbar.get_port("write", config.dma_width)
+        else:
+            port   = self.sdram.crossbar.get_port("write", config.dma_width, clock_domain=cd)
+        recorder = LiteDRAMDMAWriter(port)
+        recorder.add_csr()
+        setattr(self.submodules, name + "_dma_recorder", recorder)
+        self.add_csr(name + "_dma_recorder")
+        # Symbols are discarded until the trigger.
+        self.comb += [
+            recorder.sink.valid.eq(source.valid & trigger),
+            recorder.sink.data.eq(source.payload.raw_bits()),
+            source.ready.eq(recorder.sink.ready | ~trigger),
+        ]
+
+    # DRAM CRC -------------------------------------------------------------------------------------
+
+    def add_dram_crc(self, name="dram_crc", data_width=128, nblocks=1024):
+        """CRC-32 of DRAM regions (per-block) computed in gateware to check the uploads."""
+        port = self.sdram.crossbar.get_port("read", data_width)
+        setattr(self.submodules, name, DRAMCRC(port, nblocks=nblocks))
+        self.add_csr(name)
+
+    # Capture Layout -------------------------------------------------------------------------------
+
+    def get_capture_layout(self):
+        """Description of the recorded words for the host tools (see software/capture.py)."""
+        config = self.capture_config
+        n      = config.symbols_per_word
+        return {
+            "target"        : self.platform.name,
+            "linerate"      : self.linerate,
+            "symbol_period" : 1e9*10/self.linerate, # ns.
+            "recorders"     : {name + "_dma_recorder" : {
+                "gtp"              : i,
+                "word_size"        : config.dma_width//8,
+                "symbols_per_word" : n,
+                "data_offset"      : 0,
+                "ctrl_offset"      : 8*n,
+                "sync_offset"      : 9*n if config.descrambling else None,
+                "scrambled"        : not config.descrambling,
+                "skp_removed"      : config.skp_removal,
+                "filtered"         : config.filter,
+            } for name, i in config.recorders.items()},
+        }
+
+    def generate_capture_layout(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.get_capture_layout(), f, indent=4)
@@ -0,0 +1,318 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+"""
+Seekable chunked compression container for archived captures.
+
+A capture is split in fixed-size chunks (a multiple of the capture word size) that are compressed
+independently (zlib, lzma or zstd when the zstandard module is installed), chunks being compressed
+in a process pool. The file is made of:
+- a header: magic, version, codec, level, chunk size, capture size, number of chunks and offset
+  of the chunk table, followed by the capture format name and its layout (JSON, see capture.py),
+  so that archives of layout formats ("layout.json:recorder") are read without the layout file.
+- the compressed chunks.
+- the chunk table: offset, compressed size and CRC-32 of each chunk.
+
+Readers only decompress the chunks covering the requested bytes/symbols/time range. The sidecar
+packet index (<archive>.idx.npy, `framing.packet_layout` with absolute symbol offsets) gives
+random access to the packets of the archived capture.
+"""
+
+import os
+import json
+import zlib
+import lzma
+import struct
+import multiprocessing
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from pcie_analyzer.software.capture import (CaptureReader, capture_format, capture_formats,
+    capture_layouts, capture_scrambled, unpack)
+from pcie_analyzer.software.code_8b10b import Decoder
+from pcie_analyzer.software.scrambling import Descrambler
+from pcie_analyzer.software.framing import frame_stream, packet_layout
+from pcie_analyzer.software.profiling import Profiler
+
+# Constants ----------------------------------------------------------------------------------------
+
+ARCHIVE_MAGIC   = b"PCIECAPZ"
+ARCHIVE_VERSION = 1
+
+archive_header = struct.Struct("<8sHBBIQIQ") # Followed by format name and layout (JSON).
+archive_format = struct.Struct("<HI")        # Format name and layout lengths.
+
+archive_codecs = {
+    "zlib": 1,
+    "lzma": 2,
+    "zstd": 3,
+}
+
+chunk_layout = np.dtype([
+    ("offset", "<u8"),
+    ("size",   "<u4"),
+    ("crc",    "<u4"),
+])
+
+# Codecs -------------------------------------------------------------------------------------------
+
+def _check_codec(codec):
+    if codec not in archive_codecs:
+        raise ValueError("Unknown codec {}, supported: {}".format(codec, ", ".join(archive_codecs)))
+    if codec == "zstd" and zstandard is None:
+        raise ValueError("zstd codec requires the zstandard module")
+
+def _compress(codec, level, datas):
+    if codec == "zlib":
+        compressed = zlib.compress(datas, 6 if level is None else level)
+    elif codec == "lzma":
+        compressed = lzma.compress(datas, preset=6 if level is None else level)
+    else:
+        compressed = zstandard.ZstdCompressor(level=3 if level is None else level).compress(datas)
+    return compressed, zlib.crc32(datas)
+
+def _decompress(codec, datas):
+    if codec == "zlib":
+        return zlib.decompress(datas)
+    elif codec == "lzma":
+        return lzma.decompress(datas)
+    else:
+        return zstandard.ZstdDecompressor().decompress(datas)
+
+def index_filename(filename):
+    return filename + ".idx.npy"
+
+# Writer -------------------------------------------------------------------------------------------
+
+class ArchiveWriter:
+    """Archive Writer
+
+    Chunks are compressed in a pool of `jobs` processes (default: CPUs, 0: in this process) with at
+    most 2 chunks per process in flight, so memory use is bounded whatever the capture size.
+    """
+    def __init__(self, filename, format="netv2", codec="zlib", level=None,
+        chunk_size=1024*1024, jobs=None):
+        _check_codec(codec)
+        capture_format(format)
+        name   = format.encode()
+        layout = json.dumps(capture_layouts.get(format)).encode()
+        if len(name) >= 2**16:
+            raise ValueError("Capture format name too long: {}".format(format))
+        word_size       = capture_formats[format][0]
+        self.format     = format
+        self.codec      = codec
+        self.level      = level
+        self.chunk_size = max(chunk_size - chunk_size%word_size, word_size)
+        self.size       = 0
+        self.table      = []
+        self.buffer     = bytearray()
+        self.pool       = multiprocessing.Pool(jobs) if jobs != 0 else None
+        self.window     = 2*(jobs or os.cpu_count() or 1)
+        self.pending    = []
+        self.file       = open(filename, "wb")
+        self.file.write(bytes(archive_header.size))
+        self.file.write(archive_format.pack(len(name), len(layout)) + name + layout)
+
+    def write(self, datas):
+        self.buffer += datas
+        while len(self.buffer) >= self.chunk_size:
+            self._submit(bytes(self.buffer[:self.chunk_size]))
+            del self.buffer[:self.chunk_size]
+
+    def _submit(self, datas):
+        self.size += len(datas)
+        if self.pool is None:
+            self._store(*_compress(self.codec, self.level, datas))
+            return
+        self.pending.append(self.pool.apply_async(_compress, (self.codec, self.level, datas)))
+        while len(self.pending) >= self.window:
+            self._store(*self.pending.pop(0).get())
+
+    def _store(self, compressed, crc):
+        self.table.append((self.file.tell(), len(compressed), crc))
+        self.file.write(compressed)
+
+    def close(self):
+        if len(self.buffer):
+            self._submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        for result in self.pending:
+            self._store(*result.get())
+        self.pending = []
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+        table_offset = self.file.tell()
+        self.file.write(np.array(self.table, dtype=chunk_layout).tobytes())
+        self.file.seek(0)
+        self.file.write(archive_header.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION,
+            archive_codecs[self.codec], 0xff if self.level is None else self.level,
+            self.chunk_size, self.size, len(self.table), table_offset))
+        self.file.close()
+
+
+def compress(filename, archive, format="netv2", codec="zlib", level=None, chunk_size=1024*1024,
+    jobs=None, index=True):
+    """Compress a capture file to an archive, optionally building its sidecar packet index."""
+    writer = ArchiveWriter(archive, format, codec, level, chunk_size, jobs)
+    reader = CaptureReader(filename, format, writer.chunk_size)
+    with open(filename, "rb") as f:
+        while True:
+            datas = f.read(writer.chunk_size)
+            if not datas:
+                break
+            writer.write(datas)
+    writer.close()
+    if index:
+        np.save(index_filename(archive), build_index(reader))
+
+def build_index(reader):
+    """Build the packet index of a capture (CaptureReader/ArchiveReader): absolute offsets."""
+    indexes = []
+    for offset, data, ctrl, packets in frame_stream(reader):
+        packets["offset"] += offset
+        indexes.append(packets)
+    return np.concatenate(indexes) if indexes else np.zeros(0, dtype=packet_layout)
+
+# Reader -------------------------------------------------------------------------------------------
+
+class ArchiveReader:
+    """Archive Reader
+
+    Gives random access to the decompressed capture (bytes, symbols, time range, indexed packets)
+    and iterates over it chunk by chunk as a CaptureReader. The last `cache_size` decompressed
+    chunks are cached. The "read" (decompression) and "unpack" stages are timed in `profiler`.
+    """
+    def __init__(self, filename, cache_size=16, profiler=None):
+        self.filename = filename
+        self.profiler = profiler or Profiler()
+        self.file     = open(filename, "rb")
+        header = archive_header.unpack(self.file.read(archive_header.size))
+        magic, version, codec, self.level, self.chunk_size, self.size, nchunks, table_offset = header
+        if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION:
+            raise ValueError("{} is not a capture archive".format(filename))
+        name_length, layout_length = archive_format.unpack(self.file.read(archive_format.size))
+        self.format = self.file.read(name_length).decode()
+        layout      = json.loads(self.file.read(layout_length).decode())
+        if self.format not in capture_formats and layout is not None:
+            capture_layouts[self.format] = layout
+            capture_formats[self.format] = (layout["word_size"], layout["symbols_per_word"])
+        self.codec  = {v: k for k, v in archive_codecs.items()}[codec]
+        self.level  = None if self.level == 0xff else self.level
+        self.word_size, self.symbols_per_word = capture_formats[self.format]
+        self.scrambled = capture_scrambled(self.format)
+        self.file.seek(table_offset)
+        self.table  = np.frombuffer(self.file.read(nchunks*chunk_layout.itemsize), dtype=chunk_layout)
+        self.cache  = OrderedDict()
+        self.cache_size = cache_size
+        self._index = None
+
+    @property
+    def symbols(self):
+        return (self.size//self.word_size)*self.symbols_per_word
+
+    @property
+    def index(self):
+        """Sidecar packet index (memory-mapped), None if not available."""
+        if self._index is None and os.path.exists(index_filename(self.filename)):
+            self._index = np.load(index_filename(self.filename), mmap_mode="r")
+        return self._index
+
+    def chunk(self, n):
+        """Decompressed chunk n (bytes)."""
+        if n in self.cache:
+            self.cache.move_to_end(n)
+            return self.cache[n]
+        entry = self.table[n]
+        with self.profiler.stage("read") as stage:
+            self.file.seek(int(entry["offset"]))
+            datas = _decompress(self.codec, self.file.read(int(entry["size"])))
+            if zlib.crc32(datas) != entry["crc"]:
+                raise ValueError("CRC error on chunk {}".format(n))
+            stage.output(len(datas))
+        self.cache[n] = datas
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return datas
+
+    def read(self, offset, length):
+        """Read `length` bytes at `offset`, only decompressing the chunks covering them."""
+        offset = max(offset, 0)
+        length = max(min(length, self.size - offset), 0)
+        datas  = bytearray()
+        for n in range(offset//self.chunk_size, (offset + length + self.chunk_size - 1)//self.chunk_size):
+            chunk = self.chunk(n)
+            start = max(offset - n*self.chunk_size, 0)
+            datas += chunk[start:start + length - len(datas)]
+        return bytes(datas)
+
+    def _unpack(self, datas, decoder=None):
+        with self.profiler.stage("unpack", len(datas)) as stage:
+            data, ctrl = unpack(datas, self.format, decoder)
+            stage.output(data.nbytes + ctrl.nbytes)
+        return data, ctrl
+
+    def read_symbols(self, start, count):
+        """Read `count` raw (as recorded) symbols from symbol `start`, returns (data, ctrl)."""
+        first = start//self.symbols_per_word
+        last  = (start + count + self.symbols_per_word - 1)//self.symbols_per_word
+        data, ctrl = self._unpack(self.read(first*self.word_size, (last - first)*self.word_size))
+        skip = start - first*self.symbols_per_word
+        return data[skip:skip + count], ctrl[skip:skip + count]
+
+    def read_plain(self, start, count, lookback=4096):
+        """Read `count` descrambled symbols from symbol `start`.
+
+        Descrambling starts `lookback` symbols before to synchronize on a COM (SKP Ordered Sets are
+        sent at most every 1538 symbols). Symbols of captures recorded descrambled are returned
+        unchanged. Returns (data, ctrl, synchronized).
+        """
+        if not self.scrambled:
+            data, ctrl = self.read_symbols(start, count)
+            return data, ctrl, np.ones(len(data), dtype=bool)
+        begin = max(start - lookback, 0)
+        data, ctrl = self.read_symbols(begin, start - begin + count)
+        plain, synchronized = Descrambler().process(data, ctrl)
+        s = slice(start - begin, start - begin + count)
+        return plain[s], ctrl[s], synchronized[s]
+
+    def read_time(self, start, end, symbol_period=4.0):
+        """Read raw symbols between `start` and `end` (ns from capture start), returns (offset,
+        data, ctrl)."""
+        first = int(start//symbol_period)
+        last  = int(-(-end//symbol_period))
+        data, ctrl = self.read_symbols(first, last - first)
+        return first, data, ctrl
+
+    def read_packet(self, packet):
+        """Read the plain symbols of a packet of the sidecar index (or any absolute packet)."""
+        data, _, _ = self.read_plain(int(packet["offset"]), int(packet["length"]))
+        return data
+
+    @property
+    def nchunks(self):
+        return len(self.table)
+
+    def read_chunk(self, n):
+        """Chunk n as a (symbol offset, data, ctrl) tuple."""
+        datas = self.chunk(n)
+        data, ctrl = self._unpack(datas[:len(datas) - len(datas)%self.word_size])
+        return n*(self.chunk_size//self.word_size)*self.symbols_per_word, data, ctrl
+
+    def __iter__(self):
+        decoder = Decoder() if self.format == "raw20" else None
+        offset  = 0
+        for n in range(len(self.table)):
+            datas = self.chunk(n)
+            data, ctrl = self._unpack(datas[:len(datas) - len(datas)%self.word_size], decoder)
+            yield offset, data, ctrl
+            offset += len(data)
+
+    def close(self):
+        self.file.close()
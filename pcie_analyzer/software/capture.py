@@ -0,0 +1,212 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+"""
+Capture files as uploaded from the recorders, read in chunks as (data, ctrl) symbol arrays.
+
+Formats:
+- netv2: 128-bit words, 12 symbols per word: data in bits [0:96], ctrl in bits [96:108].
+- ac701: 32-bit words, GTP source raw bits: 2 symbols per word, data in [0:16], ctrl in [16:18].
+- raw20: 32-bit words, 2 raw 10-bit symbols per word (not 8b/10b decoded, see code_8b10b).
+- layout.json:recorder: recorder described in the capture layout generated with the gateware
+  (see pcie_analyzer/soc.py), ex: tools/capture_layout.json:rx_dma_recorder.
+
+Unless the layout says otherwise, symbols are recorded scrambled and with SKP Ordered Sets. Words
+of descrambled captures recorded before the gateware Descrambler synchronization (sync flag not
+set) are unpacked as Logical Idle. The recorders don't store timestamps:
+symbol times are deduced from their index and the symbol period (4ns at 2.5GT/s).
+"""
+
+import os
+import json
+
+import numpy as np
+
+from pcie_analyzer.software.code_8b10b import Decoder, Encoder, unpack_raw20, pack_raw20
+from pcie_analyzer.software.profiling import Profiler
+
+# Formats ------------------------------------------------------------------------------------------
+
+# name: (word size in bytes, symbols per word)
+capture_formats = {
+    "netv2": (16, 12),
+    "ac701": ( 4,  2),
+    "raw20": ( 4,  2),
+}
+
+symbol_periods = {
+    "gen1": 4.0, # ns, 2.5GT/s.
+    "gen2": 2.0, # ns, 5.0GT/s.
+}
+
+# name: recorded word layout (offsets in bits), see PCIeAnalyzerSoC.get_capture_layout.
+capture_layouts = {
+    "netv2": dict(word_size=16, symbols_per_word=12, data_offset=0, ctrl_offset=96,
+        scrambled=True, skp_removed=False, filtered=False),
+    "ac701": dict(word_size=4, symbols_per_word=2, data_offset=0, ctrl_offset=16,
+        scrambled=True, skp_removed=False, filtered=False),
+}
+
+def load_capture_layout(filename):
+    """Register the recorders of a capture layout file as "filename:recorder" formats."""
+    with open(filename) as f:
+        layout = json.load(f)
+    names = []
+    for recorder, entry in layout["recorders"].items():
+        name = filename + ":" + recorder
+        capture_layouts[name] = entry
+        capture_formats[name] = (entry["word_size"], entry["symbols_per_word"])
+        names.append(name)
+    return names
+
+def capture_format(format):
+    """Check a format name, loading its capture layout file when needed."""
+    if format not in capture_formats:
+        filename, _, recorder = format.rpartition(":")
+        if not filename or not os.path.exists(filename):
+            raise ValueError("Unknown capture format {}".format(format))
+        if load_capture_layout(filename) and format not in capture_formats:
+            raise ValueError("No {} recorder in {}".format(recorder, filename))
+    return format
+
+def unpack_words(datas, word_size, symbols_per_word, data_offset=0, ctrl_offset=None,
+    sync_offset=None):
+    words = np.frombuffer(datas, dtype=np.uint8).reshape(-1, word_size)
+    n     = symbols_per_word
+    if ctrl_offset is None:
+        ctrl_offset = data_offset + 8*n
+    data  = words[:, data_offset//8:data_offset//8 + n].reshape(-1)
+    start = ctrl_offset//8
+    end   = (ctrl_offset + n + 7)//8
+    ctrl  = np.unpackbits(words[:, start:end], axis=1, bitorder="little")
+    ctrl  = ctrl[:, ctrl_offset%8:ctrl_offset%8 + n].reshape(-1).astype(bool)
+    if sync_offset is not None:
+        synced = (words[:, sync_offset//8] >> (sync_offset%8)) & 0b1
+        if not synced.all():
+            unsynced = np.repeat(synced == 0, n)
+            data = data.copy()
+            data[unsynced] = 0
+            ctrl[unsynced] = False
+    return data, ctrl
+
+def unpack(datas, format, decoder=None):
+    """Unpack whole words of a capture to (data, ctrl) symbol arrays."""
+    if format == "raw20":
+        data, ctrl, _, _ = (decoder or Decoder()).decode(unpack_raw20(datas))
+        return data, ctrl
+    layout = capture_layouts[format]
+    return unpack_words(datas, layout["word_size"], layout["symbols_per_word"],
+        layout["data_offset"], layout["ctrl_offset"], layout.get("sync_offset"))
+
+def unpack_netv2(datas):
+    return unpack(datas, "netv2")
+
+def unpack_ac701(datas):
+    return unpack(datas, "ac701")
+
+def pack_words(data, ctrl, word_size, symbols_per_word, data_offset=0, ctrl_offset=None,
+    sync_offset=None, synced=True):
+    """Pack (data, ctrl) symbol arrays (whole words) to recorded words, inverse of unpack_words.
+
+    `synced` is the sync flag of the words (one per word or the same for all)."""
+    n     = symbols_per_word
+    data  = np.asarray(data, dtype=np.uint8).reshape(-1, n)
+    ctrl  = np.asarray(ctrl, dtype=np.uint8).reshape(-1, n)
+    words = np.zeros((len(data), word_size), dtype=np.uint8)
+    if ctrl_offset is None:
+        ctrl_offset = data_offset + 8*n
+    words[:, data_offset//8:data_offset//8 + n] = data
+    start = ctrl_offset//8
+    end   = (ctrl_offset + n + 7)//8
+    bits  = np.zeros((len(ctrl), 8*(end - start)), dtype=np.uint8)
+    bits[:, ctrl_offset%8:ctrl_offset%8 + n] = ctrl
+    words[:, start:end] |= np.packbits(bits, axis=1, bitorder="little")
+    if sync_offset is not None:
+        words[:, sync_offset//8] |= (np.asarray(synced, dtype=np.uint8) & 0b1) << (sync_offset%8)
+    return words.tobytes()
+
+def pack(data, ctrl, format, encoder=None, synced=True):
+    """Pack (data, ctrl) symbol arrays (whole words) to capture words, inverse of unpack."""
+    if format == "raw20":
+        return pack_raw20((encoder or Encoder()).encode(data, ctrl))
+    layout = capture_layouts[format]
+    return pack_words(data, ctrl, layout["word_size"], layout["symbols_per_word"],
+        layout["data_offset"], layout["ctrl_offset"], layout.get("sync_offset"), synced)
+
+def capture_scrambled(format):
+    return capture_layouts.get(format, {}).get("scrambled", True)
+
+def capture_skp_removed(format):
+    return capture_layouts.get(format, {}).get("skp_removed", False)
+
+def capture_filtered(format):
+    return capture_layouts.get(format, {}).get("filtered", False)
+
+# Reader -------------------------------------------------------------------------------------------
+
+class CaptureReader:
+    """Capture Reader
+
+    Iterates over a capture file in chunks of about `chunk_size` bytes, yielding
+    (symbol offset, data, ctrl) tuples. Memory use is bounded by the chunk size. The "read" and
+    "unpack" stages are timed in `profiler`.
+    """
+    def __init__(self, filename, format="netv2", chunk_size=4*1024*1024, profiler=None):
+        capture_format(format)
+        self.filename   = filename
+        self.format     = format
+        self.profiler   = profiler or Profiler()
+        self.word_size, self.symbols_per_word = capture_formats[format]
+        self.chunk_size = max(chunk_size - chunk_size%self.word_size, self.word_size)
+
+    @property
+    def size(self):
+        return os.path.getsize(self.filename)
+
+    @property
+    def scrambled(self):
+        return capture_scrambled(self.format)
+
+    @property
+    def symbols(self):
+        return (self.size//self.word_size)*self.symbols_per_word
+
+    @property
+    def nchunks(self):
+        return (self.size//self.word_size*self.word_size + self.chunk_size - 1)//self.chunk_size
+
+    def read_words(self, first, count):
+        """Words first to first + count - 1 as a (symbol offset, data, ctrl) tuple."""
+        with open(self.filename, "rb") as f:
+            with self.profiler.stage("read") as stage:
+                f.seek(first*self.word_size)
+                datas = f.read(count*self.word_size)
+                datas = datas[:len(datas) - len(datas)%self.word_size]
+                stage.output(len(datas))
+        decoder = Decoder() if self.format == "raw20" else None # Symbols don't depend on the RD.
+        with self.profiler.stage("unpack", len(datas)) as stage:
+            data, ctrl = unpack(datas, self.format, decoder)
+            stage.output(data.nbytes + ctrl.nbytes)
+        return first*self.symbols_per_word, data, ctrl
+
+    def read_chunk(self, n):
+        """Chunk n as a (symbol offset, data, ctrl) tuple."""
+        words = self.chunk_size//self.word_size
+        return self.read_words(n*words, words)
+
+    def __iter__(self):
+        decoder = Decoder() if self.format == "raw20" else None
+        offset  = 0
+        with open(self.filename, "rb") as f:
+            while True:
+                with self.profiler.stage("read") as stage:
+                    datas = f.read(self.chunk_size)
+                    datas = datas[:len(datas) - len(datas)%self.word_size]
+                    stage.output(len(datas))
+                if not datas:
+                    break
+                with self.profiler.stage("unpack", len(datas)) as stage:
+                    data, ctrl = unpack(datas, self.format, decoder)
+                    stage.output(data.nbytes + ctrl.nbytes)
+                yield offset, data, ctrl
+                offset += len(data)
@@ -0,0 +1,216 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+"""
+Shared cache of decoded capture chunks.
+
+Descrambled and framed chunks (framing.Framer results) are stored in a cache directory shared by
+all the tools/processes of the machine, so that a capture opened again (by the same or another
+tool) is not descrambled and framed again. Entries are keyed on the capture content hash, the
+chunk index and the pipeline configuration (format/layout, chunk size, descrambling, max packet
+size) and hold the symbol/packet arrays as .npy files, memory-mapped when read, along with the
+Framer state after the chunk: processing can resume after any cached chunk.
+
+Entries are written to a temporary directory and renamed (concurrent processes never see partial
+entries), their mtime is refreshed on each hit and the least recently used entries are removed
+when the cache exceeds `max_size` bytes. Use a tmpfs directory (ex: /dev/shm/pcie_analyzer) to
+keep the cache in shared memory.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+
+import numpy as np
+
+from pcie_analyzer.software.capture import capture_layouts
+from pcie_analyzer.software.framing import Framer
+from pcie_analyzer.software.profiling import Profiler
+
+CHUNK_CACHE_VERSION = 1
+
+default_cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "pcie_analyzer", "chunks")
+
+# Chunk Cache --------------------------------------------------------------------------------------
+
+class ChunkCache:
+    """Chunk Cache
+
+    `frame_stream` replaces framing.frame_stream for readers with random chunk access
+    (CaptureReader, ArchiveReader). `hits`/`misses` count the cached/processed chunks.
+    """
+    def __init__(self, directory=default_cache_dir, max_size=4*1024**3):
+        self.directory = os.path.abspath(directory)
+        self.max_size  = max_size
+        self.hits      = 0
+        self.misses    = 0
+        self.size      = None # Estimated size (bytes), updated on stores.
+        os.makedirs(os.path.join(self.directory, "captures"), exist_ok=True)
+
+    # Keys -----------------------------------------------------------------------------------------
+
+    def capture_hash(self, filename, block_size=16*1024*1024):
+        """SHA-256 of a capture file, remembered for its path/size/mtime so that it is only
+        computed once per file version."""
+        st  = os.stat(filename)
+        ref = "{}:{}:{}:{}".format(os.path.realpath(filename), st.st_ino, st.st_size, st.st_mtime_ns)
+        ref = os.path.join(self.directory, "captures", hashlib.sha256(ref.encode()).hexdigest())
+        try:
+            with open(ref) as f:
+                return f.read().strip()
+        except OSError:
+            pass
+        h = hashlib.sha256()
+        with open(filename, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                h.update(block)
+        tmp = ref + ".tmp{}".format(os.getpid())
+        with open(tmp, "w") as f:
+            f.write(h.hexdigest())
+        os.replace(tmp, ref)
+        return h.hexdigest()
+
+    def key(self, capture, n, config):
+        config = json.dumps(dict(config, version=CHUNK_CACHE_VERSION), sort_keys=True)
+        return hashlib.sha256("{}:{:d}:{}".format(capture, n, config).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    # Entries --------------------------------------------------------------------------------------
+
+    def load(self, key):
+        """Returns (meta, offset, data, ctrl, packets) of a cached chunk (data/ctrl memory-mapped)
+        or None on miss."""
+        path = self.path(key)
+        try:
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+            data    = np.load(os.path.join(path, "data.npy"), mmap_mode="r")
+            ctrl    = np.load(os.path.join(path, "ctrl.npy"), mmap_mode="r")
+            packets = np.load(os.path.join(path, "packets.npy")) # Small, modified by some tools.
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return meta, meta["offset"], data, ctrl, packets
+
+    def store(self, key, meta, data, ctrl, packets):
+        path = self.path(key)
+        tmp  = path + ".tmp{}".format(os.getpid())
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, "data.npy"),    np.asarray(data,    dtype=np.uint8))
+        np.save(os.path.join(tmp, "ctrl.npy"),    np.asarray(ctrl,    dtype=bool))
+        np.save(os.path.join(tmp, "packets.npy"), np.asarray(packets))
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        size = sum(os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp))
+        try:
+            os.rename(tmp, path)
+        except OSError: # Stored by another process.
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        if self.size is None:
+            self.size = self.scan()[1]
+        else:
+            self.size += size
+        if self.size > self.max_size:
+            self.evict()
+
+    def scan(self):
+        """Returns the entries as (mtime, size, path) sorted from the least recently used, and
+        their total size."""
+        entries = []
+        for prefix in os.scandir(self.directory):
+            if not prefix.is_dir() or len(prefix.name) != 2:
+                continue
+            for entry in os.scandir(prefix.path):
+                if ".tmp" in entry.name:
+                    continue
+                try:
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                    entries.append((entry.stat().st_mtime_ns, size, entry.path))
+                except OSError: # Evicted by another process.
+                    pass
+        entries.sort()
+        return entries, sum(size for _, size, _ in entries)
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is under `max_size`."""
+        entries, self.size = self.scan()
+        for mtime, size, path in entries:
+            if self.size <= self.max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            self.size -= size
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(os.path.join(self.directory, "captures"), exist_ok=True)
+        self.size = 0
+
+    # Frame Stream ---------------------------------------------------------------------------------
+
+    def frame_stream(self, reader, stats=None, max_packet_size=8192, descramble=None, profiler=None,
+        first=0, last=None):
+        """Descramble and frame chunks `first` to `last` (excluded, default: all) of `reader`
+        (see framing.frame_stream), from the cache when available.
+
+        Processing starts after the last cached chunk before `first` (from the capture start
+        otherwise). Processed chunks are stored in the cache, `stats` only count the yielded ones.
+        """
+        if descramble is None:
+            descramble = getattr(reader, "scrambled", True)
+        if profiler is None:
+            profiler = getattr(reader, "profiler", None) or Profiler()
+        stats   = {} if stats is None else stats
+        framer  = Framer(stats, max_packet_size, descramble, profiler)
+        last    = reader.nchunks if last is None else min(last, reader.nchunks)
+        first   = min(first, last)
+        capture = self.capture_hash(reader.filename)
+        config  = {
+            "format"          : reader.format,
+            "layout"          : capture_layouts.get(reader.format),
+            "chunk_size"      : reader.chunk_size,
+            "descramble"      : bool(descramble),
+            "max_packet_size" : max_packet_size,
+        }
+        keys = [self.key(capture, n, config) for n in range(last)]
+
+        # Resume after the last cached chunk before first.
+        start = 0
+        for n in reversed(range(first)):
+            entry = self.load(keys[n])
+            if entry is not None:
+                meta, _, data, ctrl, _ = entry
+                framer.restore(meta["framer"], data, ctrl)
+                start = n + 1
+                break
+
+        for n in range(start, last):
+            with profiler.stage("cache") as stage:
+                entry = self.load(keys[n])
+                if entry is not None:
+                    meta, offset, data, ctrl, packets = entry
+                    framer.restore(meta["framer"], data, ctrl)
+                    stage.output(data.nbytes + ctrl.nbytes + packets.nbytes)
+            if entry is not None:
+                self.hits += 1
+                if n >= first:
+                    for name, value in meta["stats"].items():
+                        stats[name] = stats.get(name, 0) + value
+            else:
+                self.misses += 1
+                before = dict(stats)
+                offset, data, ctrl, packets = framer.process(*reader.read_chunk(n))
+                with profiler.stage("cache_store", data.nbytes + ctrl.nbytes + packets.nbytes):
+                    self.store(keys[n], {
+                        "offset" : int(offset),
+                        "framer" : framer.state(),
+                        "stats"  : {name: stats[name] - before.get(name, 0) for name in stats},
+                    }, data, ctrl, packets)
+                if n < first:
+                    stats.update(before)
+            if n >= first:
+                yield offset, data, ctrl, packets
@@ -0,0 +1,214 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+"""
+PCIe packet framing for plain (descrambled) captures.
+
+Packets are located with NumPy on (data, ctrl) symbol arrays: TLPs are framed by STP ... END and
+DLLPs by SDP ... END, nullified TLPs end with EDB. Framed packets are returned as a structured
+array (one row per packet) referencing the symbol arrays, so that later stages (CRC checks, header
+decoding, export) can work column-wise on millions of packets.
+"""
+
+import numpy as np
+
+from pcie_analyzer.software.scrambling import Descrambler
+from pcie_analyzer.software.profiling import Profiler
+
+# Helpers ------------------------------------------------------------------------------------------
+
+def K(x, y):
+    """K code generator ex: K(28, 5) is COM Symbol"""
+    return (y << 5) | x
+
+COM = K(28, 5)
+SKP = K(28, 0)
+STP = K(27, 7)
+SDP = K(28, 2)
+END = K(29, 7)
+EDB = K(30, 7)
+GAP = K(28, 4) # Marker of a packet dropped by the gateware packet filter.
+
+# Packets ------------------------------------------------------------------------------------------
+
+PACKET_TLP  = 0
+PACKET_DLLP = 1
+
+PACKET_FLAG_NULLIFIED = 0b01 # Ended by EDB.
+PACKET_FLAG_TRUNCATED = 0b10 # Interrupted by another STP/SDP before END/EDB.
+
+# offset: offset of the first symbol after STP/SDP, length: number of symbols before END/EDB.
+packet_layout = np.dtype([
+    ("offset", "<i8"),
+    ("length", "<i4"),
+    ("type",   "u1"),
+    ("flags",  "u1"),
+])
+
+def frame(data, ctrl):
+    """Frame TLPs/DLLPs in plain (data, ctrl) symbol arrays.
+
+    Returns (packets, consumed): `packets` is an array of `packet_layout` and `consumed` the number
+    of symbols that can be dropped by the caller; symbols after it belong to a packet that is not
+    complete yet and should be framed again with the next symbols when streaming.
+    """
+    data = np.asarray(data, dtype=np.uint8)
+    ctrl = np.asarray(ctrl, dtype=bool)
+
+    starts = np.flatnonzero(ctrl & ((data == STP) | (data == SDP)))
+    ends   = np.flatnonzero(ctrl & ((data == END) | (data == EDB)))
+
+    # Each start is paired with the first END/EDB after it, or truncated by the next start.
+    end        = np.append(ends, len(data))[np.searchsorted(ends, starts)]
+    complete   = end < len(data)
+    next_start = np.append(starts[1:], len(data))
+    truncated  = next_start < end
+    end        = np.minimum(end, next_start)
+    complete  |= truncated
+
+    # Last incomplete packet is kept for the next call.
+    consumed = len(data)
+    if len(starts) and not complete[-1]:
+        consumed  = int(starts[-1])
+        starts    = starts[:-1]
+        end       = end[:-1]
+        truncated = truncated[:-1]
+
+    packets = np.zeros(len(starts), dtype=packet_layout)
+    packets["offset"] = starts + 1
+    packets["length"] = end - starts - 1
+    packets["type"]   = np.where(data[starts] == STP, PACKET_TLP, PACKET_DLLP)
+    nullified = ~truncated & (data[np.minimum(end, len(data) - 1)] == EDB)
+    packets["flags"]  = np.where(nullified, PACKET_FLAG_NULLIFIED, 0)
+    packets["flags"] |= np.where(truncated, PACKET_FLAG_TRUNCATED, 0).astype(np.uint8)
+
+    return packets, consumed
+
+# Filtered captures --------------------------------------------------------------------------------
+
+def gaps(data, ctrl):
+    """Locate the markers left by the gateware packet filter (pcie_analyzer/packet_filter.py).
+
+    Each dropped packet is replaced by GAP followed by its 24-bit length in symbols (little endian).
+    Returns (offsets, lengths) of the complete markers.
+    """
+    data    = np.asarray(data, dtype=np.uint8)
+    ctrl    = np.asarray(ctrl, dtype=bool)
+    offsets = np.flatnonzero(ctrl & (data == GAP))
+    offsets = offsets[offsets + 4 <= len(data)]
+    lengths = np.zeros(len(offsets), dtype=np.int64)
+    for i in range(3):
+        lengths |= data[offsets + 1 + i].astype(np.int64) << 8*i
+    return offsets, lengths
+
+def unfiltered_offsets(offsets, gap_offsets, gap_lengths):
+    """Convert symbol `offsets` of a filtered capture to offsets on the link (as if the dropped
+    packets had been recorded), each marker standing for `gap_lengths` symbols."""
+    skipped = np.concatenate([[0], np.cumsum(np.asarray(gap_lengths, dtype=np.int64) - 4)])
+    return np.asarray(offsets) + skipped[np.searchsorted(gap_offsets, offsets)]
+
+# Streaming ----------------------------------------------------------------------------------------
+
+class Framer:
+    """Incremental descrambling and framing of consecutive capture chunks.
+
+    Only the boundary state is kept between chunks: the descrambler state and the symbols of a
+    packet spanning two chunks (at most `max_packet_size` symbols: longer unterminated packets are
+    dropped). Statistics are accumulated in the `stats` dict.
+
+    Captures recorded descrambled (gateware Descrambler or packet filter) are already plain: use
+    `descramble=False`. The "descramble" and "framing" stages are timed in `profiler`.
+    """
+    def __init__(self, stats=None, max_packet_size=8192, descramble=True, profiler=None):
+        self.descrambler     = Descrambler() if descramble else None
+        self.max_packet_size = max_packet_size
+        self.stats           = {} if stats is None else stats
+        self.profiler        = profiler or Profiler()
+        for name in ["symbols", "packets", "unsynchronized", "dropped_symbols"]:
+            self.stats.setdefault(name, 0)
+        self.tail_data   = np.zeros(0, dtype=np.uint8)
+        self.tail_ctrl   = np.zeros(0, dtype=bool)
+        self.tail_offset = 0
+
+    def process(self, offset, data, ctrl):
+        """Process the chunk at symbol `offset`, returns (offset, data, ctrl, packets) with plain
+        symbols starting at symbol `offset` and packets framed in them."""
+        stats = self.stats
+        if self.descrambler is not None:
+            with self.profiler.stage("descramble", data.nbytes + ctrl.nbytes) as stage:
+                data, synchronized = self.descrambler.process(data, ctrl)
+                stage.output(data.nbytes + ctrl.nbytes)
+            stats["unsynchronized"] += int(len(synchronized) - np.count_nonzero(synchronized))
+        stats["symbols"] += len(data)
+        with self.profiler.stage("framing", data.nbytes + ctrl.nbytes) as stage:
+            offset, data, ctrl, packets = self._frame(offset, data, ctrl)
+            stage.output(packets.nbytes)
+        return offset, data, ctrl, packets
+
+    def _frame(self, offset, data, ctrl):
+        stats = self.stats
+
+        # Frame with the unterminated packet of the previous chunk.
+        if len(self.tail_data):
+            data   = np.concatenate([self.tail_data, data])
+            ctrl   = np.concatenate([self.tail_ctrl, ctrl])
+            offset = self.tail_offset
+        packets, consumed = frame(data, ctrl)
+        stats["packets"] += len(packets)
+
+        # Keep GAP marker split between chunks.
+        last   = max(len(data) - 3, 0)
+        marker = np.flatnonzero(ctrl[last:] & (data[last:] == GAP))
+        if len(marker):
+            consumed = min(consumed, last + int(marker[0]))
+
+        # Keep unterminated packet.
+        if len(data) - consumed > self.max_packet_size:
+            stats["dropped_symbols"] += len(data) - consumed
+            consumed = len(data)
+        self.tail_data   = data[consumed:].copy()
+        self.tail_ctrl   = ctrl[consumed:].copy()
+        self.tail_offset = offset + consumed
+        return offset, data, ctrl, packets
+
+    def state(self):
+        """Boundary state after the last chunk (JSON serializable): descrambler state and length of
+        the unterminated packet (the last symbols of the last processed chunk)."""
+        d = self.descrambler
+        return {
+            "descrambler": None if d is None else [d.position, d.ts_left, d.com_pending],
+            "tail_offset": int(self.tail_offset),
+            "tail_length": len(self.tail_data),
+        }
+
+    def restore(self, state, data, ctrl):
+        """Resume after a chunk processed earlier: `state` and its returned (data, ctrl)."""
+        d = self.descrambler
+        if d is not None:
+            d.position, d.ts_left, d.com_pending = state["descrambler"]
+        n = state["tail_length"]
+        self.tail_data   = np.array(data[len(data) - n:], dtype=np.uint8)
+        self.tail_ctrl   = np.array(ctrl[len(ctrl) - n:], dtype=bool)
+        self.tail_offset = state["tail_offset"]
+
+
+def frame_stream(chunks, stats=None, max_packet_size=8192, descramble=None, profiler=None,
+    cache=None):
+    """Descramble and frame a stream of (symbol offset, data, ctrl) capture chunks.
+
+    Yields (offset, data, ctrl, packets) tuples with plain symbols starting at symbol `offset` and
+    packets framed in them (see Framer). By default, chunks are descrambled unless their reader
+    (CaptureReader) reports a capture recorded descrambled. Stages are timed in `profiler` (default:
+    the reader's one). With a chunk_cache.ChunkCache `cache`, chunks are taken from/stored to the
+    cache (readers with random chunk access only).
+    """
+    if cache is not None:
+        yield from cache.frame_stream(chunks, stats, max_packet_size, descramble, profiler)
+        return
+    if descramble is None:
+        descramble = getattr(chunks, "scrambled", True)
+    if profiler is None:
+        profiler = getattr(chunks, "profiler", None)
+    framer = Framer(stats, max_packet_size, descramble, profiler)
+    for offset, data, ctrl in chunks:
+        yield framer.process(offset, data, ctrl)
@@ -0,0 +1,190 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+"""
+Incremental live decode of captures.
+
+Capture bytes are fed to a LiveDecoder as they are received (from a board upload or from a capture
+file being written) and go through the incremental pipeline: descrambling, SKP removal and framing
+(framing.Framer) and TLP header decode (tlp.decode). Only the boundary state is kept between
+chunks (partial word, descrambler state, unterminated packet). Bytes are decoded by chunks of
+`chunk_size` bytes or after `latency` seconds, whichever comes first.
+
+Decoded TLPs are published to a LiveView: a display thread calls a callback (default: print to the
+terminal) from a bounded queue. When the display can't keep up, the oldest pending display updates
+are dropped (and counted): decoding and the capture itself are never slowed down by the display.
+
+Stages (unpack, descramble, framing, decode, display) and the depths of the decoder input buffer
+and of the display queue are recorded in a profiling.Profiler.
+"""
+
+import os
+import sys
+import time
+import queue
+import threading
+
+from pcie_analyzer.software.capture import capture_formats, capture_format, capture_scrambled, unpack
+from pcie_analyzer.software.code_8b10b import Decoder
+from pcie_analyzer.software.framing import Framer
+from pcie_analyzer.software.tlp import decode, tlp_kind_names, tlp_completions
+from pcie_analyzer.software.profiling import Profiler
+
+# Live Decoder -------------------------------------------------------------------------------------
+
+class LiveDecoder:
+    """Incremental decoder of raw capture bytes to TLP tables (times in ns)."""
+    def __init__(self, format="netv2", symbol_period=4.0, start_time=0, chunk_size=64*1024,
+        latency=0.1, profiler=None):
+        self.format        = capture_format(format)
+        self.word_size     = capture_formats[format][0]
+        self.symbol_period = symbol_period
+        self.start_time    = start_time
+        self.chunk_size    = chunk_size
+        self.latency       = latency
+        self.stats         = {}
+        self.profiler      = profiler or Profiler()
+        self.framer        = Framer(self.stats, descramble=capture_scrambled(format),
+            profiler=self.profiler)
+        self.decoder       = Decoder() if format == "raw20" else None
+        self.pending       = bytearray()
+        self.pending_time  = None
+        self.offset        = 0 # Symbols.
+
+    def feed(self, datas):
+        """Feed received bytes, returns the Table of newly decoded TLPs (None if still buffered).
+
+        `datas` can be empty (no new data): buffered bytes are then decoded once `latency` elapsed.
+        """
+        if not datas and not self.pending:
+            return None
+        if not self.pending:
+            self.pending_time = time.monotonic()
+        self.pending += datas
+        self.profiler.queue("unpack", len(self.pending))
+        if (len(self.pending) >= self.chunk_size or
+            time.monotonic() - self.pending_time >= self.latency):
+            return self.flush()
+        return None
+
+    def flush(self):
+        """Decode all the buffered whole words, returns the Table of newly decoded TLPs."""
+        size  = len(self.pending) - len(self.pending)%self.word_size
+        datas = bytes(self.pending[:size])
+        del self.pending[:size]
+        self.pending_time = time.monotonic()
+        with self.profiler.stage("unpack", len(datas)) as stage:
+            data, ctrl = unpack(datas, self.format, self.decoder)
+            stage.output(data.nbytes + ctrl.nbytes)
+        offset, data, ctrl, packets = self.framer.process(self.offset, data, ctrl)
+        self.offset += size//self.word_size*capture_formats[self.format][1]
+        times = self.start_time + (offset + packets["offset"])*self.symbol_period
+        with self.profiler.stage("decode", packets.nbytes) as stage:
+            tlps = decode(data, packets, times)
+            stage.output(tlps.array.nbytes)
+        return tlps
+
+# Live View ----------------------------------------------------------------------------------------
+
+def format_tlp(tlp):
+    """One-line description of a decoded TLP (row of tlp.tlp_layout)."""
+    kind = tlp_kind_names.get(int(tlp["kind"]), "?")
+    line = "{:>14.0f}ns {:<8s} req {:04x} tag {:3d} len {:4d}".format(
+        tlp["time"], kind, tlp["requester_id"], tlp["tag"], tlp["length"])
+    if tlp["kind"] in tlp_completions:
+        line += " cpl {:04x} status {:d} bc {:d}".format(
+            tlp["completer_id"], tlp["status"], tlp["byte_count"])
+    elif tlp["address"]:
+        line += " addr 0x{:x}".format(tlp["address"])
+    if tlp["nullified"]:
+        line += " (nullified)"
+    return line
+
+
+class LiveView:
+    """Publishes decoded TLPs to `callback(tlps)` (default: terminal) from a display thread.
+
+    At most `queue_size` updates are pending: when full, the oldest update is dropped and its TLPs
+    counted in `dropped`.
+    """
+    def __init__(self, callback=None, queue_size=16, file=sys.stdout, profiler=None):
+        self.callback  = callback or self.print
+        self.queue     = queue.Queue(queue_size)
+        self.file      = file
+        self.profiler  = profiler or Profiler()
+        self.published = 0
+        self.dropped   = 0
+        self.thread    = threading.Thread(target=self._run, daemon=True)
+
+    def print(self, tlps):
+        for tlp in tlps:
+            print(format_tlp(tlp), file=self.file)
+        self.file.flush()
+
+    def start(self):
+        self.thread.start()
+
+    def publish(self, tlps):
+        """Publish a Table of TLPs (never blocks)."""
+        if tlps is None or not len(tlps):
+            return
+        self.published += len(tlps)
+        self.profiler.queue("display", self.queue.qsize())
+        while True:
+            try:
+                self.queue.put_nowait(tlps)
+                return
+            except queue.Full:
+                try:
+                    self.dropped += len(self.queue.get_nowait())
+                except queue.Empty:
+                    pass
+
+    def _run(self):
+        while True:
+            tlps = self.queue.get()
+            if tlps is None:
+                return
+            with self.profiler.stage("display", tlps.array.nbytes):
+                self.callback(tlps)
+
+    def stop(self):
+        """Display the pending updates and stop the display thread."""
+        self.queue.put(None)
+        self.thread.join()
+
+# Sources ------------------------------------------------------------------------------------------
+
+def follow(filename, chunk_size=64*1024, poll=0.05, stop=None, idle=None):
+    """Yield the bytes of a capture file as it grows (ex: being uploaded), until `stop` (a
+    threading.Event) is set or no data is written for `idle` seconds, at the end of the file.
+
+    b"" is yielded every `poll` seconds without new data, so that consumers can flush on time.
+    """
+    last = time.monotonic()
+    def done():
+        return ((stop is not None and stop.is_set()) or
+                (idle is not None and time.monotonic() - last > idle))
+    while not os.path.exists(filename):
+        if done():
+            return
+        time.sleep(poll)
+    with open(filename, "rb") as f:
+        while True:
+            datas = f.read(chunk_size)
+            if datas:
+                last = time.monotonic()
+                yield datas
+            elif done():
+                return
+            else:
+                time.sleep(poll)
+                yield b""
+
+
+def live(source, decoder, view):
+    """Decode the bytes of `source` and publish the TLPs to `view`, returns the decoder stats."""
+    for datas in source:
+        view.publish(decoder.feed(datas))
+    view.publish(decoder.flush())
+    return decoder.stats
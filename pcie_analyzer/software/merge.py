@@ -0,0 +1,114 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+"""
+Streaming k-way merge of timestamped capture streams into one timeline.
+
+Each stream (a direction, a lane or a board) yields time-ordered chunks of framed packets with
+their times, corrected by an optional clock hook (ex: ClockOffset). Streams are merged with a heap
+keyed on the time of the last packet of the current chunk of each stream: the top of the heap is
+the horizon up to which packets of all streams can be emitted. Packets before the horizon are
+merged in bulk with NumPy and the streams whose chunk is exhausted are refilled. Only one chunk per
+stream is held in memory.
+"""
+
+import heapq
+
+import numpy as np
+
+from pcie_analyzer.software.framing import frame_stream
+
+# Clock Correction ---------------------------------------------------------------------------------
+
+class ClockOffset:
+    """Linear clock correction: t' = t + offset + (t - reference)*drift_ppm/1e6 (ns)."""
+    def __init__(self, offset=0, drift_ppm=0.0, reference=0):
+        self.offset    = offset
+        self.drift_ppm = drift_ppm
+        self.reference = reference
+
+    def __call__(self, times):
+        times = times + self.offset
+        if self.drift_ppm:
+            times = times + np.round((times - self.reference)*self.drift_ppm/1e6).astype(np.int64)
+        return times
+
+# Streams ------------------------------------------------------------------------------------------
+
+def capture_stream(reader, symbol_period=4.0, start_time=0, clock=None):
+    """Timestamped packets of a capture (CaptureReader/ArchiveReader).
+
+    Yields (data, ctrl, packets, times) chunks, `times` in ns (int64) corrected by `clock`.
+    """
+    for offset, data, ctrl, packets in frame_stream(reader):
+        if not len(packets):
+            continue
+        times = start_time + np.round((offset + packets["offset"])*symbol_period).astype(np.int64)
+        if clock is not None:
+            times = clock(times)
+        yield data, ctrl, packets, times
+
+# Merge --------------------------------------------------------------------------------------------
+
+def merge(streams):
+    """Merge time-ordered streams of (data, ctrl, packets, times) chunks.
+
+    Yields (stream, data, ctrl, packets, times) batches in global time order: packets of all the
+    streams are gathered in a single batch (with their symbols), `stream` giving the stream index
+    of each packet. Packets with equal times are ordered by stream index within a batch.
+    """
+    streams = [iter(stream) for stream in streams]
+    chunks  = [None]*len(streams)
+    heap    = []
+
+    def load(i):
+        for chunk in streams[i]:
+            if len(chunk[2]):
+                chunks[i] = [chunk, 0]
+                heapq.heappush(heap, (int(chunk[3][-1]), i))
+                return
+        chunks[i] = None
+
+    for i in range(len(streams)):
+        load(i)
+
+    while heap:
+        horizon = heap[0][0]
+
+        # Packets of each stream up to the horizon.
+        parts = []
+        for i, current in enumerate(chunks):
+            if current is None:
+                continue
+            (data, ctrl, packets, times), position = current
+            end = position + int(np.searchsorted(times[position:], horizon, side="right"))
+            if end > position:
+                parts.append((i, data, ctrl, packets[position:end], times[position:end]))
+                current[1] = end
+
+        # Refill exhausted streams.
+        exhausted = []
+        while heap and heap[0][0] == horizon:
+            exhausted.append(heapq.heappop(heap)[1])
+        for i in exhausted:
+            load(i)
+
+        # Gather the symbols spanned by the packets of each part and sort by (time, stream).
+        stream_ids, datas, ctrls, packets, times = [], [], [], [], []
+        base = 0
+        for i, data, ctrl, p, t in parts:
+            begin = int(p["offset"].min())
+            end   = int((p["offset"] + p["length"]).max())
+            p = p.copy()
+            p["offset"] += base - begin
+            base += end - begin
+            stream_ids.append(np.full(len(p), i, dtype=np.uint16))
+            datas.append(data[begin:end])
+            ctrls.append(ctrl[begin:end])
+            packets.append(p)
+            times.append(t)
+        stream_ids = np.concatenate(stream_ids)
+        times      = np.concatenate(times)
+        order      = np.lexsort((stream_ids, times))
+        yield (stream_ids[order], np.concatenate(datas), np.concatenate(ctrls),
+            np.concatenate(packets)[order], times[order])
@@ -0,0 +1,275 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+"""
+Multi-board capture orchestrator.
+
+Drives several analyzer boards (each through a LiteX RemoteClient/litex_server) as one capture
+session:
+- configures the DMA recorders of all the boards.
+- arms them together: one thread per board, released by a barrier, writes the start CSRs. Each
+  board's arm time is estimated as the write time plus half its measured CSR round-trip time, so
+  the arm skew between boards is reported with an uncertainty of half the round-trip times.
+- waits for the recorders and uploads the captures of all the boards concurrently.
+  Uploads are checked against the CRCs computed in gateware (DRAM CRC unit) and corrupted blocks
+  are fetched again.
+- writes the captures and a manifest.json (boards, recorders, files, sizes, CRCs, arm times and
+  clock offsets to be used when merging the captures) to a single session directory.
+"""
+
+import os
+import json
+import time
+import zlib
+import threading
+import statistics
+
+from litex import RemoteClient
+
+from pcie_analyzer.software.profiling import Profiler
+
+# Board --------------------------------------------------------------------------------------------
+
+class Board:
+    """Analyzer board reached through a litex_server."""
+    def __init__(self, name, host="localhost", port=1234, csr_csv="csr.csv",
+        recorders=["rx_dma_recorder"], format="netv2", profiler=None):
+        self.name      = name
+        self.host      = host
+        self.port      = port
+        self.csr_csv   = csr_csv
+        self.recorders = recorders
+        self.format    = format
+        self.wb        = None
+        self.rtt       = None # ns.
+        self.armed     = None # ns (time.perf_counter_ns), estimated.
+        self.refetched = {}   # Blocks re-fetched during the verified uploads (per recorder).
+        self.profiler  = profiler or Profiler() # "upload" stage.
+
+    def open(self):
+        self.wb = RemoteClient(host=self.host, port=self.port, csr_csv=self.csr_csv)
+        self.wb.open()
+
+    def close(self):
+        self.wb.close()
+
+    def reg(self, recorder, name):
+        return getattr(self.wb.regs, recorder + "_" + name)
+
+    def measure_rtt(self, n=16):
+        """CSR round-trip time (median of `n` reads, ns)."""
+        done  = self.reg(self.recorders[0], "done")
+        times = []
+        for i in range(n):
+            start = time.perf_counter_ns()
+            done.read()
+            times.append(time.perf_counter_ns() - start)
+        self.rtt = int(statistics.median(times))
+        return self.rtt
+
+    def configure(self, length):
+        """Capture `length` bytes per recorder, recorders stored one after the other in DRAM."""
+        for i, recorder in enumerate(self.recorders):
+            self.reg(recorder, "base").write(i*length)
+            self.reg(recorder, "length").write(length)
+
+    def arm(self):
+        start = time.perf_counter_ns()
+        for recorder in self.recorders:
+            self.reg(recorder, "start").write(1)
+        # Start writes are posted: the arm time is the write time plus the one-way latency.
+        self.armed = start + self.rtt//2
+
+    def done(self):
+        return all(self.reg(recorder, "done").read() == 1 for recorder in self.recorders)
+
+    def has_dram_crc(self):
+        return hasattr(self.wb.regs, "dram_crc_start")
+
+    def dram_crc_start(self, offset, length, block_size):
+        """Start the gateware CRC-32 of a DRAM region (`offset` from the start of the DRAM)."""
+        self.wb.regs.dram_crc_base.write(offset)
+        self.wb.regs.dram_crc_length.write(length)
+        self.wb.regs.dram_crc_block_shift.write(block_size.bit_length() - 1)
+        self.wb.regs.dram_crc_start.write(1)
+
+    def dram_crc_results(self, timeout=10.0, period=0.001):
+        """Wait for the gateware CRC-32, returns the CRC of the region and the CRCs of its blocks."""
+        deadline = time.time() + timeout
+        while self.wb.regs.dram_crc_done.read() != 1:
+            if time.time() > deadline:
+                raise TimeoutError("DRAM CRC not done after {}s".format(timeout))
+            time.sleep(period)
+        crcs = []
+        for i in range(self.wb.regs.dram_crc_blocks.read()):
+            self.wb.regs.dram_crc_block_index.write(i)
+            crcs.append(self.wb.regs.dram_crc_block_crc.read())
+        return self.wb.regs.dram_crc_crc.read(), crcs
+
+    def upload(self, recorder, length, filename, burst=128, callback=None, verify=None,
+        block_size=64*1024, retries=3):
+        """Upload a recorder's capture to a file, returns its CRC-32.
+
+        `callback` is called with the uploaded bytes as they are received (ex: live.LiveDecoder).
+
+        With `verify` (default: when the board has a DRAM CRC unit), the gateware computes the CRC-32
+        of each `block_size` block of the capture in DRAM while it is uploaded, the blocks received
+        with a different CRC are fetched again (up to `retries` times) and rewritten in the file;
+        re-fetched blocks are not passed again to `callback`. The indexes of the re-fetched blocks
+        are stored in `refetched[recorder]`.
+        """
+        offset = self.recorders.index(recorder)*length
+        base   = self.wb.mems.main_ram.base + offset
+        if verify is None:
+            verify = self.has_dram_crc()
+        if verify:
+            nblocks = getattr(self.wb.constants, "dram_crc_nblocks", 1024)
+            while (length + block_size - 1)//block_size > nblocks:
+                block_size *= 2
+            self.dram_crc_start(offset, length, block_size)
+
+        def fetch(start, end):
+            with self.profiler.stage("upload") as stage:
+                datas = self.wb.read(base + start, length=(end - start)//4)
+                datas = b"".join(data.to_bytes(4, "little") for data in datas)
+                stage.output(len(datas))
+            return datas
+
+        # Upload (host CRCs of the blocks).
+        crc  = 0
+        crcs = []
+        with open(filename, "wb") as f:
+            for block in range(0, length, block_size):
+                block_crc = 0
+                for start in range(block, min(block + block_size, length), 4*burst):
+                    datas     = fetch(start, min(start + 4*burst, block + block_size, length))
+                    crc       = zlib.crc32(datas, crc)
+                    block_crc = zlib.crc32(datas, block_crc)
+                    f.write(datas)
+                    if callback is not None:
+                        callback(datas)
+                crcs.append(block_crc)
+        if not verify:
+            return crc
+
+        # Verify (re-fetch the blocks that don't match).
+        dram_crc, dram_crcs = self.dram_crc_results()
+        refetched = []
+        with open(filename, "r+b") as f:
+            for i, (block_crc, dram_block_crc) in enumerate(zip(crcs, dram_crcs)):
+                start = i*block_size
+                end   = min(start + block_size, length)
+                retry = 0
+                while block_crc != dram_block_crc:
+                    if retry == retries:
+                        raise IOError("{}: block {:d} of {} still corrupted after {:d} retries".format(
+                            self.name, i, recorder, retries))
+                    datas = b"".join(fetch(s, min(s + 4*burst, end)) for s in range(start, end, 4*burst))
+                    block_crc = zlib.crc32(datas)
+                    retry    += 1
+                if retry:
+                    f.seek(start)
+                    f.write(datas)
+                    refetched.append(i)
+        self.refetched[recorder] = refetched
+        # All blocks match: the file's CRC is the CRC of the region.
+        return dram_crc
+
+# Orchestrator -------------------------------------------------------------------------------------
+
+class Orchestrator:
+    """Orchestrates a capture session over several boards."""
+    def __init__(self, boards):
+        self.boards = boards
+
+    def _parallel(self, function):
+        """Run `function(board)` on all the boards in parallel, returns the results."""
+        results = [None]*len(self.boards)
+        errors  = []
+        def run(i, board):
+            try:
+                results[i] = function(board)
+            except Exception as e:
+                errors.append((board.name, e))
+        threads = [threading.Thread(target=run, args=(i, board)) for i, board in enumerate(self.boards)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise RuntimeError("; ".join("{}: {}".format(name, e) for name, e in errors))
+        return results
+
+    def open(self):
+        self._parallel(lambda board: board.open())
+
+    def close(self):
+        for board in self.boards:
+            if board.wb is not None:
+                board.close()
+
+    def arm(self, length):
+        """Configure and arm all the recorders together, returns the skew report."""
+        self._parallel(lambda board: board.configure(length))
+        self._parallel(lambda board: board.measure_rtt())
+        barrier = threading.Barrier(len(self.boards))
+        def arm(board):
+            barrier.wait()
+            board.arm()
+        self._parallel(arm)
+        reference = min(board.armed for board in self.boards)
+        return {
+            "skew_ns":        max(board.armed for board in self.boards) - reference,
+            "uncertainty_ns": max(board.rtt for board in self.boards)//2,
+            "offsets_ns":     {board.name: board.armed - reference for board in self.boards},
+        }
+
+    def wait(self, timeout=10.0, period=0.01):
+        """Wait for the recorders of all the boards."""
+        def wait(board):
+            deadline = time.time() + timeout
+            while not board.done():
+                if time.time() > deadline:
+                    raise TimeoutError("recorders not done after {}s".format(timeout))
+                time.sleep(period)
+        self._parallel(wait)
+
+    def upload(self, length, directory, verify=None):
+        """Upload the captures of all the boards (in parallel), returns the capture descriptions."""
+        def upload(board):
+            captures = []
+            for recorder in board.recorders:
+                filename = "{}_{}.bin".format(board.name, recorder)
+                crc = board.upload(recorder, length, os.path.join(directory, filename),
+                    verify=verify)
+                captures.append({"recorder": recorder, "file": filename, "size": length, "crc32": crc,
+                    "refetched_blocks": board.refetched.get(recorder)})
+            return captures
+        return self._parallel(upload)
+
+    def capture(self, directory, length, timeout=10.0, verify=None):
+        """Capture `length` bytes per recorder on all the boards to a session directory."""
+        os.makedirs(directory, exist_ok=True)
+        created = time.time()
+        skew    = self.arm(length)
+        self.wait(timeout)
+        captures = self.upload(length, directory, verify)
+        manifest = {
+            "created": created,
+            "skew":    skew,
+            "boards":  [],
+        }
+        for board, board_captures in zip(self.boards, captures):
+            manifest["boards"].append({
+                "name":     board.name,
+                "host":     board.host,
+                "port":     board.port,
+                "format":   board.format,
+                "rtt_ns":   board.rtt,
+                # To be applied to the board's capture times when merging (see merge.ClockOffset).
+                "clock_offset_ns": skew["offsets_ns"][board.name],
+                "captures": board_captures,
+            })
+        with open(os.path.join(directory, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=4)
+        return manifest
@@ -0,0 +1,280 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+"""
+Streaming pcapng export of PCIe captures.
+
+Captures are read, descrambled and framed chunk by chunk and written as pcapng Enhanced Packet
+Blocks. Blocks of a whole chunk are built at once with NumPy and written in large batches, so that
+memory use is bounded (chunk size + flush size) and export is I/O-bound.
+
+Packets use a user link type (LINKTYPE_USER0 by default, to be associated with a dissector in
+Wireshark) with the following payload:
+- 4-byte pseudo-header: packet type (0: TLP, 1: DLLP), framing flags (bit 0: nullified, bit 1:
+  truncated), CRC status (see crc.py, 0xff: not checked), reserved.
+- Packet symbols between STP/SDP and END/EDB: Sequence Number + TLP + LCRC or DLLP + CRC.
+Timestamps have a 1ns resolution.
+"""
+
+import os
+import struct
+import multiprocessing
+
+import numpy as np
+
+from pcie_analyzer.software.capture import CaptureReader
+from pcie_analyzer.software.framing import Framer, frame_stream, gaps, unfiltered_offsets
+from pcie_analyzer.software.crc import verify
+from pcie_analyzer.software.profiling import Profiler
+
+# Constants ----------------------------------------------------------------------------------------
+
+LINKTYPE_USER0 = 147
+
+BLOCK_SHB = 0x0a0d0d0a
+BLOCK_IDB = 0x00000001
+BLOCK_EPB = 0x00000006
+
+OPT_ENDOFOPT   = 0
+OPT_SHB_APPL   = 4
+OPT_IF_NAME    = 2
+OPT_IF_TSRESOL = 9
+
+CRC_NOT_CHECKED = 0xff
+
+# Helpers ------------------------------------------------------------------------------------------
+
+def _option(code, value):
+    return struct.pack("<HH", code, len(value)) + value + bytes(-len(value)%4)
+
+def _block(type, body):
+    length = 12 + len(body)
+    return struct.pack("<II", type, length) + body + struct.pack("<I", length)
+
+# Enhanced Packet Blocks ---------------------------------------------------------------------------
+
+def packet_blocks(data, packets, times, interface=0, status=None):
+    """Enhanced Packet Blocks of framed packets of a plain symbol array (uint8 array).
+
+    `times` (ns) and `interface` are given per packet (`interface` can also be a single ID).
+    """
+    if not len(packets):
+        return np.zeros(0, dtype=np.uint8)
+    offsets = packets["offset"].astype(np.int64)
+    lengths = packets["length"].astype(np.int64)
+    # Only keep the symbols spanned by the packets.
+    begin   = int(offsets.min())
+    data    = np.asarray(data[begin:int((offsets + lengths).max())], dtype=np.uint8)
+    offsets = offsets - begin
+    n       = len(packets)
+
+    # Block layout: 28-byte header, 4-byte pseudo-header, padded packet, 4-byte trailer. Every word
+    # of the block is written below (padding bytes are cleared with the last packet word).
+    captured = 4 + lengths
+    total    = 28 + ((captured + 3) & ~3) + 4
+    starts   = np.cumsum(total) - total
+    block    = np.empty(int(total.sum()), dtype=np.uint8)
+    words    = block.view("<u4")
+    w        = starts//4
+    times    = np.asarray(times, dtype=np.uint64)
+    if status is None:
+        status = np.full(n, CRC_NOT_CHECKED, dtype=np.uint8)
+    header = np.empty((n, 8), dtype="<u4")
+    header[:, 0] = BLOCK_EPB
+    header[:, 1] = total
+    header[:, 2] = interface
+    header[:, 3] = times >> np.uint64(32)
+    header[:, 4] = times & np.uint64(0xffffffff)
+    header[:, 5] = captured
+    header[:, 6] = captured
+    header[:, 7] = (packets["type"].astype(np.uint32) <<  0 |
+                    packets["flags"].astype(np.uint32) <<  8 |
+                    status.astype(np.uint32)           << 16)
+    words[w[:, None] + np.arange(8)] = header
+    words[w + total//4 - 1] = total
+
+    # Packet symbols, copied as 32-bit words from the 4 possible alignments of the data (aligned
+    # gathers are much faster than unaligned ones), bytes past the packet are cleared.
+    count   = (lengths + 3)//4
+    first   = np.cumsum(count) - count
+    size    = len(data)//4 + 1
+    aligned = np.empty(4*size, dtype="<u4")
+    for k in range(4):
+        shifted = data[k:k + 4*((len(data) - k)//4)].view("<u4")
+        aligned[k*size:k*size + len(shifted)] = shifted
+        aligned[k*size + len(shifted)] = int.from_bytes(data[k + 4*len(shifted):].tobytes(), "little")
+        aligned[k*size + len(shifted) + 1:(k + 1)*size] = 0
+    index   = np.arange(int(count.sum()))
+    dest    = np.repeat(w + 8 - first, count)
+    dest   += index
+    source  = np.repeat((offsets%4)*size + offsets//4 - first, count)
+    source += index
+    words[dest] = aligned[source]
+    last   = w + 8 + count - 1
+    words[last[lengths%4 != 0]] &= (0xffffffff >> (8*(-lengths%4)[lengths%4 != 0])).astype(np.uint32)
+
+    return block
+
+# Writer -------------------------------------------------------------------------------------------
+
+class PcapngWriter:
+    """pcapng Writer
+
+    Writes a Section Header Block, Interface Description Blocks and batches of Enhanced Packet
+    Blocks. Blocks are buffered until `flush_size` bytes are pending.
+    """
+    def __init__(self, filename, flush_size=32*1024*1024, application="pcie_analyzer"):
+        self.file         = open(filename, "wb")
+        self.flush_size   = flush_size
+        self.pending      = []
+        self.pending_size = 0
+        self.written      = 0 # Bytes of blocks (written or pending).
+        self.interfaces   = 0
+        body  = struct.pack("<IHHq", 0x1a2b3c4d, 1, 0, -1)
+        body += _option(OPT_SHB_APPL, application.encode())
+        body += _option(OPT_ENDOFOPT, b"")
+        self._write(_block(BLOCK_SHB, body))
+
+    def add_interface(self, name, linktype=LINKTYPE_USER0):
+        """Add an interface (ex: one per capture/direction), returns its ID."""
+        body  = struct.pack("<HHI", linktype, 0, 0)
+        body += _option(OPT_IF_NAME,    name.encode())
+        body += _option(OPT_IF_TSRESOL, bytes([9])) # 10^-9s.
+        body += _option(OPT_ENDOFOPT,   b"")
+        self._write(_block(BLOCK_IDB, body))
+        self.interfaces += 1
+        return self.interfaces - 1
+
+    def write_packets(self, data, packets, times, interface=0, status=None):
+        """Write framed packets of a plain symbol array (see packet_blocks)."""
+        if len(packets):
+            self._write(packet_blocks(data, packets, times, interface, status))
+
+    def _write(self, block):
+        self.pending.append(block)
+        self.pending_size += len(block)
+        self.written      += len(block)
+        if self.pending_size >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        for block in self.pending:
+            self.file.write(block)
+        self.pending = []
+        self.pending_size = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+# Export -------------------------------------------------------------------------------------------
+
+def _export_chunk(filename, format, chunk_size, n, interface, symbol_period, start_time, check_crc,
+    max_packet_size=8192):
+    """Descramble, frame and build the blocks of chunk `n` of a capture (worker of export).
+
+    The descrambler/framer state at the start of the chunk only depends on the last COM and on the
+    unterminated packet (at most `max_packet_size` symbols, longer ones are dropped): it is rebuilt
+    by processing the end of the previous chunk(s) first, from at least `max_packet_size` symbols
+    before and a COM. Returns (blocks, stats, profiler stages).
+    """
+    profiler = Profiler()
+    reader   = CaptureReader(filename, format, chunk_size, profiler)
+    first    = n*(reader.chunk_size//reader.word_size)
+    warmup   = (max_packet_size + 16)//reader.symbols_per_word + 1 # Words.
+    while True:
+        stats  = {}
+        framer = Framer(stats, max_packet_size, reader.scrambled, profiler)
+        start  = max(first - warmup, 0)
+        if start < first:
+            framer.process(*reader.read_words(start, first - start))
+        if start == 0 or framer.descrambler is None or framer.descrambler.position is not None:
+            break
+        warmup *= 4 # No COM yet: start further back.
+    for name in stats:
+        stats[name] = 0
+
+    offset, data, ctrl, packets = framer.process(*reader.read_chunk(n))
+    status = None
+    if check_crc:
+        with profiler.stage("crc", int(packets["length"].sum())) as stage:
+            status = verify(data, packets)[0]
+            stage.output(status.nbytes)
+    times = start_time + np.round((offset + packets["offset"])*symbol_period).astype(np.uint64)
+    with profiler.stage("export", packets.nbytes) as stage:
+        blocks = packet_blocks(data, packets, times, interface, status)
+        stage.output(len(blocks))
+    return blocks, stats, profiler.stages
+
+def _export_parallel(reader, writer, interface, symbol_period, start_time, check_crc, profiler,
+    jobs):
+    stats   = {}
+    window  = 2*jobs
+    pending = []
+    def store(result):
+        blocks, chunk_stats, stages = result.get()
+        for name, value in chunk_stats.items():
+            stats[name] = stats.get(name, 0) + value
+        profiler.merge(stages)
+        profiler.queue("write", len(pending))
+        with profiler.stage("write", len(blocks)):
+            writer._write(blocks)
+    with multiprocessing.Pool(jobs) as pool:
+        for n in range(reader.nchunks):
+            pending.append(pool.apply_async(_export_chunk, (reader.filename, reader.format,
+                reader.chunk_size, n, interface, symbol_period, start_time, check_crc)))
+            while len(pending) >= window:
+                store(pending.pop(0))
+        while pending:
+            store(pending.pop(0))
+    return stats
+
+def export(reader, writer, interface, symbol_period=4.0, start_time=0, check_crc=False, filtered=False,
+    profiler=None, cache=None, jobs=0):
+    """Descramble, frame and write a capture (CaptureReader) to a PcapngWriter.
+
+    `start_time` is the capture start time (ns, integer). With `filtered`, the capture was recorded
+    after the gateware packet filter: it is already plain and packet times account for the dropped
+    packets (GAP markers). Stages are timed in `profiler` (default: the reader's one). Decoded chunks
+    are shared through `cache` (chunk_cache.ChunkCache) when given. Returns a dict of statistics.
+
+    With `jobs` (None: CPUs), chunks are descrambled, framed and turned into blocks in a pool of
+    processes (at most 2 chunks per process in flight) and written in order by this process, so
+    that export is only bound by the writes with enough CPUs. Filtered captures (packet times
+    depend on all the previous GAP markers), cached exports and other chunk sources are always done
+    in this process.
+    """
+    profiler = profiler or getattr(reader, "profiler", None) or Profiler()
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if jobs and not filtered and cache is None and isinstance(reader, CaptureReader):
+        return _export_parallel(reader, writer, interface, symbol_period, start_time, check_crc,
+            profiler, jobs)
+    stats    = {}
+    skipped  = 0  # Symbols of the dropped packets before the chunk.
+    last     = -1 # Offset of the last GAP marker counted.
+    chunks   = frame_stream(reader, stats, descramble=False if filtered else None, profiler=profiler,
+        cache=cache)
+    for offset, data, ctrl, packets in chunks:
+        status = None
+        if check_crc:
+            with profiler.stage("crc", int(packets["length"].sum())) as stage:
+                status = verify(data, packets)[0]
+                stage.output(status.nbytes)
+        offsets = offset + packets["offset"]
+        if filtered:
+            gap_offsets, gap_lengths = gaps(data, ctrl)
+            gap_offsets += offset
+            new         = gap_offsets > last
+            gap_offsets, gap_lengths = gap_offsets[new], gap_lengths[new]
+            offsets     = unfiltered_offsets(offsets, gap_offsets, gap_lengths) + skipped
+            if len(gap_offsets):
+                last     = gap_offsets[-1]
+                skipped += int(np.sum(gap_lengths - 4))
+        times  = start_time + np.round(offsets*symbol_period).astype(np.uint64)
+        profiler.queue("export", writer.pending_size)
+        with profiler.stage("export", packets.nbytes) as stage:
+            written = writer.written
+            writer.write_packets(data, packets, times, interface, status)
+            stage.output(writer.written - written)
+    return stats
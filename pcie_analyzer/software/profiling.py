@@ -0,0 +1,245 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+"""
+Host pipeline instrumentation.
+
+Each stage of the host pipeline (upload/read, unpack, descramble, framing, CRC, decode, export...)
+is timed per call in a Profiler: calls, bytes in/out (size of the consumed/produced buffers or
+arrays), wall and CPU time (of the calling thread) and the depth of the queue feeding it when it
+has one. Stages process whole chunks, so the overhead (two clock reads per chunk) is negligible and
+instrumentation is always on.
+
+Statistics are dumped as JSON or as a console summary (periodically with a Reporter thread). For
+deeper analysis, cProfile and/or tracemalloc can be enabled on selected stages only.
+"""
+
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+
+# Stage --------------------------------------------------------------------------------------------
+
+class Stage:
+    """Statistics of a pipeline stage.
+
+    Used as a context manager around each call of the stage (from one thread at a time):
+
+        with profiler.stage("unpack", len(datas)) as stage:
+            data, ctrl = unpack(datas, format)
+            stage.output(data.nbytes + ctrl.nbytes)
+    """
+    def __init__(self, name, profile=False, trace_memory=False):
+        self.name            = name
+        self.calls           = 0
+        self.bytes_in        = 0
+        self.bytes_out       = 0
+        self.wall            = 0 # ns.
+        self.cpu             = 0 # ns.
+        self.queue_depth     = 0
+        self.queue_depth_max = 0
+        self.queue_depth_sum = 0
+        self.queue_samples   = 0
+        self.profile         = cProfile.Profile() if profile else None
+        self.memory_peak     = 0 if trace_memory else None # Bytes allocated during a call (max).
+        self._bytes_in       = 0
+
+    def __call__(self, bytes_in=0):
+        self._bytes_in = bytes_in
+        return self
+
+    def __enter__(self):
+        if self.memory_peak is not None:
+            tracemalloc.reset_peak()
+            self._memory = tracemalloc.get_traced_memory()[0]
+        if self.profile is not None:
+            self.profile.enable()
+        self._wall = time.perf_counter_ns()
+        self._cpu  = time.thread_time_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.cpu  += time.thread_time_ns()  - self._cpu
+        self.wall += time.perf_counter_ns() - self._wall
+        if self.profile is not None:
+            self.profile.disable()
+        if self.memory_peak is not None:
+            peak = tracemalloc.get_traced_memory()[1] - self._memory
+            self.memory_peak = max(self.memory_peak, peak)
+        self.calls    += 1
+        self.bytes_in += self._bytes_in
+        return False
+
+    def input(self, n):
+        """Count `n` consumed bytes (when only known inside the call)."""
+        self._bytes_in += n
+
+    def output(self, n):
+        """Count `n` produced bytes."""
+        self.bytes_out += n
+
+    def queue(self, depth):
+        """Sample the depth of the queue feeding the stage (items or bytes)."""
+        self.queue_depth      = depth
+        self.queue_depth_max  = max(self.queue_depth_max, depth)
+        self.queue_depth_sum += depth
+        self.queue_samples   += 1
+
+    def report(self):
+        r = {
+            "calls":           self.calls,
+            "bytes_in":        self.bytes_in,
+            "bytes_out":       self.bytes_out,
+            "wall_s":          self.wall/1e9,
+            "cpu_s":           self.cpu/1e9,
+            "throughput_in":   self.bytes_in/(self.wall/1e9) if self.wall else None,  # Bytes/s.
+            "throughput_out":  self.bytes_out/(self.wall/1e9) if self.wall else None, # Bytes/s.
+        }
+        if self.queue_samples:
+            r["queue_depth"]      = self.queue_depth
+            r["queue_depth_max"]  = self.queue_depth_max
+            r["queue_depth_mean"] = self.queue_depth_sum/self.queue_samples
+        if self.memory_peak is not None:
+            r["memory_peak"] = self.memory_peak
+        return r
+
+# Profiler -----------------------------------------------------------------------------------------
+
+class Profiler:
+    """Per-stage statistics of a host pipeline.
+
+    Stages are created on first use. cProfile (`profile`) and tracemalloc (`trace_memory`) are only
+    enabled on the listed stage names ("all": every stage).
+    """
+    def __init__(self, profile=[], trace_memory=[]):
+        self.profile      = set(profile)
+        self.trace_memory = set(trace_memory)
+        self.stages       = {}
+        self.start        = time.perf_counter_ns()
+        self.lock         = threading.Lock()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stage(self, name, bytes_in=0):
+        """Stage `name` (context manager counting `bytes_in` consumed bytes)."""
+        stage = self.stages.get(name)
+        if stage is None:
+            with self.lock:
+                stage = self.stages.setdefault(name, Stage(name,
+                    profile      = bool(self.profile      & {name, "all"}),
+                    trace_memory = bool(self.trace_memory & {name, "all"})))
+        return stage(bytes_in)
+
+    def queue(self, name, depth):
+        """Sample the depth of the queue feeding stage `name`."""
+        self.stage(name).queue(depth)
+
+    def merge(self, stages):
+        """Add the calls/bytes/times of `stages` (ex: Profiler.stages of a worker process)."""
+        for name, other in stages.items():
+            with self.lock:
+                stage = self.stages.setdefault(name, Stage(name))
+            stage.calls     += other.calls
+            stage.bytes_in  += other.bytes_in
+            stage.bytes_out += other.bytes_out
+            stage.wall      += other.wall
+            stage.cpu       += other.cpu
+
+    @property
+    def elapsed(self):
+        return (time.perf_counter_ns() - self.start)/1e9
+
+    def report(self):
+        return {
+            "elapsed_s": self.elapsed,
+            "stages":    {name: stage.report() for name, stage in list(self.stages.items())},
+        }
+
+    def dump_json(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.report(), f, indent=4)
+
+    def summary(self):
+        """Console summary: one line per stage, the stage with the most wall time is the one
+        limiting the throughput (for stages of the same thread)."""
+        lines = ["{:<12s} {:>7s} {:>10s} {:>10s} {:>9s} {:>9s} {:>10s} {:>11s}".format(
+            "stage", "calls", "in MB", "out MB", "wall s", "cpu s", "in MB/s", "queue max")]
+        for name, stage in list(self.stages.items()):
+            wall = stage.wall/1e9
+            lines.append("{:<12s} {:>7d} {:>10.1f} {:>10.1f} {:>9.3f} {:>9.3f} {:>10s} {:>11s}".format(
+                name, stage.calls, stage.bytes_in/1e6, stage.bytes_out/1e6, wall, stage.cpu/1e9,
+                "{:.1f}".format(stage.bytes_in/1e6/wall) if wall and stage.bytes_in else "-",
+                str(stage.queue_depth_max) if stage.queue_samples else "-"))
+        return "\n".join(lines)
+
+    def dump_profiles(self, directory=None, file=sys.stdout, count=15):
+        """Dump the cProfile statistics of the profiled stages to `directory`/<stage>.prof (or print
+        the `count` top functions) and the tracemalloc peaks."""
+        for name, stage in list(self.stages.items()):
+            if stage.profile is not None:
+                if directory is not None:
+                    os.makedirs(directory, exist_ok=True)
+                    stage.profile.dump_stats(os.path.join(directory, name + ".prof"))
+                else:
+                    print("Profile of stage {}:".format(name), file=file)
+                    pstats.Stats(stage.profile, stream=file).sort_stats("cumulative").print_stats(count)
+            if stage.memory_peak is not None:
+                print("Stage {}: {:.1f} MB allocated at most per call".format(
+                    name, stage.memory_peak/1e6), file=file)
+
+# Reporter -----------------------------------------------------------------------------------------
+
+class Reporter:
+    """Prints the summary of a Profiler every `period` seconds (from a daemon thread)."""
+    def __init__(self, profiler, period=1.0, file=sys.stderr):
+        self.profiler = profiler
+        self.period   = period
+        self.file     = file
+        self.stopped  = threading.Event()
+        self.thread   = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.period):
+            print("[{:.1f}s]\n{}".format(self.profiler.elapsed, self.profiler.summary()), file=self.file)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+# Command line -------------------------------------------------------------------------------------
+
+def add_profiling_arguments(parser):
+    parser.add_argument("--stats",        action="store_true",           help="Print per-stage pipeline statistics at the end")
+    parser.add_argument("--stats-json",   default=None,                  help="Dump per-stage pipeline statistics to a JSON file")
+    parser.add_argument("--stats-period", default=None, type=float,      help="Print per-stage pipeline statistics every N seconds")
+    parser.add_argument("--profile",      action="append", default=[],   help="Run cProfile on a stage (or all)")
+    parser.add_argument("--profile-dir",  default=None,                  help="Dump the cProfile statistics to <dir>/<stage>.prof")
+    parser.add_argument("--trace-memory", action="append", default=[],   help="Trace the memory allocated by a stage (or all)")
+
+
+class ProfilingSession:
+    """Profiler/Reporter configured from the command line arguments (see add_profiling_arguments)."""
+    def __init__(self, args):
+        self.args     = args
+        self.profiler = Profiler(args.profile, args.trace_memory)
+        self.reporter = None
+        if args.stats_period:
+            self.reporter = Reporter(self.profiler, args.stats_period)
+            self.reporter.start()
+
+    def close(self):
+        if self.reporter is not None:
+            self.reporter.stop()
+        if self.args.stats:
+            print(self.profiler.summary())
+        if self.args.stats_json is not None:
+            self.profiler.dump_json(self.args.stats_json)
+        self.profiler.dump_profiles(self.args.profile_dir)
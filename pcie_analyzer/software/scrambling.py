@@ -0,0 +1,115 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+"""
+Software (de)scrambler for 8b/10b PCIe captures (X^16 + X^5 + X^4 + X^3 + 1 polynom).
+
+Follows the specification symbol by symbol: COM resets the LFSR, SKP does not advance it, every
+other symbol advances it by 8 bits. K codes and the symbols of TS1/TS2 Ordered Sets are not
+scrambled. Since the scrambled value only depends on the symbol position, a 65535-byte keystream
+is precomputed and symbols are (de)scrambled in bulk with NumPy.
+"""
+
+import numpy as np
+
+# Helpers ------------------------------------------------------------------------------------------
+
+def K(x, y):
+    """K code generator ex: K(28, 5) is COM Symbol"""
+    return (y << 5) | x
+
+COM = K(28, 5)
+SKP = K(28, 0)
+PAD = K(23, 7)
+
+# Keystream ----------------------------------------------------------------------------------------
+
+def _keystream(reset=0xffff):
+    """Scrambled values of the successive symbols after a LFSR reset (period: 65535 symbols)."""
+    lfsr   = reset
+    stream = np.empty(2**16 - 1, dtype=np.uint8)
+    for n in range(len(stream)):
+        value = 0
+        for i in range(8):
+            fb     = (lfsr >> 15) & 0b1
+            value |= fb << i
+            lfsr   = ((lfsr << 1) & 0xffff) ^ (0x0039 if fb else 0x0000)
+        stream[n] = value
+    return stream
+
+_keystreams = {}
+
+def keystream(reset=0xffff):
+    if reset not in _keystreams:
+        _keystreams[reset] = _keystream(reset)
+    return _keystreams[reset]
+
+# Descrambler --------------------------------------------------------------------------------------
+
+class Descrambler:
+    """Descrambler
+
+    Descrambles (data, ctrl) symbol arrays, keeping its state between calls so that captures can be
+    processed in chunks. Data symbols before the first COM can't be descrambled: they are reported
+    as not synchronized. Scrambling and descrambling being the same operation, it is also used to
+    scramble generated traffic.
+    """
+    def __init__(self, reset=0xffff):
+        self.keystream   = keystream(reset)
+        self.position    = None  # LFSR advances since last COM (None: not synchronized).
+        self.ts_left     = 0     # Remaining unscrambled TS1/TS2 symbols.
+        self.com_pending = False # Last symbol was a COM.
+
+    def process(self, data, ctrl):
+        """Returns (data, synchronized) arrays."""
+        data = np.asarray(data, dtype=np.uint8)
+        ctrl = np.asarray(ctrl, dtype=bool)
+        n    = len(data)
+        if n == 0:
+            return data.copy(), np.zeros(0, dtype=bool)
+
+        com     = ctrl & (data == COM)
+        com_idx = np.flatnonzero(com)
+        start   = self.position or 0
+
+        # Position of each symbol: LFSR advances since the last COM (or since the last call). Every
+        # symbol but COM/SKP advances the LFSR; on COMs, advances are rewound to restart from 0.
+        advance = (~(com | (ctrl & (data == SKP)))).view(np.int8).astype(np.int32)
+        if len(com_idx):
+            advance[com_idx] = -np.add.reduceat(advance, np.append(0, com_idx))[:-1]
+            advance[com_idx[0]] -= start
+        position     = np.empty(n, dtype=np.int32)
+        position[0]  = start
+        position[1:] = advance[:-1]
+        np.cumsum(position, out=position, dtype=np.int32)
+
+        # Symbols before the first COM can't be descrambled when not synchronized.
+        synchronized = np.ones(n, dtype=bool)
+        if self.position is None:
+            synchronized[:com_idx[0] if len(com_idx) else n] = False
+
+        # K codes and TS1/TS2 Ordered Sets (COM followed by PAD or a Link Number) are not scrambled.
+        unscrambled = ctrl | ~synchronized
+        unscrambled[:self.ts_left] = True
+        starts = com_idx + 1
+        if self.com_pending:
+            starts = np.append(0, starts)
+        starts = starts[starts < n]
+        starts = starts[~ctrl[starts] | (data[starts] == PAD)]
+        if len(starts):
+            unscrambled[np.minimum(starts[:, None] + np.arange(15), n - 1).ravel()] = True
+
+        key = np.take(self.keystream, position, mode="wrap")
+        key[unscrambled] = 0
+
+        # Update state.
+        if synchronized[-1]:
+            self.position = int(position[-1] + advance[-1])
+        self.ts_left     = max(self.ts_left - n, int(starts[-1]) + 15 - n if len(starts) else 0, 0)
+        self.com_pending = bool(com[-1])
+
+        return data ^ key, synchronized
+
+def descramble(data, ctrl, reset=0xffff):
+    """Descramble (data, ctrl) symbol arrays, returns (data, synchronized) arrays."""
+    return Descrambler(reset).process(data, ctrl)
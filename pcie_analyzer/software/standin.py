@@ -0,0 +1,161 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+"""
+Stand-in analyzer board for host tools testing.
+
+StandInComm emulates the CSRs/memory of an analyzer board (DMA recorders and main_ram) behind a
+LiteX RemoteServer, so that several local stand-in boards can be driven by the host tools (ex: the
+capture orchestrator) exactly as real boards. Recorders fill their DRAM region with deterministic
+pseudo-random data when started and report done after `capture_time` seconds. The DRAM CRC unit
+is emulated too and main_ram reads can be corrupted (`read_error_rate`: probability that a read
+word has a flipped bit) to exercise the upload verification.
+"""
+
+import csv
+import zlib
+import time
+import threading
+
+import numpy as np
+
+from litex.tools.litex_server import RemoteServer
+
+# Stand-In Comm ------------------------------------------------------------------------------------
+
+class StandInComm:
+    csr_base      = 0x82000000
+    main_ram_base = 0x40000000
+
+    dram_crc_registers = ["base", "length", "block_shift", "start", "done", "crc", "blocks",
+        "block_index", "block_crc"]
+    readonly_registers = ["done", "crc", "blocks", "block_crc"]
+
+    def __init__(self, recorders=["rx_dma_recorder"], main_ram_size=16*1024*1024, seed=0,
+        capture_time=0.0, dram_crc_nblocks=1024, read_error_rate=0.0):
+        self.recorders        = recorders
+        self.seed             = seed
+        self.capture_time     = capture_time
+        self.dram_crc_nblocks = dram_crc_nblocks
+        self.read_error_rate  = read_error_rate
+        self.read_errors      = 0
+        self.rng              = np.random.default_rng(seed)
+        self.main_ram         = np.zeros(main_ram_size//4, dtype="<u4")
+        self.lock             = threading.Lock()
+        self.registers        = {}
+        self.csr_bases        = {}
+        self.armed            = {} # Recorder start times (time.perf_counter_ns()).
+        self.block_crcs       = []
+        for i, recorder in enumerate(recorders):
+            self._add_csrs(recorder, self.csr_base + 0x800*i, ["start", "done", "base", "length"])
+        if dram_crc_nblocks:
+            self._add_csrs("dram_crc", self.csr_base + 0x800*len(recorders), self.dram_crc_registers)
+            self._register("dram_crc", "block_shift")[1] = 16
+
+    def _add_csrs(self, name, base, registers):
+        self.csr_bases[name] = base
+        for j, register in enumerate(registers):
+            self.registers[base + 4*j] = [name + "_" + register, 0]
+
+    def csr_csv(self, filename):
+        """Write the csr.csv describing the stand-in board."""
+        with open(filename, "w") as f:
+            w = csv.writer(f)
+            w.writerow(["constant", "config_csr_data_width", 32, "", ""])
+            w.writerow(["constant", "config_bus_address_width", 32, "", ""])
+            if self.dram_crc_nblocks:
+                w.writerow(["constant", "dram_crc_nblocks", self.dram_crc_nblocks, "", ""])
+            for name, base in self.csr_bases.items():
+                w.writerow(["csr_base", name, "0x{:08x}".format(base), "", ""])
+            for addr, (name, _) in sorted(self.registers.items()):
+                readonly = any(name.endswith("_" + r) for r in self.readonly_registers)
+                w.writerow(["csr_register", name, "0x{:08x}".format(addr), 1,
+                    "ro" if readonly else "rw"])
+            w.writerow(["memory_region", "main_ram", "0x{:08x}".format(self.main_ram_base),
+                4*len(self.main_ram), "cached"])
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def _register(self, recorder, name):
+        for addr, (n, _) in self.registers.items():
+            if n == recorder + "_" + name:
+                return self.registers[addr]
+
+    def _start(self, i, recorder):
+        self.armed[recorder] = time.perf_counter_ns()
+        self._register(recorder, "done")[1] = 0
+        base   = self._register(recorder, "base")[1]
+        length = self._register(recorder, "length")[1]
+        rng    = np.random.default_rng(self.seed*len(self.recorders) + i)
+        datas  = rng.integers(0, 2**32, length//4, dtype=np.uint32)
+        def capture():
+            time.sleep(self.capture_time)
+            with self.lock:
+                self.main_ram[base//4:base//4 + len(datas)] = datas
+                self._register(recorder, "done")[1] = 1
+        threading.Thread(target=capture, daemon=True).start()
+
+    def _dram_crc(self):
+        base   = self._register("dram_crc", "base")[1]
+        length = self._register("dram_crc", "length")[1]
+        block  = 1 << self._register("dram_crc", "block_shift")[1]
+        with self.lock:
+            datas = self.main_ram[base//4:(base + length)//4].tobytes()
+        self.block_crcs = [zlib.crc32(datas[i:i + block]) for i in range(0, length, block)]
+        self._register("dram_crc", "crc")[1]    = zlib.crc32(datas)
+        self._register("dram_crc", "blocks")[1] = len(self.block_crcs)
+        self._register("dram_crc", "done")[1]   = 1
+
+    def read(self, addr, length=1, burst="incr"):
+        with self.lock:
+            if addr in self.registers:
+                name, value = self.registers[addr]
+                if name == "dram_crc_block_crc":
+                    index = self._register("dram_crc", "block_index")[1]
+                    if index < min(len(self.block_crcs), self.dram_crc_nblocks):
+                        return [self.block_crcs[index]]
+                return [value]
+            offset = (addr - self.main_ram_base)//4
+            if 0 <= offset < len(self.main_ram):
+                datas = [int(d) for d in self.main_ram[offset:offset + length]]
+                if datas and self.rng.random() < self.read_error_rate:
+                    self.read_errors += 1
+                    datas[self.rng.integers(len(datas))] ^= 1 << int(self.rng.integers(32))
+                return datas
+            return [0]*length
+
+    def write(self, addr, datas):
+        for i, data in enumerate(datas):
+            a = addr + 4*i
+            if a in self.registers:
+                name, _ = self.registers[a]
+                self.registers[a][1] = data
+                for j, recorder in enumerate(self.recorders):
+                    if name == recorder + "_start" and data:
+                        self._start(j, recorder)
+                if name == "dram_crc_start" and data:
+                    self._register("dram_crc", "done")[1] = 0
+                    self._dram_crc()
+            else:
+                offset = (a - self.main_ram_base)//4
+                if 0 <= offset < len(self.main_ram):
+                    self.main_ram[offset] = data
+
+# Stand-In Board -----------------------------------------------------------------------------------
+
+class StandInBoard:
+    """Stand-in board served on localhost (port=0: any free port)."""
+    def __init__(self, csr_csv, port=0, **kwargs):
+        self.comm   = StandInComm(**kwargs)
+        self.comm.csr_csv(csr_csv)
+        self.server = RemoteServer(self.comm, "localhost", port)
+        self.server.open()
+        self.port   = self.server.socket.getsockname()[1]
+        self.server.start(1)
+
+    def close(self):
+        self.server.close()
@@ -0,0 +1,397 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+"""
+Columnar TLP header decoder with a small query API.
+
+TLP headers of framed packets are decoded column-wise into NumPy structured arrays (one row per
+TLP). On top of them, `Table` provides filtering with predicates, group-by and the join of
+Non-Posted requests to their completions (on Requester ID/Tag), ex:
+
+    tlps = decode(data, packets)
+    mrd  = tlps.where((col("kind") == TLP_MRD) & (col("requester_id") == bdf("01:00.0")) &
+                      col("address").between(bar0, bar0 + bar0_size))
+    slow = transactions(tlps).where(col("latency") > 2000)
+
+Tables can be saved to .npy files and loaded back memory-mapped.
+"""
+
+import numpy as np
+
+from pcie_analyzer.software.framing import PACKET_TLP, PACKET_FLAG_NULLIFIED, PACKET_FLAG_TRUNCATED
+
+# TLP Kinds ----------------------------------------------------------------------------------------
+
+TLP_UNKNOWN  = 0
+TLP_MRD      = 1
+TLP_MRDLK    = 2
+TLP_MWR      = 3
+TLP_IORD     = 4
+TLP_IOWR     = 5
+TLP_CFGRD0   = 6
+TLP_CFGWR0   = 7
+TLP_CFGRD1   = 8
+TLP_CFGWR1   = 9
+TLP_MSG      = 10
+TLP_MSGD     = 11
+TLP_CPL      = 12
+TLP_CPLD     = 13
+TLP_CPLLK    = 14
+TLP_CPLDLK   = 15
+TLP_FETCHADD = 16
+TLP_SWAP     = 17
+TLP_CAS      = 18
+
+tlp_kind_names = {
+    TLP_UNKNOWN  : "Unknown",
+    TLP_MRD      : "MRd",
+    TLP_MRDLK    : "MRdLk",
+    TLP_MWR      : "MWr",
+    TLP_IORD     : "IORd",
+    TLP_IOWR     : "IOWr",
+    TLP_CFGRD0   : "CfgRd0",
+    TLP_CFGWR0   : "CfgWr0",
+    TLP_CFGRD1   : "CfgRd1",
+    TLP_CFGWR1   : "CfgWr1",
+    TLP_MSG      : "Msg",
+    TLP_MSGD     : "MsgD",
+    TLP_CPL      : "Cpl",
+    TLP_CPLD     : "CplD",
+    TLP_CPLLK    : "CplLk",
+    TLP_CPLDLK   : "CplDLk",
+    TLP_FETCHADD : "FetchAdd",
+    TLP_SWAP     : "Swap",
+    TLP_CAS      : "CAS",
+}
+
+tlp_non_posted = [TLP_MRD, TLP_MRDLK, TLP_IORD, TLP_IOWR, TLP_CFGRD0, TLP_CFGWR0, TLP_CFGRD1,
+    TLP_CFGWR1, TLP_FETCHADD, TLP_SWAP, TLP_CAS]
+tlp_completions = [TLP_CPL, TLP_CPLD, TLP_CPLLK, TLP_CPLDLK]
+
+def _build_kind_table():
+    # Kind from the first header byte (Fmt[2:0], Type[4:0]).
+    table = np.full(256, TLP_UNKNOWN, dtype=np.uint8)
+    def add(fmts, type, kind):
+        for fmt in fmts:
+            table[(fmt << 5) | type] = kind
+    add([0b000, 0b001], 0b00000, TLP_MRD)
+    add([0b000, 0b001], 0b00001, TLP_MRDLK)
+    add([0b010, 0b011], 0b00000, TLP_MWR)
+    add([0b000],        0b00010, TLP_IORD)
+    add([0b010],        0b00010, TLP_IOWR)
+    add([0b000],        0b00100, TLP_CFGRD0)
+    add([0b010],        0b00100, TLP_CFGWR0)
+    add([0b000],        0b00101, TLP_CFGRD1)
+    add([0b010],        0b00101, TLP_CFGWR1)
+    for routing in range(8):
+        add([0b001],    0b10000 | routing, TLP_MSG)
+        add([0b011],    0b10000 | routing, TLP_MSGD)
+    add([0b000],        0b01010, TLP_CPL)
+    add([0b010],        0b01010, TLP_CPLD)
+    add([0b000],        0b01011, TLP_CPLLK)
+    add([0b010],        0b01011, TLP_CPLDLK)
+    add([0b010, 0b011], 0b01100, TLP_FETCHADD)
+    add([0b010, 0b011], 0b01101, TLP_SWAP)
+    add([0b010, 0b011], 0b01110, TLP_CAS)
+    return table
+
+tlp_kind_table = _build_kind_table()
+
+def bdf(s):
+    """Convert a "bus:device.function" string to a 16-bit ID, ex: bdf("01:00.0") = 0x0100."""
+    bus, devfn       = s.split(":")
+    device, function = devfn.split(".")
+    return (int(bus, 16) << 8) | (int(device, 16) << 3) | int(function, 16)
+
+# TLP Layout ---------------------------------------------------------------------------------------
+
+# One row per TLP. Fields not present in a TLP kind are 0: requester_id/tag are the ones of the
+# request (also for completions), completer_id is the Completer ID of completions and the
+# destination ID of configuration requests, address is the register address of configuration
+# requests. time is in ns.
+tlp_layout = np.dtype([
+    ("packet",        "<i8"), # Index in the framed packets.
+    ("offset",        "<i8"), # Offset of the header in the symbol array.
+    ("time",          "<f8"),
+    ("seq",           "<u2"),
+    ("fmt",           "u1"),
+    ("type",          "u1"),
+    ("kind",          "u1"),
+    ("tc",            "u1"),
+    ("attr",          "u1"),
+    ("td",            "?"),
+    ("ep",            "?"),
+    ("nullified",     "?"),
+    ("length",        "<u2"), # In DWs.
+    ("requester_id",  "<u2"),
+    ("completer_id",  "<u2"),
+    ("tag",           "u1"),
+    ("first_be",      "u1"),
+    ("last_be",       "u1"),
+    ("message_code",  "u1"),
+    ("address",       "<u8"),
+    ("status",        "u1"),
+    ("byte_count",    "<u2"),
+    ("lower_address", "u1"),
+])
+
+# Decoder ------------------------------------------------------------------------------------------
+
+def decode(data, packets, timestamps=None, symbol_period=4.0):
+    """Decode TLP headers of framed packets, returns a `Table` of `tlp_layout`.
+
+    `data` is the plain symbol array (can be memory-mapped) and `packets` the `framing.frame`
+    result for it. Packets that are not TLPs, are truncated or too short are skipped. `time` is
+    taken from `timestamps` (ns, one per packet) when provided, otherwise deduced from the symbol
+    offset and `symbol_period` (ns, 4.0 for 2.5GT/s links).
+    """
+    data    = np.asarray(data, dtype=np.uint8)
+    index   = np.flatnonzero((packets["type"] == PACKET_TLP) &
+                             (packets["length"] >= 2 + 12 + 4) &
+                             ((packets["flags"] & PACKET_FLAG_TRUNCATED) == 0))
+    offsets = packets["offset"][index].astype(np.int64)
+    tlps    = np.zeros(len(index), dtype=tlp_layout)
+
+    # Gather Sequence Number + 16 header bytes of each TLP (as 16-bit columns, to ease shifts).
+    h = np.take(data, offsets[:, None] + np.arange(2 + 16), mode="clip").astype(np.uint16)
+    s, h = h[:, :2], h[:, 2:]
+
+    tlps["packet"]    = index
+    tlps["offset"]    = offsets + 2
+    if timestamps is not None:
+        tlps["time"]  = np.asarray(timestamps)[index]
+    else:
+        tlps["time"]  = offsets*symbol_period
+    tlps["seq"]       = ((s[:, 0] & 0xf) << 8) | s[:, 1]
+    tlps["nullified"] = (packets["flags"][index] & PACKET_FLAG_NULLIFIED) != 0
+
+    # DW0 (common to all TLPs).
+    fmt  = h[:, 0] >> 5
+    kind = np.take(tlp_kind_table, h[:, 0])
+    tlps["fmt"]    = fmt
+    tlps["type"]   = h[:, 0] & 0x1f
+    tlps["kind"]   = kind
+    tlps["tc"]     = (h[:, 1] >> 4) & 0b111
+    tlps["attr"]   = ((h[:, 2] >> 4) & 0b11) | (h[:, 1] & 0b100)
+    tlps["td"]     = (h[:, 2] & 0x80) != 0
+    tlps["ep"]     = (h[:, 2] & 0x40) != 0
+    length         = ((h[:, 2] & 0b11) << 8) | h[:, 3]
+    tlps["length"] = np.where(length == 0, 1024, length)
+
+    # Requests (Memory, IO, Configuration, Messages, AtomicOps): DW1.
+    completion = np.isin(kind, tlp_completions)
+    request    = ~completion & (kind != TLP_UNKNOWN)
+    tlps["requester_id"] = np.where(completion, (h[:, 8] << 8) | h[:, 9], (h[:, 4] << 8) | h[:, 5])
+    tlps["tag"]          = np.where(completion, h[:, 10], h[:, 6])
+    tlps["first_be"]     = np.where(request, h[:, 7] & 0xf, 0)
+    tlps["last_be"]      = np.where(request, h[:, 7] >> 4, 0)
+    message = np.isin(kind, [TLP_MSG, TLP_MSGD])
+    tlps["message_code"] = np.where(message, h[:, 7], 0)
+    tlps["first_be"][message] = 0
+    tlps["last_be"][message]  = 0
+
+    # Addresses: 3DW (32-bit) or 4DW (64-bit) for Memory/IO/AtomicOps, register for Configuration.
+    def dw(i):
+        return ((h[:, i + 0].astype(np.uint64) << np.uint64(24)) |
+                (h[:, i + 1].astype(np.uint64) << np.uint64(16)) |
+                (h[:, i + 2].astype(np.uint64) <<  np.uint64(8)) |
+                (h[:, i + 3].astype(np.uint64) <<  np.uint64(0)))
+    memory = np.isin(kind, [TLP_MRD, TLP_MRDLK, TLP_MWR, TLP_IORD, TLP_IOWR,
+                            TLP_FETCHADD, TLP_SWAP, TLP_CAS])
+    config = np.isin(kind, [TLP_CFGRD0, TLP_CFGWR0, TLP_CFGRD1, TLP_CFGWR1])
+    four_dw = (fmt & 0b001) != 0
+    address = np.where(four_dw, (dw(8) << np.uint64(32)) | dw(12), dw(8)) & np.uint64(2**64 - 4)
+    register = ((h[:, 10] & 0xf) << 8) | (h[:, 11] & 0xfc)
+    tlps["address"] = np.where(memory, address, np.where(config, register, 0))
+
+    # Completions: Completer ID, Status, Byte Count, Lower Address. Configuration: Destination ID.
+    tlps["completer_id"]  = np.where(completion, (h[:, 4] << 8) | h[:, 5],
+                            np.where(config,     (h[:, 8] << 8) | h[:, 9], 0))
+    tlps["status"]        = np.where(completion, h[:, 6] >> 5, 0)
+    tlps["byte_count"]    = np.where(completion, ((h[:, 6] & 0xf) << 8) | h[:, 7], 0)
+    tlps["lower_address"] = np.where(completion, h[:, 11] & 0x7f, 0)
+
+    return Table(tlps)
+
+# Transactions -------------------------------------------------------------------------------------
+
+transaction_layout = np.dtype([
+    ("request",      "<i8"), # Row of the request in the TLP table.
+    ("completion",   "<i8"), # Row of the first completion in the TLP table (-1 if none).
+    ("kind",         "u1"),
+    ("requester_id", "<u2"),
+    ("completer_id", "<u2"),
+    ("tag",          "u1"),
+    ("address",      "<u8"),
+    ("length",       "<u2"),
+    ("status",       "u1"),
+    ("time",         "<f8"),
+    ("latency",      "<f8"), # ns (NaN if no completion).
+])
+
+def transactions(tlps):
+    """Join Non-Posted requests to their (first) completion on Requester ID/Tag.
+
+    A request is matched with the first completion for its Requester ID/Tag that follows it and
+    precedes the next request reusing the same Requester ID/Tag. Returns a `Table` of
+    `transaction_layout`.
+    """
+    t    = tlps.array if isinstance(tlps, Table) else tlps
+    rows = np.arange(len(t), dtype=np.int64)
+    key  = (t["requester_id"].astype(np.int64) << 8) | t["tag"]
+    # Sortable (key, row) pairs.
+    pair = (key << 40) | rows
+
+    requests    = np.flatnonzero(np.isin(t["kind"], tlp_non_posted) & ~t["nullified"])
+    completions = np.flatnonzero(np.isin(t["kind"], tlp_completions) & ~t["nullified"])
+
+    # First completion after each request with the same key.
+    completion_pairs = np.sort(pair[completions])
+    i     = np.searchsorted(completion_pairs, pair[requests], side="right")
+    found = np.append(completion_pairs, -1)[i]
+    match = (found >= 0) & ((found >> 40) == key[requests])
+
+    # ... that is before the next request with the same key.
+    order         = np.argsort(pair[requests], kind="stable")
+    request_pairs = pair[requests][order]
+    next_pairs    = np.empty_like(request_pairs)
+    next_pairs[:-1] = request_pairs[1:]
+    next_pairs[-1:] = -1
+    next_pair = np.empty_like(next_pairs)
+    next_pair[order] = next_pairs
+    reused = (next_pair >= 0) & ((next_pair >> 40) == key[requests]) & (next_pair < found)
+    match &= ~reused
+    completion = np.where(match, found & (2**40 - 1), -1)
+
+    r = t[requests]
+    c = t[np.maximum(completion, 0)]
+    transactions = np.zeros(len(requests), dtype=transaction_layout)
+    transactions["request"]      = requests
+    transactions["completion"]   = completion
+    for name in ["kind", "requester_id", "tag", "address", "length", "time"]:
+        transactions[name] = r[name]
+    transactions["completer_id"] = np.where(match, c["completer_id"], 0)
+    transactions["status"]       = np.where(match, c["status"], 0)
+    transactions["latency"]      = np.where(match, c["time"] - r["time"], np.nan)
+    return Table(transactions)
+
+# Query API ----------------------------------------------------------------------------------------
+
+class Predicate:
+    """Predicate on the rows of a Table, combined with &, | and ~."""
+    def __init__(self, function):
+        self.function = function
+
+    def __call__(self, array):
+        return self.function(array)
+
+    def __and__(self, other):
+        return Predicate(lambda a: self(a) & other(a))
+
+    def __or__(self, other):
+        return Predicate(lambda a: self(a) | other(a))
+
+    def __invert__(self):
+        return Predicate(lambda a: ~self(a))
+
+
+class col:
+    """Column reference used to build predicates, ex: (col("tag") == 5) & (col("length") > 1)."""
+    def __init__(self, name):
+        self.name = name
+
+    def _predicate(self, op, value):
+        return Predicate(lambda a: op(a[self.name], value))
+
+    def __eq__(self, value): return self._predicate(np.equal,         value)
+    def __ne__(self, value): return self._predicate(np.not_equal,     value)
+    def __lt__(self, value): return self._predicate(np.less,          value)
+    def __le__(self, value): return self._predicate(np.less_equal,    value)
+    def __gt__(self, value): return self._predicate(np.greater,       value)
+    def __ge__(self, value): return self._predicate(np.greater_equal, value)
+
+    def isin(self, values):
+        return Predicate(lambda a: np.isin(a[self.name], values))
+
+    def between(self, low, high):
+        """low <= value < high."""
+        return Predicate(lambda a: (a[self.name] >= low) & (a[self.name] < high))
+
+
+class Groups:
+    """Result of Table.group_by: unique keys and per-group aggregates."""
+    def __init__(self, array, names):
+        self.keys, self.inverse, self.counts = np.unique(array[list(names)],
+            return_inverse=True, return_counts=True)
+        self.inverse = self.inverse.reshape(-1)
+        self.array   = array
+
+    def __len__(self):
+        return len(self.keys)
+
+    def count(self):
+        return self.counts
+
+    def _reduce(self, ufunc, name, initial):
+        out = np.full(len(self.keys), initial, dtype=np.float64)
+        ufunc.at(out, self.inverse, self.array[name])
+        return out
+
+    def sum(self, name):
+        return self._reduce(np.add, name, 0)
+
+    def min(self, name):
+        return self._reduce(np.minimum, name, np.inf)
+
+    def max(self, name):
+        return self._reduce(np.maximum, name, -np.inf)
+
+    def mean(self, name):
+        return self.sum(name)/self.counts
+
+    def items(self):
+        """Iterate over (key, Table) pairs."""
+        order  = np.argsort(self.inverse, kind="stable")
+        bounds = np.cumsum(self.counts)[:-1]
+        for key, rows in zip(self.keys, np.split(order, bounds)):
+            yield key, Table(self.array[rows])
+
+
+class Table:
+    """Thin wrapper around a structured array (TLPs, transactions) providing queries."""
+    def __init__(self, array):
+        self.array = array
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.array[key]
+        return Table(self.array[key])
+
+    def __iter__(self):
+        return iter(self.array)
+
+    @property
+    def columns(self):
+        return self.array.dtype.names
+
+    def where(self, predicate=None, **equals):
+        """Rows matching `predicate` and column == value keyword arguments."""
+        mask = np.ones(len(self.array), dtype=bool)
+        if predicate is not None:
+            mask &= predicate(self.array)
+        for name, value in equals.items():
+            mask &= self.array[name] == value
+        return Table(self.array[mask])
+
+    def group_by(self, *names):
+        return Groups(self.array, names)
+
+    def save(self, filename):
+        np.save(filename, self.array)
+
+    @classmethod
+    def load(cls, filename, mmap=True):
+        return cls(np.load(filename, mmap_mode="r" if mmap else None))
@@ -0,0 +1,405 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+"""
+Synthetic PCIe traffic generator.
+
+Generates realistic x1 link traffic as plain (data, ctrl) symbol arrays and writes it as capture
+files in any capture format (scrambled, packed as recorded), to test and benchmark the host tools
+without a board:
+- TLPs of a configurable mix (Memory/Configuration Requests, Completions, Messages) with valid
+  headers, Sequence Numbers, payloads, optional ECRC and LCRC.
+- DLLPs (Ack/Nak, UpdateFC) with their CRC-16.
+- Logical Idle between packets and SKP Ordered Sets at the nominal interval (SKP_INTERVAL, as
+  transmitted by the replay).
+- Optional errors: LCRC errors (bit flips), ECRC errors, nullified TLPs (EDB), truncated TLPs (no
+  END) and DLLP CRC errors.
+
+Packets are generated in batches with NumPy (no per-symbol/per-packet Python loop) and the expected
+framing/CRC results are counted, so that decoded captures can be checked against them.
+"""
+
+import numpy as np
+
+from pcie_analyzer.common import SKP_INTERVAL
+from pcie_analyzer.software.framing import STP, SDP, END, EDB
+from pcie_analyzer.software.scrambling import COM, SKP, Descrambler
+from pcie_analyzer.software.crc import crc32, crc16, ECRC_VARIANT_BITS
+from pcie_analyzer.software.code_8b10b import Encoder
+from pcie_analyzer.software.capture import (capture_formats, capture_layouts, capture_scrambled,
+    capture_skp_removed, capture_filtered, pack)
+
+# TLP Kinds ----------------------------------------------------------------------------------------
+
+LENGTH_NONE   = 0 # Length field reserved/0 (Cpl, Msg).
+LENGTH_ONE    = 1 # 1 DW (Configuration).
+LENGTH_RANDOM = 2 # 1 to max_payload/max_read DWs.
+
+# name: (Fmt/Type byte, header size, with data, length)
+tlp_kinds = {
+    "mrd32"  : (0x00, 12, False, LENGTH_RANDOM),
+    "mrd64"  : (0x20, 16, False, LENGTH_RANDOM),
+    "mwr32"  : (0x40, 12, True,  LENGTH_RANDOM),
+    "mwr64"  : (0x60, 16, True,  LENGTH_RANDOM),
+    "cfgrd0" : (0x04, 12, False, LENGTH_ONE),
+    "cfgwr0" : (0x44, 12, True,  LENGTH_ONE),
+    "cpl"    : (0x0a, 12, False, LENGTH_NONE),
+    "cpld"   : (0x4a, 12, True,  LENGTH_RANDOM),
+    "msg"    : (0x34, 16, False, LENGTH_NONE), # Local routing.
+}
+
+# Relative weights of the packet kinds ("dllp": DLLPs, others: tlp_kinds).
+default_mix = {
+    "mrd32"  : 20,
+    "mrd64"  : 5,
+    "mwr32"  : 15,
+    "mwr64"  : 5,
+    "cfgrd0" : 1,
+    "cfgwr0" : 1,
+    "cpl"    : 2,
+    "cpld"   : 20,
+    "msg"    : 1,
+    "dllp"   : 30,
+}
+
+# DLLP types: Ack, Nak, UpdateFC-P/NP/Cpl (VC0).
+dllp_types = np.array([0x00, 0x10, 0x80, 0x90, 0xa0], dtype=np.uint8)
+dllp_type_weights = np.array([0.4, 0.01, 0.25, 0.14, 0.2])
+
+# Assert/Deassert_INTA, PM_Active_State_Nak, Vendor_Defined Type 1.
+message_codes = np.array([0x20, 0x24, 0x14, 0x7f], dtype=np.uint8)
+
+error_kinds = ["lcrc", "ecrc", "nullified", "truncated", "dllp_crc"]
+
+def parse_mix(s):
+    """Parse a "kind=weight,..." mix (ex: "mwr32=10,cpld=5,dllp=3")."""
+    mix = {}
+    for entry in s.split(","):
+        name, _, weight = entry.partition("=")
+        if name not in tlp_kinds and name != "dllp":
+            raise ValueError("Unknown packet kind {}".format(name))
+        mix[name] = float(weight or 1)
+    return mix
+
+def _ranges(starts, lengths):
+    """Concatenation of the ranges [starts[i], starts[i] + lengths[i])."""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(np.asarray(starts, dtype=np.int64) - offsets, lengths) + np.arange(lengths.sum())
+
+def _put_le(data, offsets, value, nbytes):
+    for i in range(nbytes):
+        data[offsets + i] = (value >> (8*i)) & 0xff
+
+# Traffic Generator --------------------------------------------------------------------------------
+
+class TrafficGenerator:
+    """Traffic Generator
+
+    Each `generate` call returns the plain (data, ctrl) symbols of `n` more items (packets or
+    Logical Idle, and the SKP Ordered Sets scheduled before them); `close` terminates the stream.
+    All items are multiples of 4 symbols, so that SKP Ordered Sets are aligned on 4 symbols as seen
+    by the recorders.
+
+    - mix: relative weights of the packet kinds (see default_mix).
+    - idle_ratio: ratio of Logical Idle items (4 to 16 symbols) between packets.
+    - max_payload/max_read: TLP payload/read request sizes (bytes).
+    - ecrc_ratio: ratio of TLPs with a TLP Digest (ECRC).
+    - skp_interval: SKP Ordered Set interval in symbols (None: no SKP Ordered Sets).
+    - errors: per packet error rates, ex: {"lcrc": 1e-3, "truncated": 1e-4} (see error_kinds),
+      "ecrc" only applies to TLPs with ECRC.
+
+    `stats` counts the generated items, `crc_totals` gives the expected crc.verify totals and
+    `fields` the histograms of header fields (TC, Attr) of the TLPs generated without errors.
+    """
+    def __init__(self, seed=0, mix=default_mix, idle_ratio=0.2, max_payload=256, max_read=512,
+        ecrc_ratio=0.0, skp_interval=SKP_INTERVAL, errors={}, requesters=8):
+        for name in errors:
+            if name not in error_kinds:
+                raise ValueError("Unknown error kind {}".format(name))
+        mix               = dict(mix)
+        mix.setdefault("dllp", 0)
+        self.rng          = np.random.default_rng(seed)
+        self.kinds        = list(mix.keys()) + ["idle"]
+        self.kind_table   = np.array([tlp_kinds.get(kind, (0, 0, 0, 0)) for kind in self.kinds])
+        weights           = np.array(list(mix.values()), dtype=np.float64)
+        weights           = (1 - idle_ratio)*weights/weights.sum()
+        self.p            = np.append(weights, idle_ratio)
+        self.max_payload  = max_payload
+        self.max_read     = max_read
+        self.ecrc_ratio   = ecrc_ratio
+        self.skp_interval = skp_interval
+        self.errors       = errors
+        self.requesters   = self.rng.integers(0, 2**16, requesters)
+        self.completer    = int(self.rng.integers(0, 2**16))
+        self.seq          = 0
+        self.skp_count    = skp_interval or 0 # Start with a SKP Ordered Set (scrambler sync).
+        self.stats        = {name: 0 for name in ["symbols", "items", "tlps", "dllps", "idles",
+            "skps", "tlp_bytes"] + ["tlp_" + kind for kind in tlp_kinds] +
+            ["error_" + kind for kind in error_kinds]}
+        self.fields       = {name: np.zeros(8, dtype=np.int64) for name in ["tc", "attr"]}
+
+    def crc_totals(self):
+        """Expected crc.verify totals (without bytes) of the generated packets."""
+        s = self.stats
+        errors = sum(s["error_" + kind] for kind in error_kinds)
+        return {
+            "ok"             : s["tlps"] + s["dllps"] - errors,
+            "lcrc_error"     : s["error_lcrc"],
+            "ecrc_error"     : s["error_ecrc"],
+            "nullified"      : s["error_nullified"],
+            "malformed"      : s["error_truncated"],
+            "dllp_crc_error" : s["error_dllp_crc"],
+            "packets"        : s["tlps"] + s["dllps"],
+        }
+
+    def _errors(self, n, kinds):
+        """Error kind index of n packets (-1: no error) for the given error kinds."""
+        error = np.full(n, -1, dtype=np.int8)
+        u     = self.rng.random(n)
+        rate  = 0.0
+        for kind in kinds:
+            r = self.errors.get(kind, 0.0)
+            error[(u >= rate) & (u < rate + r)] = error_kinds.index(kind)
+            rate += r
+        return error
+
+    def generate(self, n=4096):
+        rng   = self.rng
+        kind  = rng.choice(len(self.kinds), n, p=self.p)
+        names = np.array(self.kinds)[kind]
+        tlp   = np.flatnonzero(np.isin(names, list(tlp_kinds)))
+        dllp  = np.flatnonzero(names == "dllp")
+        idle  = np.flatnonzero(names == "idle")
+
+        # TLP fields.
+        nt      = len(tlp)
+        tnames  = names[tlp]
+        fmt_type, header_size, with_data, length_mode = self.kind_table[kind[tlp]].T
+        write   = np.isin(tnames, ["mwr32", "mwr64", "cpld"])
+        length  = np.where(write,
+            rng.integers(1, self.max_payload//4 + 1, nt),
+            rng.integers(1, self.max_read//4 + 1, nt))
+        length  = np.select([length_mode == LENGTH_NONE, length_mode == LENGTH_ONE], [0, 1], length)
+        payload = np.where(with_data != 0, 4*length, 0)
+        td      = rng.random(nt) < self.ecrc_ratio
+        tlp_size = header_size + payload + 4*td # TLP (without Seq/LCRC).
+
+        # Item sizes (symbols, multiples of 4) and SKP Ordered Sets scheduling.
+        size       = np.empty(n, dtype=np.int64)
+        size[tlp]  = 1 + 2 + tlp_size + 4 + 1
+        size[dllp] = 1 + 6 + 1
+        size[idle] = 4*rng.integers(1, 5, len(idle))
+        if self.skp_interval:
+            before = self.skp_count + np.cumsum(size) - size
+            count  = before//self.skp_interval
+            skp    = np.diff(count, prepend=0) > 0
+            self.skp_count += int(size.sum()) - self.skp_interval*int(count[-1])
+        else:
+            skp = np.zeros(n, dtype=bool)
+        size  += 4*skp
+        start  = np.cumsum(size) - size
+        total  = int(size.sum())
+        data   = np.zeros(total, dtype=np.uint8)
+        ctrl   = np.zeros(total, dtype=bool)
+        offset = start + 4*skp # Items start.
+
+        # SKP Ordered Sets.
+        o = start[skp][:, None] + np.arange(4)
+        data[o] = [COM, SKP, SKP, SKP]
+        ctrl[o] = True
+
+        # TLPs: STP, Seq, Header, Payload, (ECRC), LCRC, END.
+        p = offset[tlp]
+        data[_ranges(p + 1, 2 + tlp_size + 4)] = rng.integers(0, 256, int(np.sum(2 + tlp_size + 4)),
+            dtype=np.uint8)
+        seq = (self.seq + np.arange(nt)) % 4096
+        self.seq = (self.seq + nt) % 4096
+        h = rng.integers(0, 256, (nt, 16), dtype=np.uint8)
+        requester = self.requesters[rng.integers(0, len(self.requesters), nt)]
+        completion = np.isin(tnames, ["cpl", "cpld"])
+        config     = np.isin(tnames, ["cfgrd0", "cfgwr0"])
+        message    = tnames == "msg"
+        h[:, 0] = fmt_type
+        tc   = rng.integers(0, 8, nt)
+        attr = rng.integers(0, 8, nt)
+        h[:, 1] = (tc << 4) | (attr & 0b100)                                  # TC, Attr[2].
+        h[:, 2] = (td << 7) | ((attr & 0b11) << 4) | ((length >> 8) & 0b11) # TD, no EP, Attr[1:0].
+        h[:, 3] = length & 0xff
+        # Requests: Requester ID, Tag, Byte Enables (or Message Code).
+        h[:, 4] = np.where(completion, self.completer >> 8, requester >> 8)
+        h[:, 5] = np.where(completion, self.completer & 0xff, requester & 0xff)
+        h[:, 7] = np.where(message, message_codes[rng.integers(0, len(message_codes), nt)],
+                  np.where(config | (length == 1), 0x0f, 0xff))
+        # Addresses (DW aligned), Configuration register (Destination ID from random bytes).
+        h[:, 11] &= 0xfc
+        h[:, 15] &= 0xfc
+        h[config, 10] &= 0x0f
+        # Completions: Status (Successful), Byte Count, Requester ID, Tag, Lower Address.
+        byte_count = 4*np.maximum(length, 1)
+        h[:, 6]  = np.where(completion, (byte_count >> 8) & 0xf, h[:, 6])
+        h[:, 7]  = np.where(completion, byte_count & 0xff, h[:, 7])
+        h[:, 8]  = np.where(completion, requester >> 8, h[:, 8])
+        h[:, 9]  = np.where(completion, requester & 0xff, h[:, 9])
+        h[:, 10] = np.where(completion, rng.integers(0, 256, nt), h[:, 10])
+        h[:, 11] = np.where(completion, h[:, 11] & 0x7c, h[:, 11])
+        data[p + 1] = seq >> 8
+        data[p + 2] = seq & 0xff
+        data[p[:, None] + 3 + np.arange(12)] = h[:, :12]
+        four = header_size == 16
+        data[p[four][:, None] + 3 + 12 + np.arange(4)] = h[four, 12:]
+        data[p] = STP
+        ctrl[p] = True
+        end = p + 1 + 2 + tlp_size + 4
+        data[end] = END
+        ctrl[end] = True
+
+        # ECRC (over the TLP, variant bits set) and LCRC (over Seq + TLP).
+        error = self._errors(nt, ["lcrc", "ecrc", "nullified", "truncated"])
+        error[(error == error_kinds.index("ecrc")) & ~td] = -1
+        ecrc = np.flatnonzero(td)
+        if len(ecrc):
+            o = p[ecrc] + 3
+            l = tlp_size[ecrc] - 4
+            _put_le(data, o + l, crc32(data, o, l, first_word_or=ECRC_VARIANT_BITS), 4)
+            e = np.flatnonzero(error == error_kinds.index("ecrc"))
+            data[p[e] + 3 + tlp_size[e] - 4] ^= np.uint8(1) << rng.integers(0, 8, len(e)).astype(np.uint8)
+        _put_le(data, end - 4, crc32(data, p + 1, 2 + tlp_size), 4)
+
+        # TLP errors.
+        e = np.flatnonzero(error == error_kinds.index("lcrc"))
+        if len(e):
+            position = p[e] + 1 + (rng.random(len(e))*(2 + tlp_size[e] + 4)).astype(np.int64)
+            data[position] ^= np.uint8(1) << rng.integers(0, 8, len(e)).astype(np.uint8)
+        e = np.flatnonzero(error == error_kinds.index("nullified"))
+        data[end[e]] = EDB
+        for i in range(4):
+            data[end[e] - 4 + i] ^= 0xff
+        e = np.flatnonzero(error == error_kinds.index("truncated"))
+        data[end[e]] = 0x00 # Ended by the next STP/SDP.
+        ctrl[end[e]] = False
+
+        # DLLPs: SDP, DLLP, CRC-16, END.
+        d  = offset[dllp]
+        nd = len(d)
+        data[d] = SDP
+        ctrl[d] = True
+        data[d + 1] = dllp_types[rng.choice(len(dllp_types), nd, p=dllp_type_weights)]
+        data[d + 2] = rng.integers(0, 256, nd, dtype=np.uint8)
+        data[d + 3] = rng.integers(0, 256, nd, dtype=np.uint8)
+        data[d + 4] = rng.integers(0, 256, nd, dtype=np.uint8)
+        ack = data[d + 1] <= 0x10
+        data[d[ack] + 2] = 0
+        data[d[ack] + 3] &= 0x0f
+        _put_le(data, d + 5, crc16(data, d + 1, 4), 2)
+        data[d + 7] = END
+        ctrl[d + 7] = True
+        dllp_error = self._errors(nd, ["dllp_crc"])
+        e = np.flatnonzero(dllp_error >= 0)
+        if len(e):
+            position = d[e] + 1 + rng.integers(0, 6, len(e))
+            data[position] ^= np.uint8(1) << rng.integers(0, 8, len(e)).astype(np.uint8)
+
+        # Statistics.
+        s = self.stats
+        s["symbols"]   += total
+        s["items"]     += n
+        s["tlps"]      += nt
+        s["dllps"]     += nd
+        s["idles"]     += len(idle)
+        s["skps"]      += int(np.count_nonzero(skp))
+        s["tlp_bytes"] += int(np.sum(2 + tlp_size + 4))
+        self.fields["tc"]   += np.bincount(tc[error < 0],   minlength=8)
+        self.fields["attr"] += np.bincount(attr[error < 0], minlength=8)
+        for name, count in zip(*np.unique(tnames, return_counts=True)):
+            s["tlp_" + name] += int(count)
+        for index, count in zip(*np.unique(np.append(error, dllp_error), return_counts=True)):
+            if index >= 0:
+                s["error_" + error_kinds[index]] += int(count)
+
+        return data, ctrl
+
+    def close(self):
+        """Final Ack DLLP terminating a truncated TLP at the end of the stream."""
+        errors, self.errors = self.errors, {}
+        mix,    self.p      = self.p, np.zeros(len(self.kinds))
+        self.p[self.kinds.index("dllp")] = 1
+        data, ctrl = self.generate(1)
+        self.errors, self.p = errors, mix
+        return data, ctrl
+
+# Capture Writer -----------------------------------------------------------------------------------
+
+class CaptureWriter:
+    """Capture Writer
+
+    Writes the symbols of a TrafficGenerator as a capture file of `format` (see capture.py):
+    scrambled (unless the layout is descrambled), without SKP symbols for layouts with SKP removal,
+    8b/10b encoded for raw20, and packed in whole words (the last one padded with Logical Idle).
+    Layouts with a sync flag start with a SKP Ordered Set and Logical Idle in words not flagged
+    synchronized, as recorded by the gateware. Filtered layouts are not supported.
+    """
+    def __init__(self, filename, format="netv2", generator=None):
+        if capture_filtered(format):
+            raise ValueError("Filtered captures can't be generated")
+        self.file        = open(filename, "wb")
+        self.format      = format
+        self.generator   = generator or TrafficGenerator()
+        self.scrambler   = Descrambler() if capture_scrambled(format) else None
+        self.skp_removed = capture_skp_removed(format)
+        self.encoder     = Encoder() if format == "raw20" else None
+        self.synced      = False
+        self.size        = 0
+        self.word_size, self.symbols_per_word = capture_formats[format]
+        self.tail_data   = np.zeros(0, dtype=np.uint8)
+        self.tail_ctrl   = np.zeros(0, dtype=bool)
+        if capture_layouts.get(format, {}).get("sync_offset") is not None:
+            self.write(np.array([COM, SKP, SKP, SKP], dtype=np.uint8), np.ones(4, dtype=bool),
+                final=True)
+
+    def write(self, data, ctrl, final=False):
+        if self.skp_removed:
+            keep = ~(ctrl & (data == SKP))
+            data, ctrl = data[keep], ctrl[keep]
+        data = np.concatenate([self.tail_data, data])
+        ctrl = np.concatenate([self.tail_ctrl, ctrl])
+        n    = self.symbols_per_word
+        if final:
+            data = np.append(data, np.zeros(-len(data)%n, dtype=np.uint8))
+            ctrl = np.append(ctrl, np.zeros(-len(ctrl)%n, dtype=bool))
+        words = len(data)//n
+        self.tail_data = data[n*words:]
+        self.tail_ctrl = ctrl[n*words:]
+        data, ctrl = data[:n*words], ctrl[:n*words]
+        if not words:
+            return
+        # Sync flag (descrambled layouts): set after the first word with a COM.
+        com    = np.any((ctrl & (data == COM)).reshape(-1, n), axis=1)
+        synced = (np.cumsum(com) - com + self.synced) > 0
+        self.synced = bool(synced[-1] | com[-1])
+        if self.scrambler is not None:
+            data = self.scrambler.process(data, ctrl)[0]
+        datas = pack(data, ctrl, self.format, self.encoder, synced)
+        self.file.write(datas)
+        self.size += len(datas)
+
+    def write_size(self, size, batch=16384):
+        """Generate and write traffic until the capture is at least `size` bytes."""
+        stats = self.generator.stats
+        while self.size < size:
+            n = batch
+            if self.size:
+                n = min(n, int((size - self.size)*stats["items"]/self.size) + 1)
+            self.write(*self.generator.generate(n))
+
+    def close(self):
+        self.write(*self.generator.close(), final=True)
+        self.file.close()
+
+
+def write_capture(filename, size, format="netv2", generator=None, batch=16384):
+    """Write a capture of about `size` bytes of synthetic traffic, returns its TrafficGenerator."""
+    writer = CaptureWriter(filename, format, generator)
+    writer.write_size(size, batch)
+    writer.close()
+    return writer.generator
@@ -0,0 +1,93 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+from migen import *
+
+from litex.soc.interconnect import stream
+
+from pcie_analyzer.common import SKP_INTERVAL
+
+# Helpers ------------------------------------------------------------------------------------------
+
+def K(x, y):
+    """K code generator ex: K(28, 5) is COM Symbol"""
+    return (y << 5) | x
+
+# TX SKP Inserter ----------------------------------------------------------------------------------
+
+class TXSKPInserter(Module):
+    """TX SKP Inserter
+
+    SKP Ordered Sets are inserted in the stream for clock compensation between partners with an
+    average of 1 SKP Ordered Set every 354 symbols. This module schedules a SKP Ordered Set (COM +
+    3 SKPs, so exactly one 32-bit word) in the TX stream every `interval` symbols, the remainder
+    is carried over so that the average interval is respected.
+
+    As required by the specification, scheduled SKP Ordered Sets are only inserted on packet
+    boundaries: when a TLP (STP ... END/EDB) or DLLP (SDP ... END) is in progress, they are held
+    (and accumulated) until the packet ends. They are also held during TS1/TS2 Ordered Sets.
+    """
+    def __init__(self, interval=SKP_INTERVAL):
+        self.sink   = sink   = stream.Endpoint([("data", 32), ("ctrl", 4)])
+        self.source = source = stream.Endpoint([("data", 32), ("ctrl", 4)])
+        self.insert = Signal()
+
+        # # #
+
+        # Track packets / TS1/TS2 Ordered Sets ----------------------------------------------------
+        in_packet = Signal() # Packet in progress after the last forwarded word.
+        ts_words  = Signal(2)
+        lanes     = [in_packet]
+        for i in range(4):
+            data = sink.data[8*i:8*(i+1)]
+            ctrl = sink.ctrl[i]
+            lane = Signal()
+            self.comb += [
+                lane.eq(lanes[-1]),
+                If(ctrl & ((data == K(27, 7)) | (data == K(28, 2))), # STP/SDP.
+                    lane.eq(1)
+                ),
+                If(ctrl & ((data == K(29, 7)) | (data == K(30, 7))), # END/EDB.
+                    lane.eq(0)
+                )
+            ]
+            lanes.append(lane)
+        ts_start = Signal()
+        self.comb += ts_start.eq(
+            (sink.data[0:8] == K(28, 5)) & sink.ctrl[0] &
+            (~sink.ctrl[1] | (sink.data[8:16] == K(23, 7))))
+        self.sync += [
+            If(sink.valid & sink.ready,
+                in_packet.eq(lanes[-1]),
+                If(ts_start,
+                    ts_words.eq(3)
+                ).Elif(ts_words != 0,
+                    ts_words.eq(ts_words - 1)
+                )
+            )
+        ]
+
+        # Count symbols since last SKP Ordered Set -------------------------------------------------
+        # Wide enough to accumulate the symbols of the largest packets while a SKP is held.
+        count = Signal(16)
+        self.comb += self.insert.eq((count >= interval) & ~in_packet & (ts_words == 0))
+        self.sync += [
+            If(source.valid & source.ready,
+                If(self.insert,
+                    count.eq(count - interval)
+                ).Else(
+                    count.eq(count + 4)
+                )
+            )
+        ]
+
+        # Insert SKP Ordered Set or forward Data/Ctrl ----------------------------------------------
+        self.comb += [
+            If(self.insert,
+                source.valid.eq(1),
+                source.data.eq((K(28, 0) << 24) | (K(28, 0) << 16) | (K(28, 0) << 8) | K(28, 5)),
+                source.ctrl.eq(0b1111)
+            ).Else(
+                sink.connect(source)
+            )
+        ]
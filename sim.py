@@ -25,6 +25,8 @@ from liteeth.phy.model import LiteEthPHYModel
 from liteeth.core import LiteEthUDPIPCore
 from liteeth.frontend.etherbone import LiteEthEtherbone
 
+from pcie_analyzer.build_cache import BuildCache, cached_verilator_build
+
 # IOs ----------------------------------------------------------------------------------------------
 
 _io = [
@@ -138,6 +140,7 @@ def main():
     parser.add_argument("--trace-start",      default=0,              help="Cycle to start VCD tracing")
     parser.add_argument("--trace-end",        default=-1,             help="Cycle to end VCD tracing")
     parser.add_argument("--opt-level",        default="O0",           help="Compilation optimization level")
+    parser.add_argument("--build-cache-dir",  default=None,           help="Reuse Verilator binaries of identical builds from this directory")
     args = parser.parse_args()
 
     soc_kwargs     = {}
@@ -156,12 +159,16 @@ def main():
         sdram_data_width = args.sdram_data_width,
         **soc_kwargs)
     builder = Builder(soc, csr_csv="tools/csr.csv")
-    vns = builder.build(threads=args.threads, sim_config=sim_config,
+    build_kwargs = dict(threads=args.threads, sim_config=sim_config,
         opt_level   = args.opt_level,
         trace       = args.trace,
         trace_start = int(args.trace_start),
         trace_end   = int(args.trace_end)
     )
+    if args.build_cache_dir is not None:
+        cached_verilator_build(builder, BuildCache(args.build_cache_dir), **build_kwargs)
+    else:
+        vns = builder.build(**build_kwargs)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+import sys
+import time
+import json
+import random
+import argparse
+import multiprocessing
+
+from migen import *
+
+from litex.soc.interconnect import stream
+
+from litedram.common import LiteDRAMNativePort
+
+from pcie_analyzer.common import SKP_INTERVAL
+from pcie_analyzer.scrambling import Descrambler
+from pcie_analyzer.rx_skp_remover import RXSKPRemover
+from pcie_analyzer.replay import Replay
+
+# Helpers ------------------------------------------------------------------------------------------
+
+def K(x, y):
+    """K code generator ex: K(28, 5) is COM Symbol"""
+    return (y << 5) | x
+
+COM = K(28, 5)
+SKP = K(28, 0)
+STP = K(27, 7)
+SDP = K(28, 2)
+END = K(29, 7)
+
+# Synthetic PCIe Symbols Generator -----------------------------------------------------------------
+
+def pcie_symbols(rng, skp_interval=SKP_INTERVAL, idle_ratio=0.3):
+    """Generate an endless stream of plain (byte, k) PCIe symbols.
+
+    The stream is made of Logical Idle, TLPs (STP ... END) and DLLPs (SDP ... END) with SKP Ordered
+    Sets inserted every `skp_interval` symbols. As on a real x1 link the recorder sees the Ordered
+    Sets aligned on its 32-bit words, so SKP Ordered Sets are only inserted on 4-symbol boundaries.
+    """
+    count = skp_interval
+    while True:
+        # SKP Ordered Set.
+        if count >= skp_interval:
+            count -= skp_interval
+            for symbol in [(COM, 1), (SKP, 1), (SKP, 1), (SKP, 1)]:
+                yield symbol
+        # Logical Idle, TLP or DLLP.
+        r = rng.random()
+        if r < idle_ratio:
+            packet = [(0x00, 0)]*4
+        elif r < (1 + idle_ratio)/2:
+            length  = 12 + 4*rng.randrange(0, 33) # Header + Payload.
+            packet  = [(STP, 1)]
+            packet += [(rng.randrange(256), 0) for _ in range(2 + length + 4)] # Seq + TLP + LCRC.
+            packet += [(END, 1)]
+        else:
+            packet  = [(SDP, 1)]
+            packet += [(rng.randrange(256), 0) for _ in range(6)] # DLLP + CRC.
+            packet += [(END, 1)]
+        # Pad to 4-symbol boundary with Logical Idle.
+        packet += [(0x00, 0)]*(-len(packet)%4)
+        for symbol in packet:
+            yield symbol
+        count += len(packet)
+
+def scramble(symbols, reset=0xffff):
+    """Scramble (byte, k) PCIe symbols (X^16 + X^5 + X^4 + X^3 + 1 polynom).
+
+    COM resets the LFSR, SKP does not advance it and K codes are not scrambled.
+    """
+    lfsr = reset
+    for byte, k in symbols:
+        if k and byte == COM:
+            lfsr = reset
+            yield byte, k
+            continue
+        if k and byte == SKP:
+            yield byte, k
+            continue
+        value = 0
+        for i in range(8):
+            fb     = (lfsr >> 15) & 0b1
+            value |= fb << i
+            lfsr   = ((lfsr << 1) & 0xffff) ^ (0x0039 if fb else 0x0000)
+        yield (byte, k) if k else (byte ^ value, k)
+
+def words(symbols):
+    """Group (byte, k) symbols in 32-bit (data, ctrl) words."""
+    symbols = iter(symbols)
+    while True:
+        data = 0
+        ctrl = 0
+        for i in range(4):
+            byte, k = next(symbols)
+            data |= byte << 8*i
+            ctrl |= k    << i
+        yield data, ctrl
+
+def unpack(datas, nbytes):
+    """Split (data, ctrl) recorded words in (byte, k) symbols."""
+    symbols = []
+    for data, ctrl in datas:
+        for i in range(nbytes):
+            symbols.append(((data >> 8*i) & 0xff, (ctrl >> i) & 0b1))
+    return symbols
+
+# Capture Chain ------------------------------------------------------------------------------------
+
+class CaptureChain(Module):
+    """Capture Chain
+
+    Descrambler -> RXSKPRemover -> Packer (32-bit to 96-bit + 12-bit ctrl, as on NeTV2) -> Recorder
+    FIFO. The source has the recorder's layout.
+    """
+    def __init__(self, fifo_depth=16):
+        self.sink   = sink   = stream.Endpoint([("data", 32), ("ctrl", 4)])
+        self.source = source = stream.Endpoint([("data", 128)])
+
+        # # #
+
+        self.submodules.descrambler = descrambler = Descrambler()
+        self.submodules.skp_remover = skp_remover = RXSKPRemover()
+        self.submodules.packer      = packer      = stream.StrideConverter(
+            [("data", 32), ("ctrl",  4)],
+            [("data", 96), ("ctrl", 12)],
+            reverse = False)
+        self.submodules.fifo        = fifo        = stream.SyncFIFO([("data", 128)], fifo_depth)
+        self.comb += [
+            sink.connect(descrambler.sink),
+            descrambler.source.connect(skp_remover.sink),
+            skp_remover.source.connect(packer.sink),
+            fifo.sink.valid.eq(packer.source.valid),
+            fifo.sink.data[0:96].eq(packer.source.data),
+            fifo.sink.data[96:108].eq(packer.source.ctrl),
+            packer.source.ready.eq(fifo.sink.ready),
+            fifo.source.connect(source),
+        ]
+
+# Replay Chain -------------------------------------------------------------------------------------
+
+class GTPTXModel(Module):
+    """GTP TX model: 16-bit data + 2-bit ctrl per cycle (250MHz at 5GT/s), never back-pressures."""
+    def __init__(self):
+        self.sink = stream.Endpoint([("data", 16), ("ctrl", 2)])
+
+class ReplayChain(Module):
+    """Replay Chain
+
+    Replay (as on NeTV2: 128-bit DRAM port in sys, 12 symbols + ctrl per word) reading a plain
+    capture from a LiteDRAM native port and driving a GTP TX model in the gtp0_tx domain.
+    """
+    def __init__(self, skp_interval=SKP_INTERVAL):
+        self.clock_domains.cd_sys     = ClockDomain()
+        self.clock_domains.cd_gtp0_tx = ClockDomain()
+        self.port = LiteDRAMNativePort("both", address_width=24, data_width=128)
+        self.submodules.gtp    = GTPTXModel()
+        self.submodules.replay = Replay(self.port, self.gtp, "gtp0_tx", skp_interval=skp_interval)
+
+# Benchmark ----------------------------------------------------------------------------------------
+
+scenarios = {
+    # name               : (input_rate, recorder_ready)
+    "line-rate"          : (1.00, 1.00),
+    "backpressure-75"    : (1.00, 0.75),
+    "backpressure-50"    : (1.00, 0.50),
+    "backpressure-25"    : (1.00, 0.25),
+    "half-rate-bp-25"    : (0.50, 0.25),
+}
+
+replay_scenarios = {
+    # name               : (dram_ready (DRAM commands accepted / cycle), DRAM stalls)
+    "replay-5g"          : (1.00, 0),
+    "replay-5g-dram-75"  : (0.75, 0),
+    "replay-5g-dram-50"  : (0.50, 0),
+    "replay-5g-stalls"   : (1.00, 2),
+}
+
+def run_scenario(input_rate, recorder_ready, cycles, seed, skp_interval=SKP_INTERVAL,
+    fifo_depth=16):
+    """Run the Capture Chain with randomized input gaps and recorder back-pressure.
+
+    As a GTP, the input can't be back-pressured: words presented while the chain is not ready are
+    dropped. Returns a dict of throughput/drop statistics.
+    """
+    rng     = random.Random(seed)
+    dut     = CaptureChain(fifo_depth=fifo_depth)
+    plain   = []
+    symbols = pcie_symbols(rng, skp_interval=skp_interval)
+    stats   = {"input_words": 0, "dropped_words": 0, "recorded": []}
+
+    def record(g):
+        for symbol in g:
+            plain.append(symbol)
+            yield symbol
+
+    def input_generator():
+        datas = words(scramble(record(symbols)))
+        for i in range(cycles):
+            if rng.random() < input_rate:
+                data, ctrl = next(datas)
+                yield dut.sink.valid.eq(1)
+                yield dut.sink.data.eq(data)
+                yield dut.sink.ctrl.eq(ctrl)
+            else:
+                yield dut.sink.valid.eq(0)
+            yield
+
+    @passive
+    def input_monitor():
+        while True:
+            if (yield dut.sink.valid):
+                stats["input_words"] += 1
+                if not (yield dut.sink.ready):
+                    stats["dropped_words"] += 1
+            yield
+
+    @passive
+    def recorder():
+        while True:
+            yield dut.source.ready.eq(rng.random() < recorder_ready)
+            yield
+            if (yield dut.source.valid) & (yield dut.source.ready):
+                data = (yield dut.source.data)
+                stats["recorded"].append((data & (2**96 - 1), data >> 96))
+
+    start = time.time()
+    run_simulation(dut, [input_generator(), input_monitor(), recorder()])
+    duration = time.time() - start
+
+    # Check recorded symbols against the plain symbols (without SKPs).
+    recorded = unpack(stats["recorded"], 12)
+    expected = [s for s in plain if s != (SKP, 1)][:len(recorded)]
+    integrity = (recorded == expected) if not stats["dropped_words"] else None
+
+    return {
+        "cycles"            : cycles,
+        "input_symbols"     : 4*stats["input_words"],
+        "dropped_symbols"   : 4*stats["dropped_words"],
+        "recorded_symbols"  : len(recorded),
+        "symbols_per_cycle" : len(recorded)/cycles,
+        "integrity"         : integrity,
+        "sim_cycles_per_s"  : cycles/duration,
+    }
+
+def run_replay_scenario(dram_ready, cycles, seed, skp_interval=SKP_INTERVAL, dram_latency=16,
+    stalls=0, stall_cycles=450):
+    """Replay a plain capture from DRAM on a 5GT/s GTP TX (sys: 100MHz, gtp0_tx: 250MHz).
+
+    The DRAM accepts commands with a `dram_ready` probability and returns the datas `dram_latency`
+    cycles later; `stalls` times during the replay, it accepts no command for `stall_cycles` cycles
+    (longer than the replay buffers). The capture is sized to be replayed within the simulation.
+    The transmitted symbols are descrambled (LFSR reset on each COM) and compared to the capture;
+    SKP Ordered Sets and the Logical Idle words inserted in the replay (the capture has none) are
+    located. Returns a dict of statistics, see check_invariants.
+    """
+    rng = random.Random(seed)
+    dut = ReplayChain(skp_interval=skp_interval)
+
+    # Plain capture (without Logical Idle words and SKP Ordered Sets, starting with a packet), 12
+    # symbols per DRAM word.
+    nwords  = int((cycles - 100 - stalls*stall_cycles)*5/12*0.8)
+    symbols = pcie_symbols(rng, skp_interval=2**32, idle_ratio=0)
+    symbols = (s for s in symbols if s not in [(COM, 1), (SKP, 1)])
+    plain   = []
+    memory  = []
+    for data, ctrl in words(symbols):
+        if not plain and ctrl == 0:
+            continue
+        plain += unpack([(data, ctrl)], 4)
+        if len(plain) == 12*nwords:
+            break
+    for i in range(nwords):
+        data = sum(b << 8*j for j, (b, k) in enumerate(plain[12*i:12*(i+1)]))
+        ctrl = sum(k << j   for j, (b, k) in enumerate(plain[12*i:12*(i+1)]))
+        memory.append(data | (ctrl << 96))
+    stats = {"tx": [], "bubbles": 0}
+
+    def control():
+        dma = dut.replay.dma
+        for i in range(16):
+            yield
+        yield dma._base.storage.eq(0)
+        yield dma._length.storage.eq(16*nwords)
+        yield dma._enable.storage.eq(1)
+        for i in range(cycles):
+            yield
+        stats["underflows"] = (yield dut.replay.underflows.status)
+
+    @passive
+    def dram():
+        port     = dut.port
+        pending  = []
+        cycle    = 0
+        stall_at = [(i + 1)*nwords//(stalls + 1) for i in range(stalls)] # Words served.
+        stall    = 0
+        yield port.rdata.valid.eq(0)
+        while True:
+            if (yield port.cmd.valid) & (yield port.cmd.ready):
+                addr = (yield port.cmd.addr)
+                pending.append((cycle + dram_latency, memory[addr]))
+                if stall_at and addr + 1 == stall_at[0]:
+                    stall_at.pop(0)
+                    stall = stall_cycles
+            if (yield port.rdata.valid) & (yield port.rdata.ready):
+                pending.pop(0)
+            stall = max(stall - 1, 0)
+            yield port.cmd.ready.eq((rng.random() < dram_ready) & (stall == 0))
+            if pending and pending[0][0] <= cycle:
+                yield port.rdata.valid.eq(1)
+                yield port.rdata.data.eq(pending[0][1])
+            else:
+                yield port.rdata.valid.eq(0)
+            yield
+            cycle += 1
+
+    @passive
+    def gtp():
+        yield dut.gtp.sink.ready.eq(1)
+        while True:
+            yield
+            if (yield dut.gtp.sink.valid):
+                stats["tx"].append(((yield dut.gtp.sink.data), (yield dut.gtp.sink.ctrl)))
+            elif stats["tx"]:
+                stats["bubbles"] += 1
+
+    start = time.time()
+    run_simulation(dut,
+        generators = {"sys": [control(), dram()], "gtp0_tx": [gtp()]},
+        clocks     = {"sys": 10, "gtp0_tx": 4})
+    duration = time.time() - start
+
+    # Descramble the transmitted symbols (32-bit words), locate SKP Ordered Sets and Logical Idle
+    # words inserted in the replay, check the replayed words.
+    tx    = list(scramble(unpack(stats["tx"], 2)))
+    tx    = [tx[n:n + 4] for n in range(0, len(tx) - 3, 4)]
+    plain = [plain[n:n + 4] for n in range(0, len(plain), 4)]
+    idle  = [(0x00, 0)]*4
+    skp_ordered_sets = 0
+    skps_in_packets  = 0
+    idles            = 0 # Logical Idle words inserted in the replay.
+    idle_runs        = 0
+    previous         = None # Last word, SKP Ordered Sets excluded.
+    in_packet        = False
+    replayed         = []
+    first = last     = None
+    for n, word in enumerate(tx):
+        if word == [(COM, 1), (SKP, 1), (SKP, 1), (SKP, 1)]:
+            skp_ordered_sets += 1
+            skps_in_packets  += in_packet
+            continue
+        if first is None and word == plain[0]:
+            first = n
+        if first is None or len(replayed) == len(plain):
+            continue
+        if word == idle:
+            idle_runs += (previous != idle)
+            idles     += 1
+            previous   = word
+            continue
+        replayed.append(word)
+        previous = word
+        last = n
+        for byte, k in word:
+            if k and byte in [STP, SDP]:
+                in_packet = True
+            if k and byte == END:
+                in_packet = False
+    integrity = (replayed == plain)
+
+    return {
+        "cycles"            : cycles,
+        "replayed_symbols"  : 4*len(replayed),
+        "stalls"            : stalls,
+        "underflows"        : stats["underflows"],
+        "idle_words"        : idles,
+        "idle_runs"         : idle_runs,
+        "bubbles"           : stats["bubbles"],
+        "skp_ordered_sets"  : skp_ordered_sets,
+        "skps_in_packets"   : skps_in_packets,
+        "symbols_per_cycle" : 4*len(replayed)/(2*(last - first + 1)) if replayed else 0.0,
+        "integrity"         : integrity,
+        "sim_cycles_per_s"  : cycles/duration,
+    }
+
+def run(name, cycles, seed, skp_interval, fifo_depth):
+    if name in replay_scenarios:
+        dram_ready, stalls = replay_scenarios[name]
+        return run_replay_scenario(dram_ready, cycles, seed, skp_interval, stalls=stalls)
+    return run_scenario(*scenarios[name], cycles, seed, skp_interval, fifo_depth)
+
+def check_invariants(results):
+    """Check the results that don't depend on a baseline."""
+    errors = []
+    for name, r in results.items():
+        if r["integrity"] is False:
+            errors.append("{}: recorded/replayed symbols mismatch".format(name))
+        if name not in replay_scenarios:
+            continue
+        # The scrambler re-synchronizes on COM: the symbols are only descrambled when it does, check
+        # that there were COMs to re-synchronize on.
+        if not r["skp_ordered_sets"]:
+            errors.append("{}: no SKP Ordered Set transmitted".format(name))
+        # SKP Ordered Sets only between packets (the capture has no TS1/TS2 Ordered Sets).
+        if r["skps_in_packets"]:
+            errors.append("{}: {} SKP Ordered Sets in packets".format(name, r["skps_in_packets"]))
+        # Underflow counter equal to the inserted Logical Idle words, one underflow per DRAM stall.
+        if r["underflows"] != r["idle_words"]:
+            errors.append("{}: {} underflows counted, {} Logical Idle words inserted".format(
+                name, r["underflows"], r["idle_words"]))
+        if r["idle_runs"] != r["stalls"]:
+            errors.append("{}: {} underflows for {} DRAM stalls".format(
+                name, r["idle_runs"], r["stalls"]))
+        if r["bubbles"]:
+            errors.append("{}: {} bubbles".format(name, r["bubbles"]))
+    return errors
+
+def check_regressions(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ref = baseline[name]
+        if result["symbols_per_cycle"] < ref["symbols_per_cycle"]*(1 - tolerance):
+            regressions.append("{}: symbols/cycle {:.3f} < {:.3f}".format(
+                name, result["symbols_per_cycle"], ref["symbols_per_cycle"]))
+        for key in ["dropped_symbols", "underflows", "bubbles", "skps_in_packets"]:
+            if key in result and result[key] > ref.get(key, 0)*(1 + tolerance):
+                regressions.append("{}: {} {} > {}".format(
+                    name, key.replace("_", " "), result[key], ref.get(key, 0)))
+    return regressions
+
+# Run ----------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="PCIe Analyzer Capture Chain Simulation/Benchmark")
+    parser.add_argument("--cycles",        default=2000, type=int,  help="Cycles per scenario")
+    parser.add_argument("--jobs",          default=None, type=int,  help="Scenarios run in parallel (default=CPUs)")
+    parser.add_argument("--seed",          default=0,    type=int,  help="Random seed")
+    parser.add_argument("--scenario",      action="append",         help="Scenario(s) to run (default=all)")
+    parser.add_argument("--skp-interval",  default=SKP_INTERVAL, type=int, help="SKP Ordered Set interval (symbols)")
+    parser.add_argument("--fifo-depth",    default=16,   type=int,  help="Recorder FIFO depth")
+    parser.add_argument("--json",          default=None,            help="Dump results to JSON file")
+    parser.add_argument("--baseline",      default=None,            help="Compare results to JSON baseline")
+    parser.add_argument("--tolerance",     default=0.02, type=float, help="Baseline tolerance")
+    args = parser.parse_args()
+
+    names = args.scenario or list(scenarios.keys()) + list(replay_scenarios.keys())
+    jobs  = [(name, args.cycles, args.seed, args.skp_interval, args.fifo_depth) for name in names]
+    with multiprocessing.Pool(args.jobs) as pool:
+        results = dict(zip(names, pool.starmap(run, jobs)))
+    for name, r in results.items():
+        if name in replay_scenarios:
+            print("{:18s}: {:.3f} symbols/cycle, {:6d} replayed, {:6d} underflows ({} stalls), {:6d} bubbles, {:6d} SKPs in packets, integrity: {} ({:.0f} cycles/s)".format(
+                name,
+                r["symbols_per_cycle"],
+                r["replayed_symbols"],
+                r["underflows"],
+                r["stalls"],
+                r["bubbles"],
+                r["skps_in_packets"],
+                {True: "ok", False: "FAIL"}[r["integrity"]],
+                r["sim_cycles_per_s"]))
+            continue
+        print("{:18s}: {:.3f} symbols/cycle, {:6d} recorded, {:6d} dropped, integrity: {} ({:.0f} cycles/s)".format(
+            name,
+            r["symbols_per_cycle"],
+            r["recorded_symbols"],
+            r["dropped_symbols"],
+            {True: "ok", False: "FAIL", None: "n/a"}[r["integrity"]],
+            r["sim_cycles_per_s"]))
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+
+    errors = check_invariants(results)
+    for error in errors:
+        print("ERROR: " + error)
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = check_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION: " + regression)
+    if errors or regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+import os
+import unittest
+import tempfile
+
+from pcie_analyzer.build_cache import BuildCache, cached_vivado_build, cached_verilator_build
+
+# Helpers ------------------------------------------------------------------------------------------
+
+def write(filename, content):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "w") as f:
+        f.write(content)
+
+class _Platform:
+    sources = []
+
+class _SoC:
+    build_name = "top"
+    platform   = _Platform()
+
+class _Builder:
+    """Generates the sources and build script of a design as a LiteX Builder with run=False, the
+    build script counts its runs and produces the outputs."""
+    def __init__(self, directory, verilog="module top(); endmodule\n", outputs=["top.bit"]):
+        self.soc          = _SoC()
+        self.gateware_dir = os.path.join(directory, "gateware")
+        self.verilog      = verilog
+        self.outputs      = outputs
+
+    def build(self, run=True, **kwargs):
+        assert not run
+        write(os.path.join(self.gateware_dir, "top.v"), self.verilog)
+        write(os.path.join(self.gateware_dir, "build_top.sh"),
+            "echo run >> runs.log\n" +
+            "".join("mkdir -p $(dirname {0}); echo {0} > {0}\n".format(o) for o in self.outputs))
+
+    def runs(self):
+        try:
+            with open(os.path.join(self.gateware_dir, "runs.log")) as f:
+                return len(f.readlines())
+        except OSError:
+            return 0
+
+# Test Build Cache ---------------------------------------------------------------------------------
+
+class TestBuildCache(unittest.TestCase):
+    def test_key_stability(self):
+        with tempfile.TemporaryDirectory() as d:
+            cache = BuildCache(os.path.join(d, "cache"))
+            # Same sources in another directory/written in another order: same key.
+            write(os.path.join(d, "a", "top.v"),           "module top(); endmodule\n")
+            write(os.path.join(d, "a", "top.xdc"),         "# constraints\n")
+            write(os.path.join(d, "b", "top.xdc"),         "# constraints\n")
+            write(os.path.join(d, "b", "top.v"),           "module top(); endmodule\n")
+            # Build outputs and non-source files are ignored.
+            write(os.path.join(d, "b", "top.log"),         "log\n")
+            write(os.path.join(d, "b", "obj_dir", "x.cpp"), "int x;\n")
+            key = cache.key(os.path.join(d, "a"), options={"x": "1", "y": "2"})
+            self.assertEqual(key, cache.key(os.path.join(d, "a"), options={"y": "2", "x": "1"}))
+            self.assertEqual(key, cache.key(os.path.join(d, "b"), options={"x": "1", "y": "2"}))
+            # Changed source/options: different key.
+            self.assertNotEqual(key, cache.key(os.path.join(d, "a"), options={"x": "2", "y": "2"}))
+            write(os.path.join(d, "b", "top.v"), "module top(input i); endmodule\n")
+            self.assertNotEqual(key, cache.key(os.path.join(d, "b"), options={"x": "1", "y": "2"}))
+
+    def test_vivado_skip_on_hit(self):
+        with tempfile.TemporaryDirectory() as d:
+            cache   = BuildCache(os.path.join(d, "cache"))
+            builder = _Builder(os.path.join(d, "build"), outputs=["top.bit"])
+            self.assertFalse(cached_vivado_build(builder, cache))
+            self.assertEqual(builder.runs(), 1)
+            os.remove(os.path.join(builder.gateware_dir, "top.bit"))
+            self.assertTrue(cached_vivado_build(builder, cache))
+            self.assertEqual(builder.runs(), 1)
+            self.assertTrue(os.path.exists(os.path.join(builder.gateware_dir, "top.bit")))
+            # Changed design: rebuilt.
+            builder.verilog = "module top(input i); endmodule\n"
+            self.assertFalse(cached_vivado_build(builder, cache))
+            self.assertEqual(builder.runs(), 2)
+            self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_verilator_skip_on_hit(self):
+        with tempfile.TemporaryDirectory() as d:
+            cache   = BuildCache(os.path.join(d, "cache"))
+            builder = _Builder(os.path.join(d, "build"), outputs=["obj_dir/Vsim", "modules/x.so"])
+            self.assertFalse(cached_verilator_build(builder, cache, run=False, opt_level="O0"))
+            self.assertEqual(builder.runs(), 1)
+            self.assertTrue(cached_verilator_build(builder, cache, run=False, opt_level="O0"))
+            self.assertEqual(builder.runs(), 1)
+            self.assertTrue(os.path.exists(os.path.join(builder.gateware_dir, "obj_dir", "Vsim")))
+            # Changed options: rebuilt.
+            self.assertFalse(cached_verilator_build(builder, cache, run=False, opt_level="O3"))
+            self.assertEqual(builder.runs(), 2)
@@ -0,0 +1,51 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+import os
+import time
+import unittest
+import tempfile
+import threading
+
+from pcie_analyzer.software.traffic import write_capture
+from pcie_analyzer.software.live import LiveDecoder, LiveView, follow, live
+
+# Test Live Decode ---------------------------------------------------------------------------------
+
+class TestLive(unittest.TestCase):
+    def test_latency_flush_when_idle(self):
+        chunk_size = 64*1024
+        latency    = 0.2
+        with tempfile.TemporaryDirectory() as d:
+            write_capture(os.path.join(d, "ref.bin"), 8*1024, batch=64)
+            with open(os.path.join(d, "ref.bin"), "rb") as f:
+                datas = f.read()
+            self.assertLess(len(datas), chunk_size)
+
+            # Reference: TLPs decoded from the same bytes.
+            decoder = LiveDecoder(chunk_size=chunk_size)
+            decoder.feed(datas)
+            expected = len(decoder.flush())
+            self.assertGreater(expected, 0)
+
+            # Capture file written once then idle: the TLPs are published within `latency`.
+            published = []
+            view      = LiveView(callback=lambda tlps: published.append(time.monotonic()))
+            view.start()
+            decoder   = LiveDecoder(chunk_size=chunk_size, latency=latency)
+            stop      = threading.Event()
+            filename  = os.path.join(d, "capture.bin")
+            open(filename, "wb").close()
+            source    = follow(filename, stop=stop)
+            thread    = threading.Thread(target=live, args=(source, decoder, view))
+            thread.start()
+            with open(filename, "ab") as f:
+                f.write(datas)
+            written = time.monotonic()
+            while view.published < expected and time.monotonic() - written < 10*latency:
+                time.sleep(0.01)
+            stop.set()
+            thread.join()
+            view.stop()
+            self.assertEqual(view.published, expected)
+            self.assertLess(published[0] - written, latency + 0.1)
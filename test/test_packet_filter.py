@@ -0,0 +1,191 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+import random
+import unittest
+
+from migen import *
+
+from pcie_analyzer.packet_filter import PacketFilter, STP, SDP, END, GAP
+
+# Traffic ------------------------------------------------------------------------------------------
+
+RIDS  = [0x0100, 0x0200, 0x0300]
+ADDRS = [0x1000, 0x2000, 0x80000000]
+
+def tlp(rng, kind):
+    """Random TLP as (symbols, info), with Sequence Number, header, payload/ECRC and LCRC."""
+    rid  = rng.choice(RIDS)
+    tag  = rng.randrange(256)
+    addr = rng.choice(ADDRS) + 4*rng.randrange(64)
+    ecrc = 0
+    if kind == "mrd":
+        length = 0
+        header = [0x00, 0, 0, 1, rid >> 8, rid & 0xff, tag, 0xff]
+        header += list(addr.to_bytes(4, "big"))
+    elif kind == "mwr64":
+        addr  |= 1 << 32
+        length = rng.randrange(1, 5)
+        header = [0x60, 0, 0, length, rid >> 8, rid & 0xff, tag, 0xff]
+        header += list(addr.to_bytes(8, "big"))
+    elif kind == "mwr":
+        # Long writes: lengths over 255 symbols exercise the upper bytes of the GAP length.
+        length = rng.randrange(64, 128) if rng.random() < 0.2 else rng.randrange(1, 9)
+        ecrc   = 1
+        header = [0x40, 0, 0x80, length, rid >> 8, rid & 0xff, tag, 0xff]
+        header += list(addr.to_bytes(4, "big"))
+    else: # cpld
+        length = rng.randrange(1, 9)
+        header = [0x4a, 0, 0, length, 0x00, 0x08, 0, 4*length, rid >> 8, rid & 0xff, tag, 0]
+    symbols  = [(STP, 1), (0, 0), (rng.randrange(256), 0)] + [(b, 0) for b in header]
+    symbols += [(rng.randrange(256), 0) for _ in range(4*(length + ecrc) + 4)] + [(END, 1)]
+    return symbols, dict(kind=kind, type=header[0], rid=rid, tag=tag, addr=addr)
+
+def dllp(rng):
+    """Random DLLP as (symbols, info)."""
+    t = rng.choice([0x00, 0x10, 0x20])
+    symbols = [(SDP, 1), (t, 0)] + [(rng.randrange(256), 0) for _ in range(5)] + [(END, 1)]
+    return symbols, dict(kind="dllp", type=t)
+
+# Rules --------------------------------------------------------------------------------------------
+
+def random_rule(rng):
+    return dict(
+        enable  = int(rng.random() < 0.8),
+        action  = rng.randrange(2),
+        tlp     = rng.randrange(2),
+        dllp    = rng.randrange(2),
+        address = rng.randrange(2),
+        tv = rng.choice([0x00, 0x10, 0x40, 0x4a, 0x60]), tm = rng.choice([0x00, 0xff, 0xff, 0xdf]),
+        rv = rng.choice(RIDS),                           rm = rng.choice([0x0000, 0xffff, 0xffff]),
+        gv = rng.randrange(256),                         gm = rng.choice([0x00, 0x01]),
+        amin = rng.choice(ADDRS), amax = rng.choice(ADDRS) + rng.choice([0xff, 0xffff]),
+    )
+
+def keep(rules, default, info):
+    """Reference: action of the first enabled matching rule, `default` when none matches."""
+    for r in rules:
+        if not r["enable"]:
+            continue
+        if info["kind"] == "dllp":
+            if not r["dllp"] or (info["type"] ^ r["tv"]) & r["tm"]:
+                continue
+            return r["action"]
+        if not r["tlp"] or (info["type"] ^ r["tv"]) & r["tm"]:
+            continue
+        if (info["rid"] ^ r["rv"]) & r["rm"] or (info["tag"] ^ r["gv"]) & r["gm"]:
+            continue
+        if r["address"] and (info["kind"] == "cpld" or not r["amin"] <= info["addr"] <= r["amax"]):
+            continue
+        return r["action"]
+    return default
+
+# Simulation ---------------------------------------------------------------------------------------
+
+def write_storage(csr, value):
+    # CSR fields are driven from the storage by the CSR bank, not present in this simulation.
+    yield csr.storage.eq(value)
+    for field in getattr(getattr(csr, "fields", None), "fields", []):
+        yield getattr(csr.fields, field.name).eq((value >> field.offset) & (2**field.size - 1))
+
+def simulate(rules, default, inputs, valid, ready, rng):
+    """Stream `inputs` symbols through a PacketFilter with `sink.valid`/`source.ready` asserted with
+    probabilities `valid`/`ready`, returns (output symbols, kept/filtered counters)."""
+    dut      = PacketFilter("sys", nrules=len(rules))
+    out      = []
+    counters = {}
+    def write_rules():
+        yield dut.enable.storage.eq(1)
+        yield dut.default.storage.eq(default)
+        for i, r in enumerate(rules):
+            control = (r["enable"] << 0 | r["action"] << 1 | r["tlp"] << 2 | r["dllp"] << 3 |
+                       r["address"] << 4)
+            yield dut.rule_index.storage.eq(i)
+            yield from write_storage(dut.rule_control, control)
+            yield from write_storage(dut.rule_type, r["tv"] | r["tm"] << 8)
+            yield from write_storage(dut.rule_requester_id, r["rv"] | r["rm"] << 16)
+            yield from write_storage(dut.rule_tag, r["gv"] | r["gm"] << 8)
+            yield dut.rule_address_min.storage.eq(r["amin"])
+            yield dut.rule_address_max.storage.eq(r["amax"])
+            yield dut.rule_write.re.eq(1)
+            yield
+            yield dut.rule_write.re.eq(0)
+            yield
+        for i in range(4):
+            yield
+    def generator():
+        yield from write_rules()
+        for i in range(0, len(inputs), 4):
+            word = inputs[i:i + 4]
+            while rng.random() > valid:
+                yield dut.sink.valid.eq(0)
+                yield
+            yield dut.sink.valid.eq(1)
+            yield dut.sink.data.eq(sum(b << 8*j for j, (b, k) in enumerate(word)))
+            yield dut.sink.ctrl.eq(sum(k << j for j, (b, k) in enumerate(word)))
+            yield
+            while not (yield dut.sink.ready):
+                yield
+        yield dut.sink.valid.eq(0)
+        for i in range(64):
+            yield
+        counters["kept"]     = (yield dut.kept.status)
+        counters["filtered"] = (yield dut.filtered.status)
+    @passive
+    def monitor():
+        while True:
+            yield dut.source.ready.eq(rng.random() < ready)
+            yield
+            if (yield dut.source.valid) and (yield dut.source.ready):
+                data = (yield dut.source.data)
+                ctrl = (yield dut.source.ctrl)
+                out.extend(((data >> 8*j) & 0xff, (ctrl >> j) & 1) for j in range(4))
+    run_simulation(dut, [generator(), monitor()])
+    return out, counters
+
+# Test Packet Filter -------------------------------------------------------------------------------
+
+class TestPacketFilter(unittest.TestCase):
+    def check(self, seed, valid, ready, npackets=150):
+        rng     = random.Random(seed)
+        rules   = [random_rule(rng) for i in range(4)]
+        default = rng.randrange(2)
+        inputs   = []
+        expected = []
+        kept     = 0
+        filtered = 0
+        for i in range(npackets):
+            r = rng.random()
+            if r < 0.2:
+                idle = [(0, 0)]*rng.randrange(1, 6)
+                inputs   += idle
+                expected += idle
+                continue
+            kind = rng.choice(["mrd", "mwr", "mwr64", "cpld"])
+            symbols, info = dllp(rng) if r < 0.45 else tlp(rng, kind)
+            inputs += symbols
+            if keep(rules, default, info):
+                expected += symbols
+                kept     += 1
+            else:
+                # Dropped packets: GAP followed by the 24-bit length (little endian).
+                expected += [(GAP, 1)] + [((len(symbols) >> 8*j) & 0xff, 0) for j in range(3)]
+                filtered += 1
+        inputs += [(0, 0)]*(-len(inputs)%4)
+        self.assertTrue(kept and filtered) # Seeds are chosen to keep and drop packets.
+        out, counters = simulate(rules, default, inputs, valid, ready, rng)
+        # Kept packets are unchanged, dropped ones replaced by their markers, in order.
+        self.assertEqual(out[:len(expected)], expected)
+        self.assertGreater(len(out), len(expected) - 4)
+        self.assertEqual(counters, {"kept": kept, "filtered": filtered})
+
+    def test_no_backpressure(self):
+        self.check(seed=0, valid=1.0, ready=1.0)
+
+    def test_source_stalls(self):
+        for seed in [3, 4]:
+            self.check(seed=seed, valid=1.0, ready=0.5)
+
+    def test_sink_gaps_and_source_stalls(self):
+        for seed in [0, 4]:
+            self.check(seed=seed, valid=0.7, ready=0.7)
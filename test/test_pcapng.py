@@ -0,0 +1,49 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+import os
+import unittest
+import tempfile
+
+from pcie_analyzer.software.traffic import TrafficGenerator, write_capture
+from pcie_analyzer.software.capture import CaptureReader
+from pcie_analyzer.software.pcapng import PcapngWriter, export
+
+# Test Pcapng Export -------------------------------------------------------------------------------
+
+class TestPcapngExport(unittest.TestCase):
+    def export(self, d, filename, jobs):
+        output = os.path.join(d, "capture{}.pcapng".format(jobs))
+        writer = PcapngWriter(output)
+        reader = CaptureReader(filename, "netv2", chunk_size=64*1024)
+        stats  = export(reader, writer, writer.add_interface("capture"), start_time=1000,
+            check_crc=True, jobs=jobs)
+        writer.close()
+        with open(output, "rb") as f:
+            return f.read(), stats
+
+    def test_parallel_export(self):
+        with tempfile.TemporaryDirectory() as d:
+            filename  = os.path.join(d, "capture.bin")
+            generator = TrafficGenerator(seed=1, errors={"truncated": 0.05, "lcrc": 0.01})
+            write_capture(filename, 1024*1024, generator=generator, batch=4096)
+            # Start mid-stream, then a packet without END longer than max_packet_size over several
+            # chunks (4096 words) without COM, SKP Ordered Sets and a packet without END spanning
+            # the next chunk boundary (28672) with COMs before it.
+            with open(filename, "rb") as f:
+                datas = bytearray(f.read()[16*1001:])
+            stp = bytes([0xfb] + [0]*11 + [0x01] + [0]*3)
+            datas[16*20000:16*30000] = bytes(16*10000)
+            for i in range(25000, 30000, 100):
+                datas[16*i:16*i + 16] = bytes([0xbc] + [0x1c]*3 + [0]*8 + [0x0f] + [0]*3)
+            for i in [20000, 28672 - 600]:
+                datas[16*i:16*i + 16] = stp
+            with open(filename, "wb") as f:
+                f.write(datas)
+
+            # Chunks exported in worker processes give the same pcapng as a single process.
+            reference, stats = self.export(d, filename, jobs=0)
+            self.assertGreater(stats["dropped_symbols"], 0)
+            self.assertGreater(stats["unsynchronized"], 0)
+            for jobs in [1, 2]:
+                self.assertEqual(self.export(d, filename, jobs), (reference, stats))
@@ -0,0 +1,67 @@
+# This file is Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# License: BSD
+
+import random
+import unittest
+
+from migen import *
+
+from pcie_analyzer.rx_skp_remover import K, RXSKPRemover
+
+# Helpers ------------------------------------------------------------------------------------------
+
+COM = K(28, 5)
+SKP = K(28, 0)
+
+def symbols(rng, nwords, skp_ratio=0.05):
+    """Random data words and SKP Ordered Sets as (data, ctrl) symbols."""
+    syms = []
+    for i in range(nwords):
+        if rng.random() < skp_ratio:
+            syms += [(COM, 1), (SKP, 1), (SKP, 1), (SKP, 1)]
+        else:
+            syms += [(rng.randrange(256), int(rng.random() < 0.1)) for _ in range(4)]
+    return syms
+
+def remove(dut, syms, ready, rng):
+    """Stream `syms` through `dut` with `source.ready` asserted with probability `ready`."""
+    words = [syms[i:i + 4] for i in range(0, len(syms), 4)]
+    out   = []
+    def generator():
+        i = 0
+        while i < len(words) or (yield dut.source.valid):
+            if i < len(words):
+                yield dut.sink.valid.eq(1)
+                yield dut.sink.data.eq(sum(b << 8*j for j, (b, k) in enumerate(words[i])))
+                yield dut.sink.ctrl.eq(sum(k << j for j, (b, k) in enumerate(words[i])))
+            else:
+                yield dut.sink.valid.eq(0)
+            yield dut.source.ready.eq(rng.random() < ready)
+            yield
+            if i < len(words) and (yield dut.sink.ready):
+                i += 1
+            if (yield dut.source.valid) and (yield dut.source.ready):
+                data = (yield dut.source.data)
+                ctrl = (yield dut.source.ctrl)
+                out.extend(((data >> 8*j) & 0xff, (ctrl >> j) & 1) for j in range(4))
+    run_simulation(dut, generator())
+    return out
+
+# Test RX SKP Remover ------------------------------------------------------------------------------
+
+class TestRXSKPRemover(unittest.TestCase):
+    def check(self, ready, seed):
+        rng  = random.Random(seed)
+        syms = symbols(rng, 2000)
+        out  = remove(RXSKPRemover(), syms, ready, rng)
+        expected = [s for s in syms if s != (SKP, 1)]
+        # Whole words are output, the last bytes can stay in the Shift Register.
+        self.assertEqual(out, expected[:len(out)])
+        self.assertGreater(len(out), len(expected) - 4)
+
+    def test_no_backpressure(self):
+        self.check(ready=1.0, seed=0)
+
+    def test_backpressure(self):
+        for seed in range(4):
+            self.check(ready=0.7, seed=seed)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+import argparse
+
+from pcie_analyzer.software.capture import capture_formats
+from pcie_analyzer.software.archive import archive_codecs, compress, ArchiveReader
+
+parser = argparse.ArgumentParser(description="Compress/extract PCIe captures (seekable archives)")
+subparsers = parser.add_subparsers(dest="command")
+
+compress_parser = subparsers.add_parser("compress", help="Compress a capture")
+compress_parser.add_argument("filename",                                help="Capture file")
+compress_parser.add_argument("archive",                                 help="Archive file")
+compress_parser.add_argument("--format",     default="netv2",           help="Capture format ({} or layout.json:recorder)".format(", ".join(capture_formats)))
+compress_parser.add_argument("--codec",      default="zlib",            help="Codec ({})".format(", ".join(archive_codecs)))
+compress_parser.add_argument("--level",      default=None, type=int,    help="Compression level")
+compress_parser.add_argument("--chunk-size", default=1024*1024, type=int, help="Chunk size in bytes")
+compress_parser.add_argument("--jobs",       default=None, type=int,    help="Compression processes (default=CPUs)")
+compress_parser.add_argument("--no-index",   action="store_true",       help="Don't build the sidecar packet index")
+
+extract_parser = subparsers.add_parser("extract", help="Extract a capture (or a range)")
+extract_parser.add_argument("archive",                                  help="Archive file")
+extract_parser.add_argument("filename",                                 help="Capture file")
+extract_parser.add_argument("--offset",      default=0,    type=int,    help="Start offset in bytes")
+extract_parser.add_argument("--length",      default=None, type=int,    help="Length in bytes (default=all)")
+
+info_parser = subparsers.add_parser("info", help="Show archive information")
+info_parser.add_argument("archive",                                     help="Archive file")
+
+packet_parser = subparsers.add_parser("packet", help="Show packets from the sidecar index")
+packet_parser.add_argument("archive",                                   help="Archive file")
+packet_parser.add_argument("first",          default=0,    type=int,    help="First packet")
+packet_parser.add_argument("--count",        default=1,    type=int,    help="Number of packets")
+
+args = parser.parse_args()
+
+# # #
+
+if args.command == "compress":
+    start = time.time()
+    compress(args.filename, args.archive, args.format, args.codec, args.level, args.chunk_size,
+        args.jobs, index=not args.no_index)
+    print("Compressed in {:.1f}s".format(time.time() - start))
+
+elif args.command == "extract":
+    archive = ArchiveReader(args.archive)
+    length  = archive.size - args.offset if args.length is None else args.length
+    with open(args.filename, "wb") as f:
+        for offset in range(args.offset, args.offset + length, archive.chunk_size):
+            f.write(archive.read(offset, min(archive.chunk_size, args.offset + length - offset)))
+
+elif args.command == "info":
+    archive = ArchiveReader(args.archive)
+    compressed = int(archive.table["size"].sum())
+    print("Format:      {}".format(archive.format))
+    print("Codec:       {} (level {})".format(archive.codec, "default" if archive.level is None else archive.level))
+    print("Chunks:      {:d} x {:d} bytes".format(len(archive.table), archive.chunk_size))
+    print("Size:        {:d} bytes ({:d} symbols)".format(archive.size, archive.symbols))
+    print("Compressed:  {:d} bytes (ratio {:.2f})".format(compressed, archive.size/max(compressed, 1)))
+    print("Packets:     {}".format("n/a" if archive.index is None else len(archive.index)))
+
+elif args.command == "packet":
+    archive = ArchiveReader(args.archive)
+    if archive.index is None:
+        print("No sidecar packet index")
+        sys.exit(1)
+    for packet in archive.index[args.first:args.first + args.count]:
+        print("@{:d} {} ({:d}): {}".format(
+            int(packet["offset"]),
+            ["TLP", "DLLP"][packet["type"]],
+            int(packet["length"]),
+            archive.read_packet(packet).tobytes().hex()))
+
+else:
+    parser.print_help()
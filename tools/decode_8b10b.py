@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+import time
+import argparse
+
+import numpy as np
+
+from pcie_analyzer.software.code_8b10b import Decoder, unpack_raw20
+
+parser = argparse.ArgumentParser(description="Decode a raw 20-bit GTP capture (8b/10b)")
+parser.add_argument("filename",                                 help="Raw capture file (32-bit words)")
+parser.add_argument("--chunk-size", default=64*1024*1024, type=int, help="Chunk size in bytes")
+parser.add_argument("--errors",     default=16,           type=int, help="Number of errors to display")
+args = parser.parse_args()
+
+# # #
+
+decoder = Decoder()
+symbols = 0
+invalid = 0
+disparity_errors = 0
+errors  = []
+start   = time.time()
+with open(args.filename, "rb") as f:
+    while True:
+        datas = f.read(args.chunk_size - args.chunk_size%4)
+        if len(datas) < 4:
+            break
+        raw = unpack_raw20(datas[:len(datas) - len(datas)%4])
+        data, ctrl, inv, derr = decoder.decode(raw)
+        for i in np.flatnonzero(inv | derr)[:max(args.errors - len(errors), 0)]:
+            errors.append((symbols + i, raw[i], "invalid" if inv[i] else "disparity"))
+        symbols          += len(raw)
+        invalid          += int(inv.sum())
+        disparity_errors += int(derr.sum())
+duration = time.time() - start
+
+print("Symbols:          {:d}".format(symbols))
+print("Invalid codes:    {:d}".format(invalid))
+print("Disparity errors: {:d}".format(disparity_errors))
+for n, code, kind in errors:
+    print("  symbol {:d}: 0b{:010b} ({})".format(n, code, kind))
+print("Decoded at {:.1f} MB/s".format(2*symbols/duration/1e6 if duration else 0))
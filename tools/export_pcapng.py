@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import argparse
+
+from pcie_analyzer.software.capture import CaptureReader, capture_formats, capture_filtered, symbol_periods
+from pcie_analyzer.software.pcapng import PcapngWriter, LINKTYPE_USER0, export
+from pcie_analyzer.software.profiling import add_profiling_arguments, ProfilingSession
+
+parser = argparse.ArgumentParser(description="Export a PCIe capture to pcapng (Wireshark)")
+parser.add_argument("filename",                                   help="Capture file")
+parser.add_argument("output",                                     help="pcapng file")
+parser.add_argument("--format",     default="netv2",              help="Capture format ({} or layout.json:recorder)".format(", ".join(capture_formats)))
+parser.add_argument("--rate",       default="gen1",               help="Link rate (gen1 or gen2)")
+parser.add_argument("--linktype",   default=LINKTYPE_USER0, type=int, help="pcapng link type")
+parser.add_argument("--start-time", default=None,  type=float,    help="Capture start time (Unix time, default: file mtime)")
+parser.add_argument("--crc",        action="store_true",          help="Check and export LCRC/ECRC/CRC status")
+parser.add_argument("--filtered",   action="store_true",          help="Capture recorded after the gateware packet filter")
+parser.add_argument("--chunk-size", default=4*1024*1024,  type=int, help="Read chunk size in bytes")
+parser.add_argument("--flush-size", default=32*1024*1024, type=int, help="Write batch size in bytes")
+parser.add_argument("--jobs",       default=None, type=int,       help="Export processes (default: CPUs, 0: this process only)")
+parser.add_argument("--cache-dir",  default=None,                 help="Share decoded chunks through this cache directory (ex: /dev/shm/pcie_analyzer)")
+parser.add_argument("--cache-size", default=4096, type=int,       help="Cache size limit in MB")
+add_profiling_arguments(parser)
+args = parser.parse_args()
+
+# # #
+
+start_time = args.start_time if args.start_time is not None else os.path.getmtime(args.filename)
+session = ProfilingSession(args)
+reader = CaptureReader(args.filename, args.format, args.chunk_size, session.profiler)
+cache  = None
+if args.cache_dir is not None:
+    from pcie_analyzer.software.chunk_cache import ChunkCache
+    cache = ChunkCache(args.cache_dir, args.cache_size*1024*1024)
+writer = PcapngWriter(args.output, args.flush_size)
+interface = writer.add_interface(os.path.basename(args.filename), args.linktype)
+
+start = time.time()
+stats = export(reader, writer, interface,
+    symbol_period = symbol_periods[args.rate],
+    start_time    = int(start_time*1e9),
+    check_crc     = args.crc,
+    filtered      = args.filtered or capture_filtered(reader.format),
+    cache         = cache,
+    jobs          = args.jobs)
+with session.profiler.stage("close"):
+    writer.close()
+duration = time.time() - start
+session.close()
+
+print("Symbols:              {:d}".format(stats["symbols"]))
+print("Packets:              {:d}".format(stats["packets"]))
+print("Unsynchronized:       {:d}".format(stats["unsynchronized"]))
+print("Dropped symbols:      {:d}".format(stats["dropped_symbols"]))
+if cache is not None:
+    print("Cached chunks:        {:d}/{:d}".format(cache.hits, cache.hits + cache.misses))
+print("Exported at {:.1f} MB/s".format(reader.size/duration/1e6 if duration else 0))
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import json
+import time
+import argparse
+
+from pcie_analyzer.common import SKP_INTERVAL
+from pcie_analyzer.software.capture import capture_formats, capture_format
+from pcie_analyzer.software.traffic import (TrafficGenerator, CaptureWriter, default_mix, parse_mix,
+    error_kinds)
+
+parser = argparse.ArgumentParser(description="Generate a synthetic PCIe capture (test/benchmark data)")
+parser.add_argument("filename",                                     help="Capture file")
+parser.add_argument("--size",         default=64,   type=float,     help="Capture size in MB")
+parser.add_argument("--format",       default="netv2",              help="Capture format ({} or layout.json:recorder)".format(", ".join(capture_formats)))
+parser.add_argument("--seed",         default=0,    type=int,       help="Random seed")
+parser.add_argument("--mix",          default=None,                 help="Packet mix: kind=weight,... (default: {})".format(
+    ",".join("{}={}".format(k, v) for k, v in default_mix.items())))
+parser.add_argument("--idle-ratio",   default=0.2,  type=float,     help="Ratio of Logical Idle between packets")
+parser.add_argument("--max-payload",  default=256,  type=int,       help="Max TLP payload size in bytes")
+parser.add_argument("--max-read",     default=512,  type=int,       help="Max read request size in bytes")
+parser.add_argument("--ecrc-ratio",   default=0.0,  type=float,     help="Ratio of TLPs with ECRC")
+parser.add_argument("--skp-interval", default=SKP_INTERVAL, type=int, help="SKP Ordered Set interval in symbols (0: none)")
+parser.add_argument("--error",        action="append", default=[],  help="Error rate per packet: kind=rate ({})".format(", ".join(error_kinds)))
+parser.add_argument("--json",         default=None,                 help="Dump generated traffic statistics to JSON file")
+args = parser.parse_args()
+
+# # #
+
+generator = TrafficGenerator(
+    seed         = args.seed,
+    mix          = default_mix if args.mix is None else parse_mix(args.mix),
+    idle_ratio   = args.idle_ratio,
+    max_payload  = args.max_payload,
+    max_read     = args.max_read,
+    ecrc_ratio   = args.ecrc_ratio,
+    skp_interval = args.skp_interval or None,
+    errors       = {k: float(v) for k, v in (e.split("=") for e in args.error)})
+writer = CaptureWriter(args.filename, capture_format(args.format), generator)
+
+start = time.time()
+writer.write_size(int(args.size*1e6))
+writer.close()
+duration = time.time() - start
+
+stats = generator.stats
+print("Symbols:              {:d}".format(stats["symbols"]))
+print("TLPs:                 {:d} ({})".format(stats["tlps"], ", ".join(
+    "{}: {:d}".format(k[4:], v) for k, v in stats.items() if k.startswith("tlp_") and k != "tlp_bytes" and v)))
+print("DLLPs:                {:d}".format(stats["dllps"]))
+print("SKP Ordered Sets:     {:d}".format(stats["skps"]))
+print("Errors:               {}".format(", ".join(
+    "{}: {:d}".format(k[6:], v) for k, v in stats.items() if k.startswith("error_")) or "none"))
+print("Generated {:d} bytes at {:.1f} MB/s".format(writer.size, writer.size/duration/1e6 if duration else 0))
+
+if args.json is not None:
+    with open(args.json, "w") as f:
+        json.dump({"format": args.format, "size": writer.size, "stats": stats,
+            "crc": generator.crc_totals()}, f, indent=4)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+import time
+import argparse
+
+from litex import RemoteClient
+
+parser = argparse.ArgumentParser(description="Read the request/completion latency histograms of a PCIe analyzer board")
+parser.add_argument("--csr-csv",    default="csr.csv",        help="CSR configuration file")
+parser.add_argument("--port",       default=1234, type=int,   help="litex_server port")
+parser.add_argument("--name",       default="latency",        help="Latency monitor name")
+parser.add_argument("--period",     default=1.0,  type=float, help="Snapshot period in seconds")
+parser.add_argument("--count",      default=1,    type=int,   help="Number of snapshots (0: endless)")
+parser.add_argument("--shift",      default=None, type=int,   help="Histogram bin width (2^shift cycles)")
+parser.add_argument("--timeout",    default=None, type=float, help="Free Requests without Completion after this time (us, 0: never)")
+parser.add_argument("--directions", default=None,             help="Track Requests of these GTPs (ex: 0,1)")
+args = parser.parse_args()
+
+wb = RemoteClient(port=args.port, csr_csv=args.csr_csv)
+wb.open()
+
+# # #
+
+def reg(name):
+    return getattr(wb.regs, args.name + "_" + name)
+
+sys_clk_freq = getattr(wb.constants, "config_clock_frequency", 100e6)
+nbins        = getattr(wb.constants, args.name + "_nbins", 64)
+cycle        = 1e9/sys_clk_freq # ns.
+
+if args.shift is not None:
+    reg("shift").write(args.shift)
+if args.timeout is not None:
+    reg("timeout").write(int(args.timeout*1e3/cycle))
+if args.directions is not None:
+    reg("directions").write(sum(1 << int(d) for d in args.directions.split(",")))
+
+def snapshot():
+    reg("snapshot").write(1)
+
+def histogram():
+    values = []
+    for i in range(nbins):
+        reg("index").write(i)
+        values.append(reg("value").read())
+    return values
+
+counters = ["requests", "completions", "unexpected", "replaced", "overflows", "timeouts"]
+
+snapshot() # Restart measurements.
+last = {name: reg(name).read() for name in counters}
+n    = 0
+while args.count == 0 or n < args.count:
+    time.sleep(args.period)
+    snapshot()
+    bin_width = (1 << reg("shift").read())*cycle
+    count     = reg("latency_count").read()
+    print("Latency ({:d} Requests, {:d} outstanding, {:d} max):".format(
+        count, reg("outstanding").read(), reg("outstanding_max").read()))
+    if count:
+        print("  min {:.0f}ns, mean {:.0f}ns, max {:.0f}ns".format(
+            reg("latency_min").read()*cycle,
+            reg("latency_sum").read()/count*cycle,
+            reg("latency_max").read()*cycle))
+    for i, value in enumerate(histogram()):
+        if value:
+            low  = i*bin_width
+            high = "+" if i == nbins - 1 else "-{:.0f}".format(low + bin_width)
+            print("  {:8.0f}{:8s} ns: {:d}".format(low, high, value))
+    values = {name: reg(name).read() for name in counters}
+    print("  " + ", ".join("{}: {:d}".format(name, (values[name] - last[name]) & 0xffffffff)
+        for name in counters))
+    last = values
+    n   += 1
+
+# # #
+
+wb.close()
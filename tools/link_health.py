@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import time
+import argparse
+
+from litex import RemoteClient
+
+parser = argparse.ArgumentParser(description="Read the link health histograms of a PCIe analyzer board")
+parser.add_argument("--csr-csv", default="csr.csv",           help="CSR configuration file")
+parser.add_argument("--port",    default=1234, type=int,      help="litex_server port")
+parser.add_argument("--gtp",     default=0,    type=int,      help="GTP (0 or 1)")
+parser.add_argument("--period",  default=1.0,  type=float,    help="Snapshot period in seconds")
+args = parser.parse_args()
+
+wb = RemoteClient(port=args.port, csr_csv=args.csr_csv)
+wb.open()
+
+# # #
+
+class LinkHealth:
+    def __init__(self, name):
+        self.name      = name
+        self.nbins     = getattr(wb.constants, name + "_nbins", 64)
+        self.bin_width = getattr(wb.constants, name + "_bin_width", 16)
+        for reg in ["snapshot", "bank", "select", "index", "value"]:
+            setattr(self, "_" + reg, getattr(wb.regs, name + "_" + reg))
+
+    def snapshot(self):
+        bank = self._bank.read()
+        self._snapshot.write(1)
+        while self._bank.read() == bank:
+            pass
+
+    def histogram(self, select, nbins):
+        self._select.write(select)
+        values = []
+        for i in range(nbins):
+            self._index.write(i)
+            values.append(self._value.read())
+        return values
+
+link_health = LinkHealth("gtp{}_link_health".format(args.gtp))
+link_health.snapshot() # Restart counting.
+time.sleep(args.period)
+link_health.snapshot()
+
+for select, name in enumerate(["SKP Ordered Set interval (nominal: 354 symbols)", "COM resync interval"]):
+    values = link_health.histogram(select, link_health.nbins)
+    print("{} ({:d} events):".format(name, sum(values)))
+    for i, value in enumerate(values):
+        if value:
+            low  = i*link_health.bin_width
+            high = "+" if i == link_health.nbins - 1 else "-{:d}".format(low + link_health.bin_width - 1)
+            print("  {:5d}{:6s} symbols: {:d}".format(low, high, value))
+
+status_names = {
+    0b001: "SKPs removed",
+    0b010: "SKPs added",
+    0b101: "Underflow",
+    0b110: "Overflow",
+}
+print("Elastic buffer status (cycles):")
+for status, value in enumerate(link_health.histogram(2, 8)):
+    if status:
+        print("  {:12s}: {:d}".format(status_names.get(status, "0b{:03b}".format(status)), value))
+
+# # #
+
+wb.close()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+import time
+import argparse
+
+from pcie_analyzer.software.capture import capture_formats, symbol_periods
+from pcie_analyzer.software.live import LiveDecoder, LiveView, follow, live
+from pcie_analyzer.software.profiling import add_profiling_arguments, ProfilingSession
+
+parser = argparse.ArgumentParser(description="Live decode of a PCIe capture being received")
+parser.add_argument("filename",                                   help="Capture file (followed as it grows, or uploaded to with --board)")
+parser.add_argument("--board",      default=None,                 help="Upload from a board: host:port:csr.csv")
+parser.add_argument("--recorder",   default="rx_dma_recorder",    help="Recorder to upload from (with --board)")
+parser.add_argument("--length",     default=1024*1024, type=int,  help="Capture length in bytes (with --board)")
+parser.add_argument("--format",     default="netv2",              help="Capture format ({} or layout.json:recorder)".format(", ".join(capture_formats)))
+parser.add_argument("--rate",       default="gen1",               help="Link rate (gen1 or gen2)")
+parser.add_argument("--idle",       default=2.0, type=float,      help="Stop following the file after N seconds without data")
+parser.add_argument("--latency",    default=0.1, type=float,      help="Maximum decode latency in seconds")
+parser.add_argument("--queue-size", default=16,  type=int,        help="Maximum pending display updates")
+add_profiling_arguments(parser)
+args = parser.parse_args()
+
+# # #
+
+session = ProfilingSession(args)
+decoder = LiveDecoder(args.format, symbol_periods[args.rate], latency=args.latency, profiler=session.profiler)
+view    = LiveView(queue_size=args.queue_size, profiler=session.profiler)
+view.start()
+
+start = time.time()
+if args.board is not None:
+    from pcie_analyzer.software.orchestrator import Board
+    host, port, csr_csv = args.board.split(":")
+    board = Board("board", host, int(port), csr_csv, [args.recorder], args.format, session.profiler)
+    board.open()
+    board.configure(args.length)
+    board.reg(args.recorder, "start").write(1)
+    while not board.done():
+        time.sleep(0.01)
+    board.upload(args.recorder, args.length, args.filename,
+        callback=lambda datas: view.publish(decoder.feed(datas)))
+    view.publish(decoder.flush())
+    board.close()
+    stats = decoder.stats
+else:
+    stats = live(follow(args.filename, idle=args.idle), decoder, view)
+view.stop()
+session.close()
+
+print("Symbols: {:d}, packets: {:d}, TLPs: {:d} ({:d} not displayed), {:.1f}s".format(
+    stats["symbols"], stats["packets"], view.published, view.dropped, time.time() - start))
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import time
+import argparse
+
+from litex import RemoteClient
+
+from pcie_analyzer.ltssm import ltssm_state_names
+
+parser = argparse.ArgumentParser(description="Observe the LTSSM of a PCIe link and arm the recorder on state transitions")
+parser.add_argument("--csr-csv", default="csr.csv",          help="CSR configuration file")
+parser.add_argument("--port",    default=1234, type=int,     help="litex_server port")
+parser.add_argument("--gtp",     default=0,    type=int,     help="GTP (0 or 1)")
+parser.add_argument("--arm",     default=None,               help="Only record after entering one of these states (ex: L0,Recovery)")
+parser.add_argument("--disarm",  action="store_true",        help="Record without waiting for a state transition")
+parser.add_argument("--watch",   default=0.0,  type=float,   help="Print state change events for N seconds")
+args = parser.parse_args()
+
+wb = RemoteClient(port=args.port, csr_csv=args.csr_csv)
+wb.open()
+
+# # #
+
+def reg(name):
+    return getattr(wb.regs, "gtp{}_ltssm_{}".format(args.gtp, name))
+
+def state_name(state):
+    return ltssm_state_names.get(state, str(state))
+
+def print_events():
+    while reg("event_valid").read():
+        t    = reg("event_time").read()
+        data = reg("event_data").read()
+        reg("event_next").write(1)
+        print("{:10d}: {:>14s} -> {:<14s} link {:3d} lane {:3d} rate 0x{:02x}".format(t,
+            state_name((data >> 0) & 0x7), state_name((data >> 4) & 0x7),
+            (data >> 8) & 0xff, (data >> 16) & 0xff, (data >> 24) & 0xff))
+
+if args.arm is not None:
+    states = {v: k for k, v in ltssm_state_names.items()}
+    mask   = sum(1 << states[name] for name in args.arm.split(","))
+    reg("trigger_mask").write(mask)
+    reg("trigger_enable").write(1)
+if args.disarm:
+    reg("trigger_enable").write(0)
+
+print("State:     {}".format(state_name(reg("state").read())))
+print("Link/Lane: {:d}/{:d}".format(reg("link").read(), reg("lane").read()))
+print("N_FTS:     {:d}".format(reg("n_fts").read()))
+print("Rate:      0x{:02x}".format(reg("rate").read()))
+print("Control:   0x{:02x}".format(reg("control").read()))
+for name in ["ts1", "ts2", "eios", "eieos", "fts", "skp"]:
+    print("{:10s} {:d}".format(name.upper() + ":", reg(name + "_count").read()))
+print("Triggered: {:d}".format(reg("triggered").read()))
+print_events()
+deadline = time.time() + args.watch
+while time.time() < deadline:
+    print_events()
+    time.sleep(0.01)
+dropped = reg("event_dropped").read()
+if dropped:
+    print("{:d} events dropped".format(dropped))
+
+# # #
+
+wb.close()
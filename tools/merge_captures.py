@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import argparse
+
+from pcie_analyzer.software.capture import CaptureReader, capture_formats, symbol_periods
+from pcie_analyzer.software.pcapng import PcapngWriter, LINKTYPE_USER0
+from pcie_analyzer.software.merge import ClockOffset, capture_stream, merge
+
+parser = argparse.ArgumentParser(description="Merge PCIe captures (directions, lanes, boards) to one pcapng timeline")
+parser.add_argument("filenames",    nargs="+",                    help="Capture files")
+parser.add_argument("--output",     required=True,                help="pcapng file")
+parser.add_argument("--format",     default="netv2",              help="Capture format ({} or layout.json:recorder)".format(", ".join(capture_formats)))
+parser.add_argument("--rate",       default="gen1",               help="Link rate (gen1 or gen2)")
+parser.add_argument("--offset",     action="append", default=[],  help="Clock offset of a capture: index=ns (ex: 1=-120)")
+parser.add_argument("--drift",      action="append", default=[],  help="Clock drift of a capture: index=ppm (ex: 1=2.5)")
+parser.add_argument("--chunk-size", default=4*1024*1024, type=int, help="Read chunk size in bytes")
+args = parser.parse_args()
+
+# # #
+
+offsets = {int(k): int(v)   for k, v in (o.split("=") for o in args.offset)}
+drifts  = {int(k): float(v) for k, v in (d.split("=") for d in args.drift)}
+
+writer  = PcapngWriter(args.output)
+streams = []
+for i, filename in enumerate(args.filenames):
+    start_time = int(os.path.getmtime(filename)*1e9)
+    writer.add_interface(os.path.basename(filename), LINKTYPE_USER0)
+    streams.append(capture_stream(
+        reader        = CaptureReader(filename, args.format, args.chunk_size),
+        symbol_period = symbol_periods[args.rate],
+        start_time    = start_time,
+        clock         = ClockOffset(offsets.get(i, 0), drifts.get(i, 0.0), start_time)))
+
+start   = time.time()
+packets = 0
+for stream, data, ctrl, p, times in merge(streams):
+    writer.write_packets(data, p, times.astype("u8"), interface=stream)
+    packets += len(p)
+writer.close()
+
+print("Merged {:d} packets in {:.1f}s".format(packets, time.time() - start))
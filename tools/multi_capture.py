@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import tempfile
+import argparse
+
+from pcie_analyzer.software.orchestrator import Board, Orchestrator
+
+parser = argparse.ArgumentParser(description="Capture on several PCIe analyzer boards to one session directory")
+parser.add_argument("--board",      action="append", default=[],   help="Board: name=host:port:csr.csv[:format] (ex: up=192.168.1.50:1234:up.csv)")
+parser.add_argument("--recorder",   action="append", default=[],   help="Recorder to arm on each board (default: rx_dma_recorder)")
+parser.add_argument("--length",     default=64*1024, type=int,     help="Capture length per recorder in bytes")
+parser.add_argument("--output-dir", required=True,                 help="Session directory")
+parser.add_argument("--timeout",    default=10.0, type=float,      help="Capture timeout in seconds")
+parser.add_argument("--no-verify",  action="store_true",          help="Don't check the uploads against the gateware DRAM CRCs")
+parser.add_argument("--standin",    default=0, type=int,           help="Capture on N local stand-in boards (for testing)")
+parser.add_argument("--standin-read-errors", default=0.0, type=float, help="Probability of corrupted stand-in read words (for testing)")
+args = parser.parse_args()
+
+# # #
+
+recorders = args.recorder or ["rx_dma_recorder"]
+boards    = []
+standins  = []
+for board in args.board:
+    name, location = board.split("=")
+    host, port, csr_csv, *format = location.split(":")
+    boards.append(Board(name, host, int(port), csr_csv, recorders, *format))
+if args.standin:
+    from pcie_analyzer.software.standin import StandInBoard
+    tmp = tempfile.mkdtemp()
+    for i in range(args.standin):
+        csr_csv = os.path.join(tmp, "standin{}.csv".format(i))
+        standin = StandInBoard(csr_csv, recorders=recorders, seed=i,
+            read_error_rate=args.standin_read_errors)
+        standins.append(standin)
+        boards.append(Board("standin{}".format(i), "localhost", standin.port, csr_csv, recorders))
+
+orchestrator = Orchestrator(boards)
+orchestrator.open()
+start    = time.time()
+manifest = orchestrator.capture(args.output_dir, args.length, args.timeout,
+    verify=False if args.no_verify else None)
+orchestrator.close()
+for standin in standins:
+    standin.close()
+
+print("Captured {} boards in {:.1f}s, arm skew: {:d}ns (+/-{:d}ns)".format(
+    len(boards), time.time() - start, int(manifest["skew"]["skew_ns"]), int(manifest["skew"]["uncertainty_ns"])))
+for board in manifest["boards"]:
+    for capture in board["captures"]:
+        refetched = capture["refetched_blocks"]
+        print("{:>12s} {:>16s}: {} ({:d} bytes, crc32 0x{:08x}{}), clock offset {:d}ns".format(
+            board["name"], capture["recorder"], capture["file"], capture["size"], capture["crc32"],
+            "" if refetched is None else ", verified, {:d} blocks re-fetched".format(len(refetched)),
+            int(board["clock_offset_ns"])))
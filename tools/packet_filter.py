@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+import argparse
+
+from litex import RemoteClient
+
+parser = argparse.ArgumentParser(description="Configure the packet filter in front of the recorder",
+    epilog="Rule: ACTION[,KIND][,type=V[/M]][,rid=V[/M]][,tag=V[/M]][,addr=MIN-MAX] with ACTION keep/drop and "
+           "KIND tlp/dllp (both by default), ex: keep,tlp,rid=0x0100,addr=0x1000-0x1fff")
+parser.add_argument("--csr-csv", default="csr.csv",      help="CSR configuration file")
+parser.add_argument("--port",    default=1234, type=int, help="litex_server port")
+parser.add_argument("--name",    default="rx_filter",    help="Packet filter name")
+parser.add_argument("--rule",    action="append",        help="Filter rule (first matching rule applies)")
+parser.add_argument("--default", default="keep",         help="Action when no rule matches (keep or drop)")
+parser.add_argument("--disable", action="store_true",    help="Disable filtering (keep all packets)")
+args = parser.parse_args()
+
+wb = RemoteClient(port=args.port, csr_csv=args.csr_csv)
+wb.open()
+
+# # #
+
+def reg(name):
+    return getattr(wb.regs, args.name + "_" + name)
+
+def value_mask(s, width):
+    value, _, mask = s.partition("/")
+    return int(value, 0), int(mask, 0) if mask else (1 << width) - 1
+
+def parse_rule(rule):
+    fields  = rule.split(",")
+    action  = {"keep": 1, "drop": 0}[fields[0]]
+    kinds   = [f for f in fields[1:] if f in ["tlp", "dllp"]] or ["tlp", "dllp"]
+    r = {"type": (0, 0), "rid": (0, 0), "tag": (0, 0), "addr": None}
+    for f in fields[1:]:
+        if f in kinds:
+            continue
+        name, _, value = f.partition("=")
+        if name == "addr":
+            low, _, high = value.partition("-")
+            r["addr"] = (int(low, 0), int(high, 0))
+        else:
+            r[name] = value_mask(value, {"type": 8, "rid": 16, "tag": 8}[name])
+    control = (1 << 0) | (action << 1) | (("tlp" in kinds) << 2) | (("dllp" in kinds) << 3)
+    control |= (r["addr"] is not None) << 4
+    return control, r
+
+nrules = getattr(wb.constants, args.name + "_nrules", 4)
+rules  = args.rule or []
+if len(rules) > nrules:
+    raise ValueError("{:d} rules max".format(nrules))
+
+reg("enable").write(0)
+for i in range(nrules):
+    reg("rule_index").write(i)
+    if i < len(rules):
+        control, r = parse_rule(rules[i])
+        reg("rule_control").write(control)
+        reg("rule_type").write(r["type"][0] | (r["type"][1] << 8))
+        reg("rule_requester_id").write(r["rid"][0] | (r["rid"][1] << 16))
+        reg("rule_tag").write(r["tag"][0] | (r["tag"][1] << 8))
+        low, high = r["addr"] if r["addr"] is not None else (0, 0)
+        reg("rule_address_min").write(low)
+        reg("rule_address_max").write(high)
+    else:
+        reg("rule_control").write(0)
+    reg("rule_write").write(1)
+reg("default").write({"keep": 1, "drop": 0}[args.default])
+reg("enable").write(0 if args.disable else 1)
+
+print("Kept:     {:d}".format(reg("kept").read()))
+print("Filtered: {:d}".format(reg("filtered").read()))
+
+# # #
+
+wb.close()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import argparse
+
+from litex import RemoteClient
+
+parser = argparse.ArgumentParser(description="Replay a plain (descrambled, SKP-free) capture on GTP0 TX")
+parser.add_argument("filename",                          help="Capture file (recorder layout)")
+parser.add_argument("--base", default="0x00000000",      help="DRAM offset of the capture")
+parser.add_argument("--loop", action="store_true",       help="Replay the capture continuously")
+args = parser.parse_args()
+
+wb = RemoteClient()
+wb.open()
+
+# # #
+
+class Replay:
+    def __init__(self, name):
+        self._base       = getattr(wb.regs, name + "_dma_base")
+        self._length     = getattr(wb.regs, name + "_dma_length")
+        self._start      = getattr(wb.regs, name + "_dma_start")
+        self._done       = getattr(wb.regs, name + "_dma_done")
+        self._loop       = getattr(wb.regs, name + "_dma_loop")
+        self._underflows = getattr(wb.regs, name + "_underflows")
+
+    def load(self, base, datas):
+        print("Load of {} bytes to @0x{:08x}...".format(4*len(datas), base))
+        for i, data in enumerate(datas):
+            wb.write(wb.mems.main_ram.base + base + 4*i, data)
+
+    def replay(self, base, length, loop=False):
+        print("Replay of {} bytes from @0x{:08x}{}...".format(length, base, " (loop)" if loop else ""))
+        self._base.write(base)
+        self._length.write(length)
+        self._loop.write(int(loop))
+        self._start.write(1)
+        if not loop:
+            print("Waiting...")
+            while self._done.read() != 1:
+                pass
+            print("Done, {} underflows...".format(self._underflows.read()))
+
+with open(args.filename, "rb") as f:
+    capture = f.read()
+datas = [int.from_bytes(capture[i:i+4], "little") for i in range(0, len(capture), 4)]
+
+base   = int(args.base, 0)
+replay = Replay("replay")
+replay.load(base, datas)
+replay.replay(base, 4*len(datas), loop=args.loop)
+
+# # #
+
+wb.close()